@@ -0,0 +1,187 @@
+import os
+import sys
+import json
+import queue
+import random
+import threading
+import time
+
+COMMON = '{host} - - [{time}] "{request_line}" {status} {bytes}'
+COMBINED = COMMON + ' "{referer}" "{user_agent}"'
+FORMATS = {'common': COMMON, 'combined': COMBINED, 'json': None}
+OVERFLOW_POLICIES = ('drop', 'sample')
+TIME_FORMAT = '%d/%b/%Y:%H:%M:%S %z'
+
+
+def _quote(value):
+    """Escapes a field written between double quotes"""
+    return (value.replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+class AccessLog:
+    """Asynchronous access log.
+
+    Request handlers only put a tuple of raw fields into a bounded queue,
+    a background thread formats and writes them in batches. Requests are
+    never blocked by the log: once the queue is full records are dropped,
+    with the "sample" policy only a share of them is kept as soon as the
+    queue is half full.
+
+    "fmt" is "common", "combined", "json" or a str.format template over the
+    fields host, time, method, target, version, request_line, status,
+    bytes, duration_ms, referer and user_agent. A file log is rotated to
+    "path.1", "path.2", ... once it exceeds "max_bytes".
+
+    Attributes
+    ----------
+    path - Log file, None for stdout
+    fmt - Format of the records
+    max_queue - Max number of records waiting to be written
+    batch_size - Max number of records written at once
+    flush_interval - Max seconds a record waits for its batch
+    max_bytes - Size of the file that triggers a rotation, None to never
+                rotate
+    backups - Number of rotated files kept
+    overflow - "drop" or "sample"
+    sample_rate - Share of the records kept by "sample" under pressure
+    written - Number of records written
+    dropped - Number of records dropped
+
+    Methods
+    ----------
+    log - Queues the record of a served request
+    flush - Waits until the queued records are written
+    close - Writes the queued records and stops the writer"""
+
+    def __init__(self, path=None, fmt='common', max_queue=10000,
+                 batch_size=256, flush_interval=0.5, max_bytes=None,
+                 backups=5, overflow='drop', sample_rate=0.1):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f'overflow must be one of {OVERFLOW_POLICIES}')
+        self.path: str = path
+        self.fmt: str = FORMATS.get(fmt, fmt)
+        self.json: bool = fmt == 'json'
+        self.max_queue: int = max_queue
+        self.batch_size: int = batch_size
+        self.flush_interval: float = flush_interval
+        self.max_bytes: int = max_bytes
+        self.backups: int = backups
+        self.overflow: str = overflow
+        self.sample_rate: float = sample_rate
+        self.written: int = 0
+        self.dropped: int = 0
+        self._queue = queue.Queue(max_queue)
+        self._file = None
+        self._size = 0
+        self._writer = None
+        self._lock = threading.Lock()
+
+    def log(self, address, request, status, sent, seconds):
+        """Queues a record, never blocks"""
+        if (self.overflow == 'sample'
+                and self._queue.qsize() * 2 >= self.max_queue
+                and random.random() >= self.sample_rate):
+            self.dropped += 1
+            return
+        headers = request.get_headers()
+        record = (time.time(), address, request.method, request.target,
+                  request.version, status, sent, seconds,
+                  headers.get('Referer'), headers.get('User-Agent'))
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self._writer is None:
+            self._start()
+
+    def flush(self):
+        self._queue.join()
+
+    def close(self):
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._queue.put(None)
+            writer.join()
+
+    def _start(self):
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run,
+                                                daemon=True)
+                self._writer.start()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = [record for record in batch if record is not None]
+            stop = len(records) < len(batch)
+            try:
+                self._write(''.join(self.format(record) + '\n'
+                                    for record in records))
+                self.written += len(records)
+            except Exception:
+                self.dropped += len(records)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def format(self, record):
+        (timestamp, address, method, target, version, status, sent, seconds,
+         referer, user_agent) = record
+        host = address[0] if isinstance(address, tuple) else address
+        if self.json:
+            return json.dumps({
+                'time': timestamp, 'host': host, 'method': method,
+                'target': target, 'version': version, 'status': status,
+                'bytes': sent, 'duration_ms': round(seconds * 1000, 3),
+                'referer': referer, 'user_agent': user_agent})
+        return self.fmt.format(
+            host=host or '-',
+            time=time.strftime(TIME_FORMAT, time.localtime(timestamp)),
+            method=method, target=target, version=version,
+            request_line=_quote(f'{method} {target} {version}'),
+            status=status, bytes=sent or '-',
+            duration_ms=f'{seconds * 1000:.3f}',
+            referer=_quote(referer or '-'),
+            user_agent=_quote(user_agent or '-'))
+
+    def _write(self, text):
+        if self.path is None:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+            return
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+            self._size = self._file.tell()
+        self._file.write(text)
+        self._file.flush()
+        self._size += len(text.encode('utf-8'))
+        if self.max_bytes is not None and self._size >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        for i in range(self.backups - 1, 0, -1):
+            source = f'{self.path}.{i}'
+            if os.path.exists(source):
+                os.replace(source, f'{self.path}.{i + 1}')
+        if self.backups > 0:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
@@ -0,0 +1,238 @@
+import os
+import math
+import socket
+import tempfile
+import threading
+import time
+import multiprocessing
+
+from web import Webserver
+
+LARGE_FILE_SIZE = 8 * 1024 * 1024
+DIR_ENTRIES = 5000
+RECV_SIZE = 65536
+
+# name, target, extra request headers, keep-alive
+SCENARIOS = (
+    ('literal', '/hello', {}, True),
+    ('literal_new_connection', '/hello', {}, False),
+    ('regex', '/hello/world', {}, True),
+    ('regex_new_connection', '/hello/world', {}, False),
+    ('large_file', '/files/large.bin', {}, True),
+    ('range', '/files/large.bin', {'Range': 'bytes=1048576-1114111'}, True),
+    ('multi_range', '/files/large.bin',
+     {'Range': 'bytes=0-1023,4096-8191,1048576-1049599'}, True),
+    ('dir_listing', '/dir', {}, True),
+    ('dir_listing_json', '/dir?format=json', {}, True),
+)
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of sorted samples"""
+    if not samples:
+        return None
+    return samples[max(math.ceil(fraction * len(samples)) - 1, 0)]
+
+
+def make_fixtures(root):
+    """Writes the large file and the large directory the routes serve"""
+    files = os.path.join(root, 'files')
+    directory = os.path.join(root, 'dir')
+    os.makedirs(files, exist_ok=True)
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(files, 'large.bin'), 'wb') as file:
+        file.write(os.urandom(LARGE_FILE_SIZE))
+    for i in range(DIR_ENTRIES):
+        open(os.path.join(directory, f'entry_{i:05}.txt'), 'wb').close()
+
+
+def serve(port, root, workers):
+    """Target of the server process"""
+    app = Webserver(port=port, workers=workers)
+
+    @app.route('/hello')
+    def hello():
+        return app.get('Hello, world')
+
+    @app.route('/hello/(?P<name>.*)')
+    def hello_name(name):
+        return app.get(f'Hello, {name}')
+
+    @app.route('/files/(?P<name>.*)')
+    def files(name):
+        return app.handle_file(name, os.path.join(root, 'files'),
+                               'application/octet-stream')
+
+    @app.route('/dir')
+    def directory():
+        return app.handle_dir(os.path.join(root, 'dir'))
+
+    app.run()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('localhost', port), 0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f'server on port {port} did not start')
+
+
+class Client:
+    """Minimal HTTP/1.1 client of one benchmark thread. Responses are read
+    by their Content-Length, the connection is reused with keep-alive"""
+
+    def __init__(self, port, keep_alive=True):
+        self.port = port
+        self.keep_alive = keep_alive
+        self._sock = None
+        self._buffer = b''
+
+    def request(self, target, headers):
+        lines = [f'GET {target} HTTP/1.1', 'Host: localhost']
+        lines += [f'{header}: {value}' for header, value in headers.items()]
+        if not self.keep_alive:
+            lines.append('Connection: close')
+        data = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+        if self._sock is None:
+            self._sock = socket.create_connection(('localhost', self.port))
+            self._buffer = b''
+        self._sock.sendall(data)
+        status, length, close = self._read_head()
+        self._read_body(length)
+        if close or not self.keep_alive:
+            self.close()
+        return status
+
+    def _read_head(self):
+        while b'\r\n\r\n' not in self._buffer:
+            self._recv()
+        head, self._buffer = self._buffer.split(b'\r\n\r\n', 1)
+        lines = head.split(b'\r\n')
+        status = int(lines[0].split()[1])
+        length, close = 0, False
+        for line in lines[1:]:
+            header, _, value = line.partition(b':')
+            header = header.strip().lower()
+            if header == b'content-length':
+                length = int(value)
+            elif header == b'connection':
+                close = value.strip().lower() == b'close'
+        return status, length, close
+
+    def _read_body(self, length):
+        """Discards the body as it arrives, only what follows it is kept"""
+        length -= len(self._buffer)
+        while length > 0:
+            data = self._sock.recv(RECV_SIZE)
+            if not data:
+                raise ConnectionError('connection closed by the server')
+            length -= len(data)
+            self._buffer = data
+        self._buffer = self._buffer[len(self._buffer) + length:]
+
+    def _recv(self):
+        data = self._sock.recv(RECV_SIZE)
+        if not data:
+            raise ConnectionError('connection closed by the server')
+        self._buffer += data
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+def drive(port, target, headers, keep_alive, concurrency, requests):
+    """Sends "requests" requests from "concurrency" threads and returns the
+    throughput and the latency percentiles"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    per_thread = [requests // concurrency + (i < requests % concurrency)
+                  for i in range(concurrency)]
+
+    def worker(count):
+        client = Client(port, keep_alive)
+        own = []
+        failed = 0
+        try:
+            for _ in range(count):
+                started = time.perf_counter()
+                try:
+                    status = client.request(target, headers)
+                except OSError:
+                    client.close()
+                    failed += 1
+                    continue
+                own.append(time.perf_counter() - started)
+                if status >= 400:
+                    failed += 1
+        finally:
+            client.close()
+        with lock:
+            latencies.extend(own)
+            errors.append(failed)
+
+    threads = [threading.Thread(target=worker, args=(count,))
+               for count in per_thread if count]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {'requests': len(latencies),
+            'errors': sum(errors),
+            'seconds': elapsed,
+            'rps': len(latencies) / elapsed if elapsed else 0.0,
+            'p50_ms': _ms(percentile(latencies, 0.5)),
+            'p99_ms': _ms(percentile(latencies, 0.99)),
+            'p999_ms': _ms(percentile(latencies, 0.999))}
+
+
+def _ms(seconds):
+    return None if seconds is None else seconds * 1000
+
+
+def run(requests=2000, concurrency=16, workers=16, scenarios=None,
+        warmup=50):
+    """Starts the server in its own process and runs the scenarios against
+    it. Returns the results by scenario name"""
+    selected = [scenario for scenario in SCENARIOS
+                if scenarios is None or scenario[0] in scenarios]
+    port = free_port()
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        make_fixtures(root)
+        process = multiprocessing.Process(target=serve,
+                                          args=(port, root, workers),
+                                          daemon=True)
+        process.start()
+        try:
+            wait_for(port)
+            for name, target, headers, keep_alive in selected:
+                # Large bodies take longer per request, fewer are enough
+                count = requests
+                if name.endswith(('file', 'range')) or 'dir' in name:
+                    count = max(requests // 10, concurrency)
+                drive(port, target, headers, keep_alive,
+                      min(concurrency, warmup), warmup)
+                results[name] = drive(port, target, headers, keep_alive,
+                                      concurrency, count)
+        finally:
+            process.terminate()
+            process.join()
+    return results
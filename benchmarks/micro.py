@@ -0,0 +1,95 @@
+import timeit
+from collections import OrderedDict
+
+from request import Request, RequestParser
+from response import Response
+from router import Router
+
+REQUEST = (b'GET /hello/world?lang=en HTTP/1.1\r\n'
+           b'Host: localhost:8080\r\n'
+           b'User-Agent: Mozilla/5.0 (X11; Linux x86_64) Firefox/115.0\r\n'
+           b'Accept: text/html,application/xhtml+xml,*/*;q=0.8\r\n'
+           b'Accept-Language: en-US,en;q=0.5\r\n'
+           b'Accept-Encoding: gzip, deflate\r\n'
+           b'Connection: keep-alive\r\n\r\n')
+ROUTES = 100
+
+
+class NullSocket:
+    """Socket discarding everything sent to it"""
+
+    @staticmethod
+    def sendmsg(buffers):
+        return sum(len(buffer) for buffer in buffers)
+
+    @staticmethod
+    def sendfile(file, offset=0, count=None):
+        return count or 0
+
+
+def make_router(cache_size):
+    """Router with ROUTES literal and ROUTES patterned routes"""
+    router = Router(cache_size=cache_size)
+
+    def handler(*args, **kwargs):
+        return None
+    for i in range(ROUTES):
+        router.add_route(f'/literal/{i}')(handler)
+        router.add_route(f'/section{i}/(?P<name>[a-z]+)/(?P<id>[0-9]+)')(
+            handler)
+    router.add_route('/hello/(?P<name>.*)')(handler)
+    return router
+
+
+def bench(function, number):
+    """Best of three timings of "number" calls, in microseconds per call"""
+    timings = timeit.repeat(function, number=number, repeat=3)
+    return {'calls': number, 'us_per_call': min(timings) / number * 1e6}
+
+
+def run(number=20000):
+    """Runs the micro-benchmarks. Returns the results by name"""
+    results = {}
+
+    def parse_request():
+        Request(REQUEST).parse_request()
+    results['parse_request'] = bench(parse_request, number)
+
+    pipelined = REQUEST * 10
+
+    def parser_feed():
+        RequestParser().feed(pipelined)
+    results['parser_feed_10_pipelined'] = bench(parser_feed, number // 10)
+
+    cached = make_router(cache_size=1024)
+    uncached = make_router(cache_size=0)
+    for router in (cached, uncached):
+        router.resolve('/hello/world')
+    results['route_literal'] = bench(
+        lambda: uncached.resolve(f'/literal/{ROUTES - 1}'), number)
+    results['route_regex'] = bench(
+        lambda: uncached.resolve(f'/section{ROUTES - 1}/name/42'), number)
+    results['route_regex_generic'] = bench(
+        lambda: uncached.resolve('/hello/world'), number)
+    results['route_cached'] = bench(
+        lambda: cached.resolve('/hello/world'), number)
+
+    client = NullSocket()
+    body = b'x' * 4096
+    connection_headers = {'Connection': 'keep-alive',
+                          'Keep-Alive': 'timeout=5'}
+
+    def response():
+        headers = OrderedDict([('Content-Type', 'text/html'),
+                               ('Content-Length', len(body))])
+        Response(200, 'OK', headers, body).response(client,
+                                                    connection_headers)
+    results['response_4k'] = bench(response, number)
+
+    error = Response(404, 'Not Found',
+                     OrderedDict([('Content-Length', 0)]), b'')
+    results['response_cached_head'] = bench(
+        lambda: Response.response(
+            Response(200, 'OK', error.headers, b'', head=error.build_head()),
+            client, connection_headers), number)
+    return results
@@ -0,0 +1,116 @@
+"""Benchmarks of the web server.
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --compare results.json
+
+The load test starts the server in its own process and drives it with a
+threaded HTTP/1.1 client, the micro-benchmarks time the hot paths in
+process. Results are written as JSON and compared with a previous run, the
+exit status is 1 when a result regressed by more than the threshold."""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import load, micro  # noqa: E402
+
+# Metric name and whether higher is better
+COMPARED = (('rps', True), ('p99_ms', False), ('us_per_call', False))
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'commit': commit,
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count()}
+
+
+def compare(baseline, current, threshold):
+    """Returns (suite, name, metric, before, after, change) of every result
+    that got worse by more than "threshold" (0.1 is 10%)"""
+    regressions = []
+    for suite in ('load', 'micro'):
+        for name, result in current.get(suite, {}).items():
+            before = baseline.get(suite, {}).get(name)
+            if before is None:
+                continue
+            for metric, higher_is_better in COMPARED:
+                old, new = before.get(metric), result.get(metric)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old
+                worse = -change if higher_is_better else change
+                if worse > threshold:
+                    regressions.append((suite, name, metric, old, new,
+                                        change))
+    return regressions
+
+
+def report(results):
+    for name, result in results.get('load', {}).items():
+        print(f'{name:28} {result["rps"]:10.1f} req/s  '
+              f'p50 {result["p50_ms"]:8.3f} ms  '
+              f'p99 {result["p99_ms"]:8.3f} ms  '
+              f'p999 {result["p999_ms"]:8.3f} ms  '
+              f'errors {result["errors"]}')
+    for name, result in results.get('micro', {}).items():
+        print(f'{name:28} {result["us_per_call"]:10.3f} us/call')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--compare', help='compare with a previous run')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='allowed regression, 0.1 is 10%%')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=16,
+                        help='worker threads of the server')
+    parser.add_argument('--calls', type=int, default=20000,
+                        help='calls of every micro-benchmark')
+    parser.add_argument('--scenario', action='append',
+                        choices=[scenario[0] for scenario in load.SCENARIOS],
+                        help='run only these load scenarios')
+    parser.add_argument('--skip-load', action='store_true')
+    parser.add_argument('--skip-micro', action='store_true')
+    args = parser.parse_args(argv)
+
+    results = {'environment': environment()}
+    if not args.skip_micro:
+        results['micro'] = micro.run(args.calls)
+    if not args.skip_load:
+        results['load'] = load.run(args.requests, args.concurrency,
+                                   args.workers, args.scenario)
+    report(results)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(baseline, results, args.threshold)
+        for suite, name, metric, old, new, change in regressions:
+            print(f'REGRESSION {suite}/{name} {metric}: {old:.3f} -> '
+                  f'{new:.3f} ({change:+.1%})')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+import os
+import threading
+from collections import OrderedDict
+
+from response import Response
+
+
+class FileCache:
+    """Size-bounded LRU cache of small static files.
+
+    Files are kept in memory together with their serialized status line and
+    headers. Every lookup costs one stat call: an entry whose mtime or size
+    changed is read again.
+
+    Attributes
+    ----------
+    max_bytes - Byte budget of all cached files
+    max_file_size - Files larger than this are never cached
+    entries - Cached files by path, least recently used first
+    size - Bytes of all cached files
+    hits - Number of lookups answered from memory
+    misses - Number of lookups that read the file
+    evictions - Number of files evicted to fit the budget
+
+    Methods
+    ----------
+    get - Returns a response of the file, None if it can not be cached
+    invalidate - Forgets one file or all of them
+    stats - Returns the counters"""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_file_size=1024 * 1024):
+        self.max_bytes: int = max_bytes
+        self.max_file_size: int = max_file_size
+        self._entries: OrderedDict = OrderedDict()
+        self._size: int = 0
+        self._lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def get(self, path, content_type, stat=None, headers=None):
+        """Returns a 200 response of the file or None when the file does not
+        exist or is too large to be cached. "headers" are added to the
+        response, they are not part of the key: the validators change with
+        every version of the file, which replaces the previous one"""
+        try:
+            stat = stat or os.stat(path)
+        except OSError:
+            return None
+        if stat.st_size > self.max_file_size:
+            return None
+        extra = tuple((headers or {}).items())
+        key = path, content_type
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[:2] == (stat.st_mtime_ns,
+                                                   stat.st_size):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                if entry[2] != extra:
+                    entry = self._build(entry[:2], content_type, extra,
+                                        entry[5])
+                    self._entries[key] = entry
+                return self._response(entry)
+            self.misses += 1
+
+        with open(path, 'rb') as file:
+            body = file.read()
+        entry = self._build((stat.st_mtime_ns, stat.st_size), content_type,
+                            extra, body)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous[5])
+            self._entries[key] = entry
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted[5])
+                self.evictions += 1
+        return self._response(entry)
+
+    @staticmethod
+    def _build(version, content_type, extra, body):
+        headers = OrderedDict([('Content-Type', content_type),
+                               ('Content-Length', len(body))])
+        headers.update(extra)
+        head = Response(200, "OK", headers, body).build_head()
+        return version + (extra, headers, head, body)
+
+    @staticmethod
+    def _response(entry):
+        _, _, _, headers, head, body = entry
+        return Response(200, "OK", headers, body, head=head)
+
+    def invalidate(self, path=None):
+        with self._lock:
+            for key in list(self._entries):
+                if path is None or key[0] == path:
+                    self._size -= len(self._entries.pop(key)[5])
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions,
+                    'files': len(self._entries), 'bytes': self._size}
@@ -0,0 +1,149 @@
+import os
+import hashlib
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+
+from response import Response
+
+COMPRESSIBLE_TYPES = frozenset(('application/json', 'application/javascript',
+                                'application/xml', 'image/svg+xml'))
+# wbits of zlib.compressobj for every supported Content-Encoding
+ENCODINGS = OrderedDict([('gzip', 31), ('deflate', 15)])
+CHUNK_SIZE = 65536
+
+
+def is_compressible(content_type):
+    content_type = (content_type or '').split(';', 1)[0].strip().lower()
+    return (content_type.startswith('text/')
+            or content_type in COMPRESSIBLE_TYPES)
+
+
+def negotiate(accept_encoding):
+    """Returns the preferred supported encoding of an Accept-Encoding value,
+    gzip before deflate at the same quality, or None"""
+    qualities = {}
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.partition(';')
+        quality = 1.0
+        params = params.strip().lower()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                continue
+        qualities[coding.strip().lower()] = quality
+    candidates = [(qualities.get(coding, qualities.get('*', 0)), -i, coding)
+                  for i, coding in enumerate(ENCODINGS)]
+    quality, _, coding = max(candidates)
+    return coding if quality > 0 else None
+
+
+class Compressor:
+    """Content negotiation and compression of responses.
+
+    In-memory bodies of compressible content types above "min_size" are
+    compressed on the fly. Static files use a precompressed "file.gz" sidecar
+    when it is newer than the file, otherwise a compressed copy written once
+    into "cache_dir", streamed chunk by chunk, and keyed by path, mtime and
+    encoding.
+
+    Attributes
+    ----------
+    min_size - Smaller bodies are sent as they are
+    level - zlib compression level
+    cache_dir - Directory of the compressed copies of files
+    variants - Current compressed copy of every (path, encoding)
+
+    Methods
+    ----------
+    compress - Returns the response compressed for the request
+    file_variant - Returns the path and encoding of a compressed copy of a
+                   file"""
+
+    def __init__(self, min_size=1024, level=6, cache_dir=None):
+        self.min_size: int = min_size
+        self.level: int = level
+        self.cache_dir: str = cache_dir or os.path.join(
+            tempfile.gettempdir(), 'webserver-compressed')
+        self._variants: dict = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def compress(self, request, response):
+        """Returns a new compressed response or the same one. Only complete
+        in-memory bodies are compressed, file bodies go through file_variant.
+        A response already negotiated (Vary: Accept-Encoding), a memoized
+        one, is returned as it is"""
+        if (getattr(response, 'file', None) is not None
+                or response.status != 200
+                or 'Content-Encoding' in response.headers
+                or 'Accept-Encoding' in str(response.headers.get('Vary', ''))
+                or not is_compressible(response.headers.get('Content-Type'))):
+            return response
+        body = response.body
+        if not isinstance(body, bytes) or len(body) < self.min_size:
+            return response
+        encoding = negotiate(request.get_headers().get('Accept-Encoding'))
+        headers = OrderedDict(response.headers)
+        headers['Vary'] = 'Accept-Encoding'
+        if encoding is not None:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED,
+                                          ENCODINGS[encoding])
+            body = compressor.compress(body) + compressor.flush()
+            headers['Content-Encoding'] = encoding
+            # Same content, other bytes: the validator can only be weak
+            if headers.get('ETag', 'W/').startswith('"'):
+                headers['ETag'] = 'W/' + headers['ETag']
+        headers['Content-Length'] = len(body)
+        return Response(response.status, response.message, headers, body)
+
+    def file_variant(self, request, path, stat, content_type):
+        """Returns (path, encoding) of a compressed copy of the file the
+        client accepts, or None to send the file as it is"""
+        if stat.st_size < self.min_size or not is_compressible(content_type):
+            return None
+        encoding = negotiate(request.get_headers().get('Accept-Encoding'))
+        if encoding is None:
+            return None
+        if encoding == 'gzip':
+            try:
+                if os.stat(path + '.gz').st_mtime_ns >= stat.st_mtime_ns:
+                    return path + '.gz', encoding
+            except OSError:
+                pass
+
+        key = path, encoding
+        name = hashlib.sha1(
+            f'{path}\0{stat.st_mtime_ns}\0{stat.st_size}'.encode()
+        ).hexdigest() + '.' + encoding
+        variant = os.path.join(self.cache_dir, name)
+        # Copies are renamed into place complete, an existing one is valid
+        if not os.path.exists(variant):
+            self._write_variant(path, variant, encoding)
+        with self._lock:
+            previous = self._variants.get(key)
+            self._variants[key] = variant
+        if previous is not None and previous != variant:
+            try:
+                os.remove(previous)
+            except OSError:
+                pass
+        return variant, encoding
+
+    def _write_variant(self, path, variant, encoding):
+        """Compresses the file chunk by chunk, memory stays bounded whatever
+        its size"""
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED,
+                                      ENCODINGS[encoding])
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir)
+        try:
+            with open(path, 'rb') as source, os.fdopen(fd, 'wb') as target:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    target.write(compressor.compress(chunk))
+                target.write(compressor.flush())
+            os.replace(temp_path, variant)
+        except BaseException:
+            os.remove(temp_path)
+            raise
@@ -1,10 +1,12 @@
 class HTTPResponseError(Exception):
     """NYI"""
 
-    def __init__(self, status, message, body=None):
+    def __init__(self, status, message, body=None, headers=None):
         self.status = status
         self.message = message
         self.body = body
+        self.headers = dict(headers or {})
+        self.heads = {}
 
     def status_code(self):
         return f'HTTP/1.1 {self.status} {self.message}'
@@ -12,7 +14,22 @@ class HTTPResponseError(Exception):
 
 class Error(HTTPResponseError):
     """NYI"""
+    BAD_REQUEST = HTTPResponseError(400, 'Bad request',
+                                    b'<h1>400</h1><p>Bad request</p>')
     NOT_FOUND_PAGE = HTTPResponseError(404, 'Not found',
-                                       b'\r\n<h1>404</h1><p>Not found</p>')
+                                       b'<h1>404</h1><p>Not found</p>')
+    REQUEST_TIMEOUT = HTTPResponseError(408, 'Request timeout',
+                                        b'<h1>408</h1><p>Request timeout</p>')
     LENGTH_REQUIRED = HTTPResponseError(411, 'Length required',
-                                        b'\r\n<h1>411</h1><p>Len required</p>')
\ No newline at end of file
+                                        b'<h1>411</h1><p>Len required</p>')
+    PAYLOAD_TOO_LARGE = HTTPResponseError(
+        413, 'Payload too large', b'<h1>413</h1><p>Payload too large</p>')
+    HEADERS_TOO_LARGE = HTTPResponseError(
+        431, 'Request header fields too large',
+        b'<h1>431</h1><p>Request header fields too large</p>')
+    BAD_GATEWAY = HTTPResponseError(502, 'Bad gateway',
+                                    b'<h1>502</h1><p>Bad gateway</p>')
+    SERVICE_UNAVAILABLE = HTTPResponseError(
+        503, 'Service unavailable', b'<h1>503</h1><p>Service unavailable</p>')
+    GATEWAY_TIMEOUT = HTTPResponseError(504, 'Gateway timeout',
+                                        b'<h1>504</h1><p>Gateway timeout</p>')
@@ -0,0 +1,101 @@
+import math
+import threading
+import time
+
+
+class ConcurrencyLimiter:
+    """Adaptive limit of the requests handled at once.
+
+    The limit follows the latency of the user functions by additive
+    increase, multiplicative decrease: a request slower than
+    "target_latency" cuts the limit by "backoff", at most once per
+    "target_latency" seconds, while fast requests that found the limit in
+    use raise it by one per "limit" requests. A request over the limit, or
+    that waited more than "max_queue_wait" seconds for a worker, is refused
+    and answered 503 right away, so that under overload the admitted
+    requests stay fast. Requests of priority routes ignore the queue wait
+    and may exceed the limit by the "priority_headroom" share of it.
+
+    Attributes
+    ----------
+    limit - Current number of requests admitted at once
+    min_limit - Lowest value of the limit
+    max_limit - Highest value of the limit
+    target_latency - Seconds above which a request signals overload
+    backoff - Factor applied to the limit on overload
+    max_queue_wait - Max seconds a request may wait for a worker
+    priority_headroom - Share of the limit only priority requests may use
+    in_flight - Number of requests being handled
+    admitted - Number of requests admitted
+    rejected - Number of requests refused over the limit
+    expired - Number of requests refused after waiting too long
+
+    Methods
+    ----------
+    acquire - Admits a request, returns False if it must be refused
+    release - Ends an admitted request and adapts the limit to its latency
+    stats - Returns the limit and the counters"""
+
+    def __init__(self, initial_limit=16, min_limit=1, max_limit=1024,
+                 target_latency=0.1, backoff=0.9, max_queue_wait=1.0,
+                 priority_headroom=0.5):
+        if not 0 < backoff < 1:
+            raise ValueError('backoff must be between 0 and 1')
+        if not 1 <= min_limit <= initial_limit <= max_limit:
+            raise ValueError('limits must satisfy '
+                             '1 <= min_limit <= initial_limit <= max_limit')
+        self._limit: float = float(initial_limit)
+        self.min_limit: int = min_limit
+        self.max_limit: int = max_limit
+        self.target_latency: float = target_latency
+        self.backoff: float = backoff
+        self.max_queue_wait: float = max_queue_wait
+        self.priority_headroom: float = priority_headroom
+        self.in_flight: int = 0
+        self.admitted: int = 0
+        self.rejected: int = 0
+        self.expired: int = 0
+        self._decreased: float = float('-inf')
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def acquire(self, priority=False, waited=0.0):
+        """Admits a request that waited "waited" seconds for a worker"""
+        with self._lock:
+            if priority:
+                limit = math.ceil(self._limit * (1 + self.priority_headroom))
+            else:
+                if waited > self.max_queue_wait:
+                    self.expired += 1
+                    return False
+                limit = int(self._limit)
+            if self.in_flight >= limit:
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+
+    def release(self, latency):
+        """Ends a request admitted by acquire that took "latency" seconds"""
+        with self._lock:
+            used = self.in_flight * 2 >= self._limit
+            self.in_flight -= 1
+            if latency > self.target_latency:
+                now = time.monotonic()
+                if now - self._decreased >= self.target_latency:
+                    self._decreased = now
+                    self._limit = max(self._limit * self.backoff,
+                                      self.min_limit)
+            elif used:
+                self._limit = min(self._limit + 1 / self._limit,
+                                  self.max_limit)
+
+    def stats(self):
+        with self._lock:
+            return {'limit': int(self._limit), 'in_flight': self.in_flight,
+                    'admitted': self.admitted, 'rejected': self.rejected,
+                    'expired': self.expired}
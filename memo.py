@@ -0,0 +1,170 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+from response import Response
+
+# Methods whose responses may be served from the cache
+CACHEABLE_METHODS = frozenset(('GET', 'HEAD'))
+
+
+class _Flight:
+    """A miss being computed, concurrent requests of its key wait for it"""
+    __slots__ = ('done', 'entry')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+
+
+class ResponseCache:
+    """TTL and LRU bounded cache of the responses of one route.
+
+    Responses are kept in memory together with their serialized status line
+    and headers, a hit costs a dictionary lookup. Entries are keyed by the
+    url, the query and the values of the "vary" request headers. Only 200
+    responses to GET and HEAD with an in-memory body are cached. Concurrent
+    misses of one key call the user function once, the other requests wait
+    for its response.
+
+    Attributes
+    ----------
+    ttl - Seconds a response stays fresh
+    max_entries - Max number of cached responses
+    vary - Request headers that are part of the key
+    entries - Cached responses by key, least recently used first
+    hits - Number of requests answered from memory
+    misses - Number of requests that called the user function
+    evictions - Number of responses evicted to fit "max_entries"
+
+    Methods
+    ----------
+    key - Returns the key of a request, None if it is not cacheable
+    get - Returns the response of a key, computing it on a miss
+    get_async - get for a coroutine user function
+    invalidate - Forgets the responses of one url or all of them
+    stats - Returns the counters"""
+
+    def __init__(self, ttl, max_entries=1024, vary=()):
+        self.ttl: float = ttl
+        self.max_entries: int = max_entries
+        self.vary: tuple = tuple(vary)
+        self._entries: OrderedDict = OrderedDict()
+        self._flights: dict = {}
+        self._async_flights: dict = {}
+        self._lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def key(self, request):
+        if request.method not in CACHEABLE_METHODS:
+            return None
+        if not self.vary:
+            return request.url, request.query
+        headers = request.get_headers()
+        return (request.url, request.query,
+                tuple(headers.get(header) for header in self.vary))
+
+    def _lookup(self, key):
+        """Returns the fresh entry of the key, the lock must be held"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def _store(self, key, response):
+        """Caches the response if it can be, returns its entry or None"""
+        if (not isinstance(response, Response) or response.status != 200
+                or response.file is not None or response.chunks is not None
+                or not isinstance(response.body, bytes)):
+            return None
+        headers = OrderedDict(response.headers)
+        headers.setdefault('Content-Length', len(response.body))
+        entry = (time.monotonic() + self.ttl, response.message, headers,
+                 Response(200, response.message, headers,
+                          response.body).build_head(), response.body)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    @staticmethod
+    def _response(entry):
+        _, message, headers, head, body = entry
+        return Response(200, message, headers, body, head=head)
+
+    def get(self, key, compute):
+        """Returns the cached response of the key. On a miss "compute" is
+        called once, concurrent requests of the key wait for its result"""
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                return self._response(entry)
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.misses += 1
+        if not leader:
+            flight.done.wait()
+            if flight.entry is not None:
+                return self._response(flight.entry)
+            # The response could not be cached or the function raised
+            return compute()
+        try:
+            response = compute()
+            entry = flight.entry = self._store(key, response)
+            return response if entry is None else self._response(entry)
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    async def get_async(self, key, compute):
+        """get for a coroutine function, called from one event loop"""
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                return self._response(entry)
+        flight = self._async_flights.get(key)
+        if flight is not None:
+            entry = await asyncio.shield(flight)
+            if entry is not None:
+                return self._response(entry)
+            return await compute()
+        flight = asyncio.get_running_loop().create_future()
+        self._async_flights[key] = flight
+        with self._lock:
+            self.misses += 1
+        entry = None
+        try:
+            response = await compute()
+            entry = self._store(key, response)
+            return response if entry is None else self._response(entry)
+        finally:
+            del self._async_flights[key]
+            flight.set_result(entry)
+
+    def invalidate(self, url=None):
+        with self._lock:
+            if url is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] == url]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries)}
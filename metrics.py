@@ -0,0 +1,178 @@
+import threading
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PHASES = ('parse', 'dispatch', 'send')
+UNMATCHED = '<unmatched>'
+REJECTED = '<rejected>'
+
+
+class Histogram:
+    """Fixed-bucket histogram. Only the bucket counts, the sum and the count
+    are kept, never the samples"""
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Returns the (upper bound, cumulative count) pairs, +Inf last"""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+def _label(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+class Metrics:
+    """Low-overhead server metrics.
+
+    Requests are counted and timed per route pattern and status code in
+    fixed-bucket histograms, next to the bytes sent, the parse, dispatch and
+    send phase timings and the open connections. Gauges such as the depth
+    of the worker pool queue are read from callbacks when the metrics are
+    collected.
+
+    Attributes
+    ----------
+    requests - Latency histograms by (route, status)
+    bytes_sent - Bytes sent by (route, status)
+    phases - Histograms of the request phases
+    active_connections - Number of open connections
+    gauges - Callbacks returning the current value of a gauge by name
+
+    Methods
+    ----------
+    observe_request - Records a request with its latency and bytes sent
+    observe_phase - Records the duration of a phase of a request
+    connection_opened - Counts an open connection
+    connection_closed - Counts a closed connection
+    add_gauge - Adds a gauge read from a callback
+    snapshot - Returns all metrics as a dictionary
+    render - Returns all metrics in the Prometheus text format"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS, prefix='webserver'):
+        self.buckets: tuple = tuple(buckets)
+        self.prefix: str = prefix
+        self.requests: dict = {}
+        self.bytes_sent: dict = {}
+        self.phases: dict = {phase: Histogram(self.buckets)
+                             for phase in PHASES}
+        self.active_connections: int = 0
+        self.gauges: dict = {}
+        self._lock = threading.Lock()
+
+    def observe_request(self, route, status, seconds, bytes_sent=0):
+        key = route, status
+        with self._lock:
+            histogram = self.requests.get(key)
+            if histogram is None:
+                histogram = self.requests[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+            self.bytes_sent[key] = self.bytes_sent.get(key, 0) + bytes_sent
+
+    def observe_phase(self, phase, seconds):
+        with self._lock:
+            self.phases[phase].observe(seconds)
+
+    def connection_opened(self):
+        with self._lock:
+            self.active_connections += 1
+
+    def connection_closed(self):
+        with self._lock:
+            self.active_connections -= 1
+
+    def add_gauge(self, name, callback):
+        self.gauges[name] = callback
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'requests': {key: {'count': histogram.count,
+                                   'sum': histogram.sum,
+                                   'buckets': histogram.cumulative()}
+                             for key, histogram in self.requests.items()},
+                'bytes_sent': dict(self.bytes_sent),
+                'phases': {phase: {'count': histogram.count,
+                                   'sum': histogram.sum,
+                                   'buckets': histogram.cumulative()}
+                           for phase, histogram in self.phases.items()},
+                'active_connections': self.active_connections,
+                'gauges': {name: callback()
+                           for name, callback in self.gauges.items()}}
+
+    def render(self):
+        prefix = self.prefix
+        with self._lock:
+            requests = [(key, histogram.count, histogram.sum,
+                         histogram.cumulative())
+                        for key, histogram in self.requests.items()]
+            bytes_sent = list(self.bytes_sent.items())
+            phases = [(phase, histogram.count, histogram.sum,
+                       histogram.cumulative())
+                      for phase, histogram in self.phases.items()]
+            active_connections = self.active_connections
+
+        lines = [f'# HELP {prefix}_requests_total Requests by route and '
+                 f'status.',
+                 f'# TYPE {prefix}_requests_total counter']
+        for (route, status), count, _, _ in requests:
+            lines.append(f'{prefix}_requests_total{{route="{_label(route)}",'
+                         f'status="{status}"}} {count}')
+
+        lines += [f'# HELP {prefix}_request_duration_seconds Latency of the '
+                  f'requests by route and status.',
+                  f'# TYPE {prefix}_request_duration_seconds histogram']
+        for (route, status), count, total, buckets in requests:
+            labels = f'route="{_label(route)}",status="{status}"'
+            name = f'{prefix}_request_duration_seconds'
+            for bound, cumulative in buckets:
+                lines.append(f'{name}_bucket{{{labels},le="{_bound(bound)}"}}'
+                             f' {cumulative}')
+            lines.append(f'{name}_sum{{{labels}}} {total}')
+            lines.append(f'{name}_count{{{labels}}} {count}')
+
+        lines += [f'# HELP {prefix}_response_bytes_total Bytes sent by route '
+                  f'and status.',
+                  f'# TYPE {prefix}_response_bytes_total counter']
+        for (route, status), sent in bytes_sent:
+            lines.append(f'{prefix}_response_bytes_total{{route="'
+                         f'{_label(route)}",status="{status}"}} {sent}')
+
+        lines += [f'# HELP {prefix}_phase_duration_seconds Duration of the '
+                  f'parse, dispatch and send phases.',
+                  f'# TYPE {prefix}_phase_duration_seconds histogram']
+        for phase, count, total, buckets in phases:
+            name = f'{prefix}_phase_duration_seconds'
+            for bound, cumulative in buckets:
+                lines.append(f'{name}_bucket{{phase="{phase}",'
+                             f'le="{_bound(bound)}"}} {cumulative}')
+            lines.append(f'{name}_sum{{phase="{phase}"}} {total}')
+            lines.append(f'{name}_count{{phase="{phase}"}} {count}')
+
+        lines += [f'# TYPE {prefix}_active_connections gauge',
+                  f'{prefix}_active_connections {active_connections}']
+        for name, callback in self.gauges.items():
+            lines += [f'# TYPE {prefix}_{name} gauge',
+                      f'{prefix}_{name} {callback()}']
+        return '\n'.join(lines) + '\n'
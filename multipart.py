@@ -0,0 +1,236 @@
+import io
+import tempfile
+from email.message import Message
+from urllib.parse import parse_qsl
+
+from errors import Error
+
+READ_SIZE = 65536
+SPOOL_SIZE = 1024 * 1024
+MAX_PART_HEADER_SIZE = 16384
+MAX_FIELD_SIZE = 1024 * 1024
+MAX_PARTS = 1000
+HEAD_END = b'\r\n\r\n'
+CRLF = b'\r\n'
+
+
+class UploadedFile:
+    """A file part of a multipart/form-data body.
+
+    Attributes
+    ----------
+    name - Name of the form field
+    filename - File name sent by the client
+    content_type - Content type sent by the client
+    headers - All headers of the part, names in lower case
+    file - File object of the content, in memory up to the spool size and
+           in a temporary file above it
+    size - Size of the content in bytes"""
+    __slots__ = ('name', 'filename', 'content_type', 'headers', 'file',
+                 'size')
+
+    def __init__(self, name, filename, content_type, headers, file, size):
+        self.name: str = name
+        self.filename: str = filename
+        self.content_type: str = content_type
+        self.headers: dict = headers
+        self.file = file
+        self.size: int = size
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def save(self, path):
+        """Copies the content to "path" in constant memory"""
+        self.file.seek(0)
+        with open(path, 'wb') as target:
+            for block in iter(lambda: self.file.read(READ_SIZE), b''):
+                target.write(block)
+        self.file.seek(0)
+
+
+class Form:
+    """Fields and files of a form body. Every name maps to the list of its
+    values, in the order they were sent
+
+    Attributes
+    ----------
+    fields - Text values by field name
+    files - UploadedFile objects by field name
+
+    Methods
+    ----------
+    get - Returns the first value of a field
+    get_file - Returns the first file of a field
+    close - Closes all files"""
+
+    def __init__(self):
+        self.fields: dict = {}
+        self.files: dict = {}
+
+    def get(self, name, default=None):
+        values = self.fields.get(name)
+        return values[0] if values else default
+
+    def get_file(self, name):
+        files = self.files.get(name)
+        return files[0] if files else None
+
+    def close(self):
+        for files in self.files.values():
+            for uploaded in files:
+                uploaded.file.close()
+
+
+def parse_form(content_type, stream, spool_size=SPOOL_SIZE):
+    """Parses an application/x-www-form-urlencoded or multipart/form-data
+    body. Other content types give an empty form"""
+    message = Message()
+    message['Content-Type'] = content_type or ''
+    kind = message.get_content_type()
+    if kind == 'multipart/form-data':
+        boundary = message.get_param('boundary')
+        if not boundary:
+            raise Error.BAD_REQUEST
+        return parse_multipart(stream, boundary, spool_size)
+    form = Form()
+    if kind == 'application/x-www-form-urlencoded':
+        body = stream.read().decode(message.get_param('charset') or 'utf-8',
+                                    'replace')
+        for name, value in parse_qsl(body, keep_blank_values=True):
+            form.fields.setdefault(name, []).append(value)
+    return form
+
+
+def parse_multipart(stream, boundary, spool_size=SPOOL_SIZE):
+    """Parses a multipart/form-data body read from "stream" block by block.
+    File contents go to spooled temporary files, so memory stays bounded
+    whatever the size of the body"""
+    form = Form()
+    try:
+        _parse_parts(_Reader(stream), boundary.encode('latin-1'), form,
+                     spool_size)
+    except BaseException:
+        form.close()
+        raise
+    return form
+
+
+class _Reader:
+    """Buffer over the stream of the body"""
+    __slots__ = ('stream', 'buffer', 'eof')
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = bytearray()
+        self.eof = False
+
+    def fill(self):
+        """Reads one more block, returns False at the end of the stream"""
+        if self.eof:
+            return False
+        block = self.stream.read(READ_SIZE)
+        if not block:
+            self.eof = True
+            return False
+        self.buffer += block
+        return True
+
+    def find(self, needle, limit):
+        """Returns the offset of "needle", reading until it is found within
+        "limit" bytes"""
+        while True:
+            offset = self.buffer.find(needle)
+            if 0 <= offset <= limit:
+                return offset
+            if len(self.buffer) > limit + len(needle) or not self.fill():
+                raise Error.BAD_REQUEST
+
+    def take(self, size):
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+def _parse_parts(reader, boundary, form, spool_size):
+    delimiter = b'--' + boundary
+    # The preamble ends with the first delimiter
+    offset = reader.find(delimiter, READ_SIZE)
+    reader.take(offset + len(delimiter))
+    delimiter = CRLF + delimiter
+    parts = 0
+    while True:
+        while len(reader.buffer) < 2 and reader.fill():
+            pass
+        if reader.buffer[:2] == b'--':
+            return
+        if reader.buffer[:2] != CRLF:
+            raise Error.BAD_REQUEST
+        parts += 1
+        if parts > MAX_PARTS:
+            raise Error.PAYLOAD_TOO_LARGE
+        reader.take(2)
+
+        end = reader.find(HEAD_END, MAX_PART_HEADER_SIZE)
+        headers = _part_headers(reader.take(end))
+        reader.take(len(HEAD_END))
+        message = Message()
+        message['Content-Disposition'] = headers.get('content-disposition',
+                                                     '')
+        name = message.get_param('name', header='content-disposition')
+        filename = message.get_filename()
+        if name is None:
+            raise Error.BAD_REQUEST
+
+        if filename is None:
+            target = io.BytesIO()
+            size = _copy_part(reader, delimiter, target, MAX_FIELD_SIZE)
+            message = Message()
+            message['Content-Type'] = headers.get('content-type', 'text/plain')
+            value = target.getvalue().decode(
+                message.get_param('charset') or 'utf-8', 'replace')
+            form.fields.setdefault(name, []).append(value)
+        else:
+            target = tempfile.SpooledTemporaryFile(max_size=spool_size)
+            uploaded = UploadedFile(
+                name, filename,
+                headers.get('content-type', 'application/octet-stream'),
+                headers, target, 0)
+            form.files.setdefault(name, []).append(uploaded)
+            uploaded.size = _copy_part(reader, delimiter, target)
+            target.seek(0)
+
+
+def _part_headers(head):
+    headers = {}
+    for line in head.split(CRLF):
+        header, colon, header_value = line.partition(b':')
+        if not colon:
+            raise Error.BAD_REQUEST
+        headers[header.strip().decode('latin-1').lower()] = (
+            header_value.strip().decode('utf-8', 'replace'))
+    return headers
+
+
+def _copy_part(reader, delimiter, target, limit=None):
+    """Writes the content of a part up to the next delimiter. Only the
+    bytes that may start a delimiter are kept in the buffer"""
+    size = 0
+    while True:
+        offset = reader.buffer.find(delimiter)
+        if offset >= 0:
+            target.write(reader.take(offset))
+            reader.take(len(delimiter))
+            size += offset
+            if limit is not None and size > limit:
+                raise Error.PAYLOAD_TOO_LARGE
+            return size
+        keep = len(delimiter) - 1
+        if len(reader.buffer) > keep:
+            chunk = reader.take(len(reader.buffer) - keep)
+            target.write(chunk)
+            size += len(chunk)
+            if limit is not None and size > limit:
+                raise Error.PAYLOAD_TOO_LARGE
+        if not reader.fill():
+            raise Error.BAD_REQUEST
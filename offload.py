@@ -0,0 +1,280 @@
+import os
+import threading
+import time
+import weakref
+import multiprocessing
+
+from errors import Error
+from request import Request
+from response import Response, is_stream, _encode
+
+# Servers of this process, their "request" is set in the worker processes
+_servers = weakref.WeakSet()
+
+
+class ProcessOffload:
+    """Worker processes running the CPU-bound user functions.
+
+    A call pickles the function by reference, its arguments and a copy of
+    the request with the body read into memory, and sends them through the
+    pipe of an idle worker. The worker turns the response into plain bytes
+    with its status line and headers already serialized, so the server only
+    sends it. At most "max_pending" calls are queued or running, more are
+    answered 503 at once, the queued ones wait for an idle worker.
+
+    The workers are started through the fork server ("spawn" where there is
+    none), never forked from the threaded server process: they import the
+    module of the user function, and the script of the server runs as
+    "__mp_main__" in them. A call not done within its timeout is answered
+    504 and only its worker is killed, the next call starts a replacement.
+
+    Attributes
+    ----------
+    workers - Max number of worker processes
+    max_pending - Max number of calls queued or running
+    pending - Number of calls queued or running
+    context - multiprocessing context starting the workers
+    idle - Workers waiting for a call
+    started - Number of workers alive or being started
+    closed - Set by shutdown, until the next start
+
+    Methods
+    ----------
+    start - Starts the worker processes
+    call - Runs a user function in a worker process, returns its response
+    shutdown - Stops the worker processes"""
+
+    def __init__(self, server, workers=None, max_pending=None):
+        self.workers: int = workers or os.cpu_count() or 1
+        self.max_pending: int = (self.workers * 4 if max_pending is None
+                                 else max_pending)
+        self.pending: int = 0
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            self._context = multiprocessing.get_context('forkserver')
+            # Workers forked by the fork server find the script imported
+            self._context.set_forkserver_preload(['__main__'])
+        else:
+            self._context = multiprocessing.get_context('spawn')
+        self._idle: list = []
+        self._started: int = 0
+        self._closed: bool = False
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        _servers.add(server)
+
+    def start(self):
+        """Starts the missing workers now rather than on a busy request"""
+        with self._lock:
+            self._closed = False
+            count = max(self.workers - self._started, 0)
+            self._started += count
+        workers = []
+        try:
+            for _ in range(count):
+                workers.append(_Worker(self._context))
+        finally:
+            with self._lock:
+                self._started -= count - len(workers)
+                self._idle.extend(workers)
+                self._available.notify_all()
+
+    def call(self, function, request, args, kwargs, timeout=None):
+        """Returns the response of the function run in a worker process,
+        a 503 error when "max_pending" calls are pending and a 504 error
+        after "timeout" seconds"""
+        with self._lock:
+            if self.pending >= self.max_pending:
+                return Error.SERVICE_UNAVAILABLE
+            self.pending += 1
+        try:
+            return self._call(function, _portable_request(request), args,
+                              kwargs, timeout)
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def _call(self, function, request, args, kwargs, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        worker = self._acquire(deadline)
+        if worker is None:
+            return (Error.SERVICE_UNAVAILABLE if self._closed
+                    else Error.GATEWAY_TIMEOUT)
+        try:
+            worker.connection.send((function, request, args, kwargs))
+        except (EOFError, OSError):
+            self._discard(worker)
+            return Error.SERVICE_UNAVAILABLE
+        except BaseException:
+            # Not picklable, nothing was written
+            self._release(worker)
+            raise
+        try:
+            if not worker.connection.poll(
+                    None if deadline is None
+                    else max(deadline - time.monotonic(), 0)):
+                # A running function can only be stopped with its process
+                self._discard(worker)
+                return Error.GATEWAY_TIMEOUT
+            done, result = worker.connection.recv()
+        except (EOFError, OSError):
+            # The worker process died
+            self._discard(worker)
+            return Error.SERVICE_UNAVAILABLE
+        except BaseException:
+            self._discard(worker)
+            raise
+        self._release(worker)
+        if done:
+            return result
+        raise result
+
+    def _acquire(self, deadline):
+        """Returns an idle worker, starts one while fewer than "workers"
+        are started. None after the deadline or once shut down"""
+        with self._lock:
+            while not self._idle:
+                if self._closed:
+                    return None
+                if self._started < self.workers:
+                    self._started += 1
+                    break
+                remaining = (None if deadline is None
+                             else deadline - time.monotonic())
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._available.wait(remaining)
+            else:
+                return self._idle.pop()
+        # Started out of the lock, the other calls do not wait for it
+        try:
+            return _Worker(self._context)
+        except BaseException:
+            self._forget()
+            raise
+
+    def _release(self, worker):
+        with self._lock:
+            if not self._closed:
+                self._idle.append(worker)
+                self._available.notify()
+                return
+        worker.stop()
+        self._forget()
+
+    def _discard(self, worker):
+        worker.kill()
+        self._forget()
+
+    def _forget(self):
+        """Frees the place of a worker that is gone"""
+        with self._lock:
+            self._started -= 1
+            self._available.notify()
+
+    def shutdown(self):
+        """Stops the idle workers, the busy ones once their call is done"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._started -= len(idle)
+            self._available.notify_all()
+        for worker in idle:
+            worker.stop()
+
+
+class _Worker:
+    """A worker process and the server end of its pipe"""
+    __slots__ = ('process', 'connection')
+
+    def __init__(self, context):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child,),
+                                       daemon=True)
+        try:
+            self.process.start()
+        finally:
+            child.close()
+
+    def stop(self):
+        """Asks the worker to exit, without waiting for it"""
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.connection.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+def _portable_request(request):
+    """Copy of the request that can be pickled, with the body in memory"""
+    portable = Request()
+    for name in ('method', 'version', 'target', 'url', 'query', 'address'):
+        setattr(portable, name, getattr(request, name))
+    portable.headers = request.headers
+    portable.body = request.body
+    return portable
+
+
+def _portable_response(response):
+    """Turns a response into a body of bytes with a serialized head, a
+    streamed body is joined and a file body read"""
+    if not isinstance(response, Response):
+        return response
+    if response.chunks is not None:
+        response.body = b''.join(_encode(chunk) for chunk in response.chunks)
+        response.chunks = None
+        response.headers['Content-Length'] = len(response.body)
+    elif response.file is not None:
+        body = response.body
+        response.close()
+        response.file = response.segments = None
+        response.body = body
+    response.head = response.build_head()
+    return response
+
+
+def _run(function, request, args, kwargs):
+    """Task of a worker process"""
+    # The servers of the imported modules, the one of the function among them
+    for server in list(_servers):
+        server.request = request
+    response = function(*args, **kwargs)
+    if is_stream(response):
+        response = Response(200, "OK", {'Content-Type':
+                                        'text/plain; charset=utf-8'},
+                            response)
+    return _portable_response(response)
+
+
+def _serve(connection):
+    """Loop of a worker process, answers (done, result or error) to every
+    task until the server asks it to exit or is gone"""
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            return
+        except Exception as error:
+            # The function could not be imported
+            _reply(connection, (False, error))
+            continue
+        if task is None:
+            return
+        try:
+            result = True, _run(*task)
+        except Exception as error:
+            result = False, error
+        _reply(connection, result)
+
+
+def _reply(connection, result):
+    try:
+        connection.send(result)
+    except Exception as error:
+        # Pickled before anything is written
+        connection.send((False, RuntimeError(
+            f'the result of the function can not be pickled: {error!r}')))
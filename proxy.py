@@ -0,0 +1,498 @@
+import socket
+import threading
+import time
+import itertools
+from collections import OrderedDict, deque
+from urllib.parse import urlsplit
+
+from errors import Error
+from response import Response
+
+BALANCING = ('round_robin', 'least_connections')
+# Headers of one connection, never forwarded
+HOP_BY_HOP = frozenset(('connection', 'keep-alive', 'proxy-authenticate',
+                        'proxy-authorization', 'proxy-connection', 'te',
+                        'trailer', 'transfer-encoding', 'upgrade'))
+# Methods retried on a fresh connection when a pooled one was stale
+IDEMPOTENT = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE', 'TRACE'))
+READ_SIZE = 65536
+MAX_HEAD_SIZE = 65536
+MAX_CHUNK_LINE = 4096
+HEAD_END = b'\r\n\r\n'
+CRLF = b'\r\n'
+
+
+class UpstreamError(ConnectionError):
+    """The upstream broke the protocol or the connection"""
+
+
+class _Stale(UpstreamError):
+    """The upstream closed the connection before answering"""
+
+
+class _Busy(Exception):
+    """No connection to the upstream got free in time"""
+
+
+class Upstream:
+    """A backend address with its pool of idle connections.
+
+    Attributes
+    ----------
+    host - Host of the backend
+    port - Port of the backend
+    idle - (socket, time.monotonic() it became idle) of the pooled
+           connections, most recently used last
+    active - Number of connections forwarding a request
+    fails - Number of consecutive failures
+    ejected_until - time.monotonic() before which no request is sent"""
+    __slots__ = ('host', 'port', 'idle', 'active', 'fails', 'ejected_until')
+
+    def __init__(self, host, port):
+        self.host: str = host
+        self.port: int = port
+        self.idle: deque = deque()
+        self.active: int = 0
+        self.fails: int = 0
+        self.ejected_until: float = 0.0
+
+    def __repr__(self):
+        return f'{self.host}:{self.port}'
+
+
+class Proxy:
+    """Forwards requests to a set of HTTP/1.1 backends.
+
+    Every upstream keeps a pool of persistent connections, at most
+    "max_connections" at once of which "max_idle" are kept between requests
+    and closed after "idle_timeout" seconds. A request waits up to
+    "connect_timeout" for a pooled connection or a new one, the backend has
+    "read_timeout" seconds for every read. Upstreams are chosen round-robin
+    or by the least number of active connections. After "max_fails"
+    consecutive failures an upstream is ejected for "fail_timeout" seconds,
+    then gets requests again until it fails once more. The response body is
+    streamed to the client as the backend sends it.
+
+    Attributes
+    ----------
+    upstreams - The Upstream of every backend address
+    balance - "round_robin" or "least_connections"
+    max_connections - Max number of connections to one upstream
+    max_idle - Max number of idle connections kept per upstream
+    idle_timeout - Seconds an idle connection is kept
+    connect_timeout - Seconds to get a connection to an upstream
+    read_timeout - Seconds an upstream may take to send more data
+    max_fails - Consecutive failures that eject an upstream
+    fail_timeout - Seconds an ejected upstream gets no request
+    preserve_host - Whether the Host header of the client is forwarded,
+                    else it names the upstream
+
+    Methods
+    ----------
+    forward - Sends the request to an upstream, returns its response
+    close - Closes the idle connections
+    stats - Returns the state of every upstream"""
+
+    def __init__(self, upstreams, balance='round_robin', max_connections=64,
+                 max_idle=16, idle_timeout=30, connect_timeout=2,
+                 read_timeout=30, max_fails=3, fail_timeout=10,
+                 preserve_host=True):
+        if balance not in BALANCING:
+            raise ValueError(f'balance must be one of {BALANCING}')
+        if isinstance(upstreams, (str, tuple)):
+            upstreams = [upstreams]
+        self.upstreams: list = [Upstream(*_address(upstream))
+                                for upstream in upstreams]
+        if not self.upstreams:
+            raise ValueError('at least one upstream is required')
+        self.balance: str = balance
+        self.max_connections: int = max_connections
+        self.max_idle: int = max_idle
+        self.idle_timeout: float = idle_timeout
+        self.connect_timeout: float = connect_timeout
+        self.read_timeout: float = read_timeout
+        self.max_fails: int = max_fails
+        self.fail_timeout: float = fail_timeout
+        self.preserve_host: bool = preserve_host
+        self._turn = itertools.count()
+        self._available = threading.Condition()
+
+    def forward(self, request):
+        """Returns the response of an upstream to the request, or a 502 or
+        504 error. The address of the client is added to X-Forwarded-For"""
+        stream = request.stream
+        stream.seek(0, 2)
+        size = stream.tell()
+        retried = False
+        # A failed connect moves on to the next upstream, once per upstream
+        attempts = len(self.upstreams)
+        while True:
+            upstream = self._choose()
+            if upstream is None:
+                return Error.BAD_GATEWAY
+            try:
+                client, reused = self._acquire(upstream)
+            except _Busy:
+                return Error.GATEWAY_TIMEOUT
+            except OSError:
+                self._failed(upstream)
+                attempts -= 1
+                if attempts > 0:
+                    continue
+                return Error.BAD_GATEWAY
+            try:
+                client.sendall(self._request_head(request, upstream, size))
+                if size:
+                    stream.seek(0)
+                    for block in iter(lambda: stream.read(READ_SIZE), b''):
+                        client.sendall(block)
+                return self._response(request, upstream, client)
+            except _Stale:
+                self._release(upstream, client, False)
+                if reused and not retried and request.method in IDEMPOTENT:
+                    retried = True
+                    continue
+                self._failed(upstream)
+                return Error.BAD_GATEWAY
+            except socket.timeout:
+                self._release(upstream, client, False)
+                self._failed(upstream)
+                return Error.GATEWAY_TIMEOUT
+            except OSError:
+                self._release(upstream, client, False)
+                self._failed(upstream)
+                return Error.BAD_GATEWAY
+
+    def _choose(self):
+        """Returns the upstream of the next request, None if all are
+        ejected"""
+        now = time.monotonic()
+        with self._available:
+            healthy = [upstream for upstream in self.upstreams
+                       if upstream.ejected_until <= now]
+            if not healthy:
+                return None
+            start = next(self._turn) % len(healthy)
+            if self.balance == 'round_robin':
+                return healthy[start]
+            # Ties go round-robin
+            return min(healthy[start:] + healthy[:start],
+                       key=lambda upstream: upstream.active)
+
+    def _failed(self, upstream):
+        with self._available:
+            upstream.fails += 1
+            if upstream.fails >= self.max_fails:
+                upstream.ejected_until = time.monotonic() + self.fail_timeout
+
+    def _succeeded(self, upstream):
+        upstream.fails = 0
+
+    def _acquire(self, upstream):
+        """Returns a connection to the upstream and whether it was pooled.
+        Raises _Busy when none is free within the connect timeout"""
+        deadline = time.monotonic() + self.connect_timeout
+        with self._available:
+            while True:
+                self._evict(upstream)
+                while upstream.idle:
+                    client, _ = upstream.idle.pop()
+                    if _alive(client):
+                        client.settimeout(self.read_timeout)
+                        upstream.active += 1
+                        return client, True
+                    client.close()
+                if upstream.active < self.max_connections:
+                    upstream.active += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise _Busy
+                self._available.wait(remaining)
+        try:
+            client = socket.create_connection((upstream.host, upstream.port),
+                                              self.connect_timeout)
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            self._release(upstream, None, False)
+            raise
+        client.settimeout(self.read_timeout)
+        return client, False
+
+    def _release(self, upstream, client, reusable):
+        """Returns the connection to the pool, or closes it"""
+        with self._available:
+            upstream.active -= 1
+            if client is not None:
+                if reusable and len(upstream.idle) < self.max_idle:
+                    upstream.idle.append((client, time.monotonic()))
+                else:
+                    client.close()
+            self._evict(upstream)
+            self._available.notify()
+
+    def _evict(self, upstream):
+        """Closes the connections idle for longer than the idle timeout,
+        the lock must be held"""
+        expired = time.monotonic() - self.idle_timeout
+        while upstream.idle and upstream.idle[0][1] <= expired:
+            upstream.idle.popleft()[0].close()
+
+    def _request_head(self, request, upstream, size):
+        headers = request.get_headers()
+        connection = {token.strip().lower() for token in
+                      headers.get('Connection', '').split(',')}
+        lines = [f'{request.method} {request.target} HTTP/1.1']
+        if not (self.preserve_host and 'Host' in headers):
+            lines.append(f'host: {upstream.host}:{upstream.port}')
+        for header, header_value in headers.items():
+            if (header in HOP_BY_HOP or header in connection
+                    or header in ('content-length', 'expect',
+                                  'x-forwarded-for')
+                    or (header == 'host' and not self.preserve_host)):
+                continue
+            lines.append(f'{header}: {header_value}')
+        forwarded = headers.get('X-Forwarded-For')
+        address = request.address
+        if address is not None:
+            client = address[0] if isinstance(address, tuple) else address
+            forwarded = f'{forwarded}, {client}' if forwarded else client
+        if forwarded:
+            lines.append(f'x-forwarded-for: {forwarded}')
+        if (size or 'Content-Length' in headers
+                or 'Transfer-Encoding' in headers):
+            lines.append(f'content-length: {size}')
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+    def _response(self, request, upstream, client):
+        """Reads the head of the upstream response and returns the response
+        streaming its body"""
+        buffer = bytearray()
+        while True:
+            status, message, headers, head = _read_head(client, buffer)
+            if not 100 <= status < 200:
+                break
+        self._succeeded(upstream)
+
+        lines = [f'HTTP/1.1 {status} {message}'.encode('latin-1')]
+        response_headers = OrderedDict()
+        connection = {token.strip().lower() for name, value in headers
+                      if name.lower() == 'connection'
+                      for token in value.split(',')}
+        length = chunked = None
+        for name, value in headers:
+            lower = name.lower()
+            if lower == 'content-length':
+                try:
+                    length = int(value)
+                except ValueError:
+                    raise UpstreamError('invalid upstream Content-Length')
+            elif lower == 'transfer-encoding':
+                chunked = value.strip().lower().endswith('chunked')
+            if (lower in HOP_BY_HOP or lower in connection
+                    or lower == 'content-length'):
+                continue
+            lines.append(f'{name}: {value}'.encode('latin-1'))
+            response_headers[name] = value
+        reusable = 'close' not in connection
+
+        if (request.method == 'HEAD' or status in (204, 304)
+                or (length == 0 and not chunked)):
+            if length is not None:
+                response_headers['Content-Length'] = length
+                lines.append(f'Content-Length: {length}'.encode('latin-1'))
+            self._release(upstream, client, reusable and not buffer)
+            return Response(status, message, response_headers, b'',
+                            head=CRLF.join(lines) + CRLF)
+
+        if chunked:
+            length = None
+        elif length is None:
+            # Delimited by the end of the connection
+            reusable = False
+        if length is not None:
+            response_headers['Content-Length'] = length
+            lines.append(f'Content-Length: {length}'.encode('latin-1'))
+        elif request.version == 'HTTP/1.1':
+            response_headers['Transfer-Encoding'] = 'chunked'
+            lines.append(b'Transfer-Encoding: chunked')
+        body = _Body(self, upstream, client, buffer, length, chunked,
+                     reusable)
+        return Response(status, message, response_headers, body,
+                        head=CRLF.join(lines) + CRLF)
+
+    def close(self):
+        with self._available:
+            for upstream in self.upstreams:
+                while upstream.idle:
+                    upstream.idle.pop()[0].close()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._available:
+            return {repr(upstream): {
+                'active': upstream.active, 'idle': len(upstream.idle),
+                'fails': upstream.fails,
+                'ejected': upstream.ejected_until > now}
+                for upstream in self.upstreams}
+
+
+class _Body:
+    """Iterator over the body of an upstream response. The connection goes
+    back to the pool once the body was read to its end, and is closed if
+    the iterator is closed before"""
+    __slots__ = ('proxy', 'upstream', 'client', 'buffer', 'remaining',
+                 'chunked', 'reusable', 'done')
+
+    def __init__(self, proxy, upstream, client, buffer, length, chunked,
+                 reusable):
+        self.proxy = proxy
+        self.upstream = upstream
+        self.client = client
+        self.buffer = buffer
+        self.remaining = length
+        self.chunked = chunked
+        self.reusable = reusable
+        self.done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.done:
+            raise StopIteration
+        try:
+            data = self._read()
+        except OSError as error:
+            self.close()
+            if isinstance(error, ConnectionError):
+                raise
+            raise UpstreamError(f'upstream read failed: {error}') from error
+        if not data:
+            self._finish()
+            raise StopIteration
+        return data
+
+    def _recv(self):
+        data = self.client.recv(READ_SIZE)
+        if not data:
+            raise UpstreamError('upstream closed the connection')
+        return data
+
+    def _read(self):
+        if self.buffer:
+            data = bytes(self.buffer)
+            self.buffer.clear()
+        elif self.chunked:
+            return self._read_chunk()
+        elif self.remaining is None:
+            data = self.client.recv(READ_SIZE)
+        elif self.remaining > 0:
+            data = self._recv()
+        else:
+            return b''
+        if self.chunked:
+            # Put back, chunk framing is parsed from the buffer
+            self.buffer += data
+            return self._read_chunk()
+        if self.remaining is not None:
+            if len(data) > self.remaining:
+                # Bytes after the body, the connection can not be reused
+                self.reusable = False
+                data = data[:self.remaining]
+            self.remaining -= len(data)
+        return data
+
+    def _read_chunk(self):
+        """Returns the data of the next chunk, b'' after the last one"""
+        line = self._line()
+        try:
+            size = int(line.split(b';', 1)[0], 16)
+        except ValueError:
+            raise UpstreamError('invalid chunk size')
+        if size == 0:
+            # Trailers up to the empty line
+            while self._line():
+                pass
+            self.reusable = self.reusable and not self.buffer
+            return b''
+        while len(self.buffer) < size + 2:
+            self.buffer += self._recv()
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size + 2]
+        return data
+
+    def _line(self):
+        while True:
+            end = self.buffer.find(CRLF)
+            if end >= 0:
+                line = bytes(self.buffer[:end])
+                del self.buffer[:end + 2]
+                return line
+            if len(self.buffer) > MAX_CHUNK_LINE:
+                raise UpstreamError('chunk line too long')
+            self.buffer += self._recv()
+
+    def _finish(self):
+        self.done = True
+        self.proxy._release(self.upstream, self.client, self.reusable)
+
+    def close(self):
+        if not self.done:
+            self.done = True
+            self.proxy._release(self.upstream, self.client, False)
+
+
+def _address(upstream):
+    """Returns (host, port) of "host:port", "http://host:port" or a pair"""
+    if isinstance(upstream, tuple):
+        return upstream[0], int(upstream[1])
+    if '//' not in upstream:
+        upstream = '//' + upstream
+    url = urlsplit(upstream)
+    return url.hostname, url.port or 80
+
+
+def _alive(client):
+    """Whether a pooled connection is still open, without blocking"""
+    try:
+        client.settimeout(0)
+        client.recv(1, socket.MSG_PEEK)
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+    # Closed, or bytes sent before any request
+    return False
+
+
+def _read_head(client, buffer):
+    """Reads a response head, the bytes after it stay in "buffer". Returns
+    (status, message, [(name, value)], head)"""
+    while True:
+        end = buffer.find(HEAD_END)
+        if end >= 0:
+            break
+        if len(buffer) > MAX_HEAD_SIZE:
+            raise UpstreamError('upstream head too large')
+        data = client.recv(READ_SIZE)
+        if not data:
+            if not buffer:
+                raise _Stale('upstream closed the connection')
+            raise UpstreamError('upstream closed the connection')
+        buffer += data
+    head = bytes(buffer[:end])
+    del buffer[:end + len(HEAD_END)]
+    lines = head.split(CRLF)
+    try:
+        _, status, *message = lines[0].decode('latin-1').split(' ', 2)
+        status = int(status)
+    except ValueError:
+        raise UpstreamError('invalid upstream status line')
+    headers = []
+    for line in lines[1:]:
+        name, colon, value = line.decode('latin-1').partition(':')
+        if not colon:
+            raise UpstreamError('invalid upstream header')
+        headers.append((name.strip(), value.strip()))
+    return status, message[0] if message else '', headers, head
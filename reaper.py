@@ -0,0 +1,153 @@
+import socket
+import selectors
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class Connection:
+    """A client connection of the threaded server.
+
+    The connection moves between the reaper, while the client sends
+    nothing, and a worker thread, while there is data to serve. Its parser
+    keeps the bytes of a partly received request in between.
+
+    Attributes
+    ----------
+    client - Socket of the client
+    address - Address of the client
+    parser - RequestParser of the connection
+    served - Number of requests served
+    deadline - time.monotonic() by which the client must send more data
+    queued - time.monotonic() at which the connection was dispatched with
+             data to serve, None once a worker took it"""
+    __slots__ = ('client', 'address', 'parser', 'served', 'deadline',
+                 'queued')
+
+    def __init__(self, client, address, parser, deadline):
+        self.client: socket.socket = client
+        self.address = address
+        self.parser = parser
+        self.served: int = 0
+        self.deadline: float = deadline
+        self.queued: float = None
+
+    def fileno(self):
+        return self.client.fileno()
+
+
+class Reaper:
+    """Selector thread watching the connections that have nothing to serve.
+
+    Parked connections cost a file descriptor and no thread. Once a client
+    sends data its connection is handed to "dispatch", connections past
+    their deadline are handed to "expire". When more than "max_connections"
+    are parked, the longest parked one is expired to make room.
+
+    Attributes
+    ----------
+    dispatch - Called with a connection that became readable
+    expire - Called with a connection that timed out, it must close it
+    max_connections - Max number of parked connections
+    parked - Parked connections, longest parked first
+
+    Methods
+    ----------
+    park - Watches the connection until it is readable or times out
+    run - Selector loop, runs until stop
+    stop - Stops the loop and expires the parked connections"""
+
+    def __init__(self, dispatch, expire, max_connections=1024):
+        self.dispatch = dispatch
+        self.expire = expire
+        self.max_connections: int = max_connections
+        self._parked: OrderedDict = OrderedDict()
+        self._pending: deque = deque()
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._next_deadline = float('inf')
+        self._stopped = threading.Event()
+
+    def __len__(self):
+        return len(self._parked) + len(self._pending)
+
+    def park(self, connection: Connection):
+        """Thread-safe, registration happens in the selector thread"""
+        self._pending.append(connection)
+        try:
+            self._wakeup_w.send(b'\0')
+        except BlockingIOError:
+            # A wakeup is already pending
+            pass
+
+    def run(self):
+        while not self._stopped.is_set():
+            timeout = min(max(self._next_deadline - time.monotonic(), 0), 1)
+            for key, _ in self._selector.select(timeout):
+                if key.fileobj is self._wakeup_r:
+                    self._drain_wakeup()
+                    continue
+                connection = key.fileobj
+                self._selector.unregister(connection)
+                del self._parked[connection]
+                self.dispatch(connection)
+            self._register_pending()
+            if time.monotonic() >= self._next_deadline:
+                self._reap()
+        self._close()
+
+    def stop(self):
+        self._stopped.set()
+        try:
+            self._wakeup_w.send(b'\0')
+        except OSError:
+            pass
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_r.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _register_pending(self):
+        while self._pending:
+            connection = self._pending.popleft()
+            if len(self._parked) >= self.max_connections:
+                oldest, _ = self._parked.popitem(last=False)
+                self._selector.unregister(oldest)
+                self.expire(oldest)
+            try:
+                self._selector.register(connection, selectors.EVENT_READ)
+            except (ValueError, OSError):
+                # Closed meanwhile
+                self.expire(connection)
+                continue
+            self._parked[connection] = None
+            self._next_deadline = min(self._next_deadline,
+                                      connection.deadline)
+
+    def _reap(self):
+        now = time.monotonic()
+        next_deadline = float('inf')
+        for connection in list(self._parked):
+            if connection.deadline <= now:
+                del self._parked[connection]
+                self._selector.unregister(connection)
+                self.expire(connection)
+            else:
+                next_deadline = min(next_deadline, connection.deadline)
+        self._next_deadline = next_deadline
+
+    def _close(self):
+        self._register_pending()
+        for connection in list(self._parked):
+            self._selector.unregister(connection)
+            self.expire(connection)
+        self._parked.clear()
+        self._selector.close()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
@@ -1,8 +1,49 @@
-import chardet
-from urllib.parse import urlparse
+import io
+import tempfile
+from collections import deque
+from urllib.parse import urlsplit
+
+from errors import Error
+from multipart import parse_form
+
+HEAD_END = b'\r\n\r\n'
+CRLF = b'\r\n'
+SPOOL_SIZE = 1024 * 1024
+MAX_CHUNK_LINE = 4096
+
+
+class Headers(dict):
+    """Dictionary of request headers with case-insensitive names.
+    Names are stored in lower case"""
+
+    def __init__(self, headers=None):
+        super().__init__()
+        for header, header_value in dict(headers or {}).items():
+            self[header] = header_value
+
+    def __setitem__(self, header, header_value):
+        super().__setitem__(header.lower(), header_value)
+
+    def __getitem__(self, header):
+        return super().__getitem__(header.lower())
+
+    def __delitem__(self, header):
+        super().__delitem__(header.lower())
+
+    def __contains__(self, header):
+        return super().__contains__(header.lower())
+
+    def get(self, header, default=None):
+        return super().get(header.lower(), default)
+
+    def pop(self, header, *default):
+        return super().pop(header.lower(), *default)
+
 
 class Request:
     """NYI"""
+    __slots__ = ('data', 'method', 'version', 'target', 'url', 'query',
+                 '_body', '_stream', '_form', 'headers', 'address')
 
     def __init__(self, data=None):
         self.data = data
@@ -10,27 +51,267 @@ class Request:
         self.version = None
         self.target = None
         self.url = None
-        self.body = None
-        self._headers = {}
+        self.query = None
+        self._body = None
+        self._stream = None
+        self._form = None
+        self.headers = Headers()
+        self.address = None
+
+    @property
+    def body(self):
+        """The whole body as bytes. A streamed body is read into memory on
+        the first access, large bodies are better read from the stream"""
+        if self._body is None and self._stream is not None:
+            self._stream.seek(0)
+            self._body = self._stream.read()
+            self._stream.seek(0)
+        return self._body
+
+    @body.setter
+    def body(self, body):
+        self._body = body
+
+    @property
+    def stream(self):
+        """The body as a binary file object, in memory up to the spool size
+        and in a temporary file above it"""
+        if self._stream is None:
+            self._stream = io.BytesIO(self._body or b'')
+        return self._stream
+
+    def form(self, spool_size=SPOOL_SIZE):
+        """Returns the Form of an urlencoded or multipart/form-data body,
+        parsed on the first call. Uploaded files are spooled to disk above
+        "spool_size" bytes"""
+        if self._form is None:
+            self.stream.seek(0)
+            self._form = parse_form(self.headers.get('Content-Type'),
+                                    self.stream, spool_size)
+        return self._form
+
+    def close(self):
+        """Releases the temporary files of the body and the form"""
+        if self._form is not None:
+            self._form.close()
+        if self._stream is not None:
+            self._stream.close()
 
     def parse_request(self):
-        data = str(self.data, chardet.detect(self.data)["encoding"])
-        lines = data.split('\r\n')
-        line = lines[0]
-        self.method, self.target, self.version = line.split()
-        self.url = urlparse(self.target).path
+        head, _, body = self.data.partition(HEAD_END)
+        self._parse_head(head)
+        self.body = body
+
+    def _parse_head(self, head, max_headers=None):
+        """Parses the request line and headers. Only the separate fields are
+        decoded, the bytes are split as they are"""
+        lines = head.split(CRLF)
+        try:
+            method, target, version = lines[0].split()
+        except ValueError:
+            raise Error.BAD_REQUEST
+        self.method = method.decode('ascii', 'replace')
+        self.target = target.decode('latin-1')
+        self.version = version.decode('ascii', 'replace')
+        url = urlsplit(self.target)
+        self.url, self.query = url.path, url.query
 
         if self.url.endswith('/') and self.url != '/':
             self.url = self.url[:-1]
 
-        for line in lines[1:-2]:
-            header, header_value = line.split(": ")
-            self._headers[header] = header_value
+        if max_headers is not None and len(lines) - 1 > max_headers:
+            raise Error.HEADERS_TOO_LARGE
+        for line in lines[1:]:
+            header, colon, header_value = line.partition(b':')
+            if not colon or not header or header != header.strip():
+                raise Error.BAD_REQUEST
+            self.headers[header.decode('latin-1')] = (
+                header_value.strip().decode('latin-1'))
 
     def get_headers(self):
-        return self._headers
+        return self.headers
 
     def print_headers(self):
         print(self.method, self.target, self.version, sep=' ')
-        for header in self._headers:
-            print(header + ':', self._headers[header], sep=' ')
\ No newline at end of file
+        for header in self.headers:
+            print(header + ':', self.headers[header], sep=' ')
+
+
+class RequestParser:
+    """Incremental parser of the requests of one connection.
+
+    Bytes are fed as they arrive from the socket, in pieces of any size.
+    Complete requests are appended to "requests", including pipelined ones.
+    Bodies are read by Content-Length or chunked transfer encoding and
+    written to the request stream as they arrive: in memory up to
+    "spool_size" bytes, in a temporary file above it.
+
+    Attributes
+    ----------
+    max_header_size - Max size of the request line and headers in bytes
+    max_headers - Max number of headers of one request
+    max_body_size - Max size of a body in bytes, None for no limit
+    spool_size - Bodies above this size are spooled to disk
+    requests - Complete requests not yet taken by the server
+    state - What is being received: "head", "body" or None
+    expect_continue - Set when the request being received waits for a
+                      "100 Continue" answer before sending its body"""
+    __slots__ = ('max_header_size', 'max_headers', 'max_body_size',
+                 'spool_size', 'requests', 'expect_continue', '_buffer',
+                 '_scanned', '_request', '_body', '_length', '_received',
+                 '_chunked', '_crlf')
+
+    def __init__(self, max_header_size=65536, max_headers=100,
+                 max_body_size=None, spool_size=SPOOL_SIZE):
+        self.max_header_size: int = max_header_size
+        self.max_headers: int = max_headers
+        self.max_body_size: int = max_body_size
+        self.spool_size: int = spool_size
+        self.requests: deque = deque()
+        self.expect_continue: bool = False
+        self._buffer = bytearray()
+        self._scanned = 0
+        self._request = None
+        self._body = None
+        self._length = None
+        self._received = 0
+        self._chunked = False
+        self._crlf = False
+
+    @property
+    def state(self):
+        """"body" while a body is received, "head" while a head is, None
+        between requests"""
+        if self._request is not None:
+            return 'body'
+        return 'head' if self._buffer else None
+
+    def feed(self, data):
+        """Consumes "data" and returns the number of complete requests"""
+        self._buffer += data
+        while self._step():
+            pass
+        return len(self.requests)
+
+    def _step(self):
+        if self._request is None:
+            return self._read_head()
+        if self._chunked:
+            return self._read_chunk()
+        return self._read_body()
+
+    def _read_head(self):
+        end = self._buffer.find(HEAD_END, self._scanned)
+        if end < 0:
+            if len(self._buffer) > self.max_header_size:
+                raise Error.HEADERS_TOO_LARGE
+            self._scanned = max(len(self._buffer) - len(HEAD_END) + 1, 0)
+            return False
+        if end > self.max_header_size:
+            raise Error.HEADERS_TOO_LARGE
+        request = Request(bytes(self._buffer[:end + len(HEAD_END)]))
+        request._parse_head(request.data[:end], self.max_headers)
+        del self._buffer[:end + len(HEAD_END)]
+        self._scanned = 0
+
+        encoding = request.headers.get('Transfer-Encoding', '').lower()
+        self._chunked = encoding.endswith('chunked')
+        self._length = None
+        if not self._chunked:
+            try:
+                self._length = int(request.headers.get('Content-Length', 0))
+            except ValueError:
+                raise Error.BAD_REQUEST
+            if self._length < 0:
+                raise Error.BAD_REQUEST
+            self._check_size(self._length)
+        self._request = request
+        self._received = 0
+        self._crlf = False
+        self.expect_continue = bool(
+            request.version == 'HTTP/1.1' and (self._chunked or self._length)
+            and request.headers.get('Expect', '').lower() == '100-continue')
+        return True
+
+    def _check_size(self, size):
+        if self.max_body_size is not None and size > self.max_body_size:
+            raise Error.PAYLOAD_TOO_LARGE
+
+    def _write(self, size):
+        """Moves "size" bytes of the buffer into the body"""
+        if self._body is None:
+            self._body = tempfile.SpooledTemporaryFile(
+                max_size=self.spool_size)
+        with memoryview(self._buffer) as view:
+            self._body.write(view[:size])
+        del self._buffer[:size]
+        self._received += size
+
+    def _read_body(self):
+        size = min(len(self._buffer), self._length - self._received)
+        if size:
+            self._write(size)
+        if self._received < self._length:
+            return False
+        self._finish()
+        return True
+
+    def _read_chunk(self):
+        if self._crlf:
+            # End of the data of a chunk
+            if len(self._buffer) < len(CRLF):
+                return False
+            if self._buffer[:len(CRLF)] != CRLF:
+                raise Error.BAD_REQUEST
+            del self._buffer[:len(CRLF)]
+            self._crlf = False
+            self._length = None
+            return True
+        if self._length is None:
+            end = self._buffer.find(CRLF)
+            if end < 0:
+                if len(self._buffer) > MAX_CHUNK_LINE:
+                    raise Error.BAD_REQUEST
+                return False
+            size = bytes(self._buffer[:end]).split(b';', 1)[0]
+            try:
+                self._length = int(size, 16)
+            except ValueError:
+                raise Error.BAD_REQUEST
+            if self._length < 0:
+                raise Error.BAD_REQUEST
+            self._check_size(self._received + self._length)
+            del self._buffer[:end + len(CRLF)]
+            return True
+        if self._length == 0:
+            # Trailer section ends with an empty line
+            end = self._buffer.find(CRLF)
+            if end < 0:
+                if len(self._buffer) > self.max_header_size:
+                    raise Error.HEADERS_TOO_LARGE
+                return False
+            del self._buffer[:end + len(CRLF)]
+            if end == 0:
+                self._finish()
+            return True
+        size = min(len(self._buffer), self._length)
+        if not size:
+            return False
+        self._write(size)
+        self._length -= size
+        if not self._length:
+            self._crlf = True
+        return True
+
+    def _finish(self):
+        if self._body is not None:
+            self._body.seek(0)
+            self._request._stream = self._body
+        else:
+            self._request.body = b''
+        self.requests.append(self._request)
+        self.expect_continue = False
+        self._request = None
+        self._body = None
+        self._length = None
+        self._chunked = False
@@ -1,173 +1,690 @@
 import os
-from collections import OrderedDict
-from errors import HTTPResponseError
+import json
+import html
+import asyncio
+import contextvars
+import threading
+import uuid
+import zlib
+from email.utils import formatdate, parsedate_to_datetime
+from collections import OrderedDict, deque
+from urllib.parse import parse_qs, quote
+
+LISTING_PAGE_SIZE = 1000
+MAX_RANGES = 100
+# Statuses never sending a body, nor an implied Content-Length
+NO_BODY = frozenset((204, 304))
+LISTINGS_CACHE_SIZE = 256
+CONNECTION_LINES_CACHE_SIZE = 64
+# A chunk of an asynchronous streamed body is sent as soon as it is
+# produced, joined with the ones already waiting up to this many bytes
+CHUNK_FLUSH_SIZE = 16384
+# Max bytes produced ahead of the send
+CHUNK_PUMP_SIZE = 4 * CHUNK_FLUSH_SIZE
+LAST_CHUNK = b'0\r\n\r\n'
+# Batches of more chunks are joined into one buffer
+MAX_SCATTER = 16
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+
+_connection_lines: dict = {}
 
 
 class Response:
     """NYI"""
+    __slots__ = ('status', 'message', 'headers', '_body', 'file', 'offset',
+                 'length', 'head', 'segments', 'chunks')
+    _listings: OrderedDict = OrderedDict()
+    _listings_lock = threading.Lock()
 
-    def __init__(self, status=None, message=None, headers=None, body=None):
+    def __init__(self, status=None, message=None, headers=None, body=None,
+                 file=None, offset=0, length=None, head=None,
+                 segments=None):
         self.status = status
         self.message = message
         self.headers = OrderedDict(headers or {})
+        self.chunks = None
+        if is_stream(body):
+            # Sent chunk by chunk as the iterator yields them
+            self.chunks = (body.__aiter__() if hasattr(body, '__aiter__')
+                           else iter(body))
+            body = None
         self.body = body
+        self.file = file
+        self.offset = offset
+        self.length = length
+        self.head = head
+        self.segments = segments
+
+    @property
+    def body(self):
+        """The body bytes. A file body is only read when this is accessed,
+        the server sends it straight from the file"""
+        if self._body is None and self.file is not None:
+            return b''.join(
+                os.pread(self.file.fileno(), segment[1], segment[0])
+                if isinstance(segment, tuple) else segment
+                for segment in self.file_segments())
+        return self._body
+
+    @body.setter
+    def body(self, body):
+        self._body = body
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
 
     def __str__(self):
-        return self._get_headers()
+        return self.get_headers()
 
     def status_code(self):
         return f'HTTP/1.1 {self.status} {self.message}'
 
-    def _get_headers(self):
+    def get_headers(self):
         return "".join(f'{h}: {hv}\r\n' for (h, hv) in self.headers.items())
 
     @staticmethod
-    def response_dir(request, path, **additional_headers):
+    def _list_dir(path):
+        """Returns the sorted (name, is_file) entries of the directory, one
+        scandir pass cached until the mtime of the directory changes"""
+        mtime = os.stat(path).st_mtime_ns
+        with Response._listings_lock:
+            cached = Response._listings.get(path)
+            if cached is not None and cached[0] == mtime:
+                Response._listings.move_to_end(path)
+                return cached[1]
+        with os.scandir(path) as scan:
+            entries = [(entry.name, entry.is_file()) for entry in scan]
+        entries.sort(key=lambda entry: (entry[1], entry[0]))
+        with Response._listings_lock:
+            Response._listings[path] = mtime, entries
+            if len(Response._listings) > LISTINGS_CACHE_SIZE:
+                Response._listings.popitem(last=False)
+        return entries
+
+    @staticmethod
+    def response_dir(request, path, base=None, parent=None,
+                     **additional_headers):
+        """Returns a listing of the directory, as HTML or as JSON for
+        "?format=json" and "Accept: application/json". Directories with more
+        than LISTING_PAGE_SIZE entries are split into pages, "?page=N".
+        With "base", the url of the directory ending with "/", the HTML
+        links are absolute urls under it, "parent" being the url of the
+        parent directory if it has a listing. Both are already quoted"""
         request_headers = request.get_headers()
-        connection = request_headers.get('Connection')
-        filename_css = os.path.join(os.getcwd(), 'static', 'css', 'bootstrap.min.css')
-        filename_js = os.path.join(os.getcwd(), 'static', 'js', 'bootstrap.min.js')
-        dirs = []
-        files = []
+        query = parse_qs(request.query or '')
+        entries = Response._list_dir(path)
+        pages = max((len(entries) - 1) // LISTING_PAGE_SIZE + 1, 1)
+        try:
+            page = min(max(int(query.get('page', ['1'])[0]), 1), pages)
+        except ValueError:
+            page = 1
+        entries = entries[(page - 1) * LISTING_PAGE_SIZE:
+                          page * LISTING_PAGE_SIZE]
+
+        if ('json' in query.get('format', [])
+                or 'application/json' in request_headers.get('Accept', '')):
+            content_type = 'application/json'
+            body = json.dumps({
+                'path': path, 'page': page, 'pages': pages,
+                'entries': [{'name': name,
+                             'type': 'file' if is_file else 'dir'}
+                            for (name, is_file) in entries]}).encode('utf-8')
+        else:
+            content_type = 'text/html'
+            body = Response._listing_page(request, path, entries, page,
+                                          pages, base, parent).encode('utf-8')
+
+        headers = OrderedDict([('Content-Type', content_type),
+                               ('Content-Length', len(body))])
+        for (header, header_value) in additional_headers.items():
+            headers[header] = header_value
+        return Response(200, "OK", headers, body)
+
+    @staticmethod
+    def _listing_page(request, path, entries, page, pages, base=None,
+                      parent=None):
         start_dir = os.getcwd()
-        title_tag = f"<head>\n<title>Listing for: {path}</title>\n</head>\n"
-        doctype = "<!DOCTYPE html><html>\n"
-        result = ''
-        result += "<!DOCTYPE html>\n"
-        result += '<html lang="en">\n'
-        result += '<meta charset="UTF-8">\n'
-        result += f"<head>\n<title>Listing for: {path}</title>\n"
-
-        result += '<link href="https://cdn.jsdelivr.net/npm/bootstrap@5.0.0-beta1/dist/css/bootstrap.min.css" rel="stylesheet" integrity="sha384-giJF6kkoqNQ00vy+HMDP7azOuL0xtbfIcaT9wjKHr8RbDVddVHyTfAAsrekwKmP1" crossorigin="anonymous">'
-       # result += f'<link rel="stylesheet" type="text/css" href="{filename}">\n'
-        result += '</head>\n'
-        result += f"<body><h1>Listing for: {path}</h1><hr>\n<ul>"
-
-        result += """<div class="container">
-  			<div class="row">
-        <table class="table">
-  <thead>
-    <tr>
-      <th scope="col">#</th>
-      <th scope="col">First</th>
-      <th scope="col">Last</th>
-      <th scope="col">Handle</th>
-    </tr>
-  </thead>
-  <tbody>
-    <tr>
-      <th scope="row">1</th>
-      <td>{123}</td>
-      <td>Otto</td>
-      <td>@mdo</td>
-    </tr>
-    
-    <tr>
-      <th scope="row">2</th>
-      <td>Jacob</td>
-      <td>Thornton</td>
-      <td>@fat</td>
-    </tr>
-    
-    <tr>
-      <th scope="row">3</th>
-      <td>Larry the Bird</td>
-      <td></td>
-      <td>@twitter</td>
-    </tr>
-    
-    
-    
-    
-  </tbody>
-</table>
-</div>
-</div>"""
-
-        body_tag = f"</head>\n<body><h1>Listing for: {path}</h1><hr>\n<ul>"
-        page_content = doctype + title_tag + body_tag
-        button = "<li><a  href=\"{name}\" {download}>{name}</a>Size:</li>\n"
-
-        if path != start_dir:
-            prev_dirs = request.url.replace('\\', '/').split('/')
-            prev_path = '/'
-            for directory in prev_dirs[:-1]:
-                prev_path = os.path.join(prev_path, directory)
-
-            prev_path = prev_path.replace('\\', '/')
-
-            page_content += button.format(name=prev_path, download=None)
-
-        for name in os.listdir(path):
-            join_path = os.path.join(path, name)
-            bname = name
-            if os.path.basename(path) != os.path.basename(os.getcwd()):
-                bname = os.path.join(os.path.basename(path), name)
-
-            if os.path.isfile(join_path):
-                page_content += button.format(name=bname, download='download')
-                files.append(name)
+        button = "<li><a  href=\"{name}\" {download}>{name}</a></li>\n"
+        page_content = [
+            "<!DOCTYPE html><html>\n",
+            f"<head>\n<title>Listing for: {path}</title>\n</head>\n",
+            f"</head>\n<body><h1>Listing for: {path}</h1><hr>\n<ul>"]
+
+        if base is not None:
+            link = "<li><a href=\"{href}\"{download}>{name}</a></li>\n"
+            if parent is not None:
+                page_content.append(link.format(href=html.escape(parent),
+                                                download='', name='..'))
+            for name, is_file in entries:
+                href = base + quote(name) + ('' if is_file else '/')
+                page_content.append(link.format(
+                    href=html.escape(href),
+                    download=' download' if is_file else '',
+                    name=html.escape(name)))
+        else:
+            if path != start_dir:
+                prev_dirs = (request.url or '/').replace('\\', '/').split('/')
+                prev_path = '/'
+                for directory in prev_dirs[:-1]:
+                    prev_path = os.path.join(prev_path, directory)
+
+                prev_path = prev_path.replace('\\', '/')
+
+                page_content.append(button.format(name=prev_path,
+                                                  download=None))
+
+            prefix = ''
+            if os.path.basename(path) != os.path.basename(start_dir):
+                prefix = os.path.basename(path)
+            for name, is_file in entries:
+                bname = os.path.join(prefix, name) if prefix else name
+                page_content.append(button.format(
+                    name=bname, download='download' if is_file else None))
+
+        page_content.append("</ul>\n")
+        if pages > 1:
+            page_content.append(f"<p>Page {page} of {pages}</p>\n")
+            if page > 1:
+                page_content.append(
+                    f'<a href="?page={page - 1}">Previous</a>\n')
+            if page < pages:
+                page_content.append(f'<a href="?page={page + 1}">Next</a>\n')
+        page_content.append("</body>\n</html>\n")
+        return "".join(page_content)
+
+    @staticmethod
+    def validators(stat, variant=''):
+        """Returns the ETag and Last-Modified of a file from its stat.
+        "variant" tells apart representations of the same file"""
+        etag = f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+        if variant:
+            etag += f'-{zlib.crc32(variant.encode("utf-8")):x}'
+        return f'"{etag}"', formatdate(stat.st_mtime, usegmt=True)
+
+    @staticmethod
+    def is_not_modified(request, etag, mtime):
+        """Checks If-None-Match, or If-Modified-Since without it, of a GET or
+        HEAD request. ETags are compared weakly"""
+        if request.method not in ('GET', 'HEAD', None):
+            return False
+        request_headers = request.get_headers()
+        if_none_match = request_headers.get('If-None-Match')
+        if if_none_match is not None:
+            if if_none_match.strip() == '*':
+                return True
+            tags = {strip_weak(tag.strip())
+                    for tag in if_none_match.split(',')}
+            return strip_weak(etag) in tags
+        if_modified_since = request_headers.get('If-Modified-Since')
+        if if_modified_since is None:
+            return False
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(mtime) <= since
+
+    @staticmethod
+    def parse_ranges(header_range, size):
+        """Returns the (first, last) byte positions of a Range header, merged
+        where they overlap, [] if none of them is satisfiable, or None if the
+        header is invalid and must be ignored"""
+        unit, _, value = header_range.partition('=')
+        if unit.strip().lower() != 'bytes' or not value:
+            return None
+        ranges = []
+        for spec in value.split(','):
+            first, dash, last = spec.strip().partition('-')
+            if not dash or not (first or last):
+                return None
+            try:
+                if not first:
+                    suffix = int(last)
+                    if suffix > 0 and size > 0:
+                        ranges.append((max(size - suffix, 0), size - 1))
+                    continue
+                first = int(first)
+                if last and int(last) < first:
+                    return None
+                last = int(last) if last else size - 1
+            except ValueError:
+                return None
+            if first < size:
+                ranges.append((first, min(last, size - 1)))
+        if len(ranges) > MAX_RANGES:
+            return None
+
+        merged = []
+        for first, last in sorted(ranges):
+            if merged and first <= merged[-1][1] + 1:
+                merged[-1] = merged[-1][0], max(merged[-1][1], last)
             else:
-                page_content += button.format(name=bname, download=None)
-                dirs.append(name.upper() + "/")
-
-        dirs.sort()
-        dirs.extend(files)
-
-        result += "</ul>\n</body>\n</html>\n"
-        page_content += "</ul>\n</body>\n</html>\n"
-
-        body = page_content.encode('utf-8')
-        result = result.encode('utf-8')
-        headers = {('Content-Type', 'text/html'),
-                   ('Content-Length', len(body)),
-                   ('Connection', connection)}
-        headers = OrderedDict(headers)
-        for (header, header_value) in additional_headers or []:
-            headers[header] = header_value
-        return Response(200, "OK", headers, result)
+                merged.append((first, last))
+        return merged
 
     @staticmethod
     def response_file(request, path, content_type, **additional_headers):
-        start, end, size = None, None, None
+        """Returns a response streaming the file, or the requested ranges of
+        it, from an open handle. Nothing is read into memory: several ranges
+        are sent as multipart/byteranges parts straight from the file"""
         request_headers = request.get_headers()
         header_range = request_headers.get("Range")
-        with open(path, 'rb') as file:
-            if header_range:
-                _, value = header_range.split('=')
-                start, end = value.split('-', maxsplit=1)
-                if not end:
-                    end = os.path.getsize(path)
-                if not start:
-                    start = int(end)
-                    end = os.path.getsize(path)
-                    start = end - start
-                start, end = int(start), int(end)
-                file.seek(start, 0)
-                body = file.read(end - start)
+        file = open(path, 'rb')
+        stat = os.fstat(file.fileno())
+        size = stat.st_size
+
+        ranges = None
+        if header_range:
+            if_range = request_headers.get('If-Range')
+            if if_range is None or if_range in Response.validators(stat):
+                ranges = Response.parse_ranges(header_range, size)
+
+        headers = OrderedDict([('Content-Type', content_type),
+                               ('Accept-Ranges', 'bytes')])
+        for (header, header_value) in additional_headers.items():
+            headers[header] = header_value
+
+        if ranges is None:
+            headers['Content-Length'] = size
+            return Response(200, "OK", headers, file=file, offset=0,
+                            length=size)
+        if not ranges:
+            file.close()
+            headers['Content-Range'] = f'bytes */{size}'
+            del headers['Content-Type']
+            return Response(416, "Range Not Satisfiable", headers, b'')
+        if len(ranges) == 1:
+            first, last = ranges[0]
+            headers['Content-Range'] = f'bytes {first}-{last}/{size}'
+            headers['Content-Length'] = last - first + 1
+            return Response(206, "Partial Content", headers, file=file,
+                            offset=first, length=last - first + 1)
+
+        boundary = uuid.uuid4().hex
+        segments = []
+        for first, last in ranges:
+            segments.append((f'--{boundary}\r\n'
+                             f'Content-Type: {content_type}\r\n'
+                             f'Content-Range: bytes {first}-{last}/{size}'
+                             f'\r\n\r\n').encode('utf-8'))
+            segments.append((first, last - first + 1))
+            segments.append(b'\r\n')
+        segments.append(f'--{boundary}--\r\n'.encode('utf-8'))
+        length = sum(segment[1] if isinstance(segment, tuple)
+                     else len(segment) for segment in segments)
+        headers['Content-Type'] = f'multipart/byteranges; boundary={boundary}'
+        headers['Content-Length'] = length
+        return Response(206, "Partial Content", headers, file=file,
+                        length=length, segments=segments)
+
+    def file_segments(self):
+        """The parts of a file body: bytes to send as they are and
+        (offset, length) pairs of the file"""
+        return self.segments or [(self.offset, self.length)]
+
+    def build_head(self, connection_headers=()):
+        """Returns the status line and the stored headers as bytes, without
+        the headers named in "connection_headers" """
+        headers = OrderedDict((h, hv) for (h, hv) in self.headers.items()
+                              if h not in connection_headers)
+        if ('Content-Length' not in headers and self.status not in NO_BODY
+                and getattr(self, 'chunks', None) is None):
+            if getattr(self, 'file', None) is not None:
+                headers['Content-Length'] = self.length
+            else:
+                headers['Content-Length'] = len(self.body or b'')
+        content = (self.status_code() + '\r\n').encode('utf-8')
+        content += "".join(f'{h}: {hv}\r\n'
+                           for (h, hv) in headers.items()).encode('utf-8')
+        return content
+
+    def serialize_head(self, connection_headers=None):
+        """Returns the status line and headers as bytes. "connection_headers"
+        are set by the server for the current connection and override the
+        stored ones. A pre-serialized "head" is used as it is, objects with a
+        "heads" dictionary (the shared error responses) keep theirs there"""
+        connection_headers = connection_headers or {}
+        head = getattr(self, 'head', None)
+        if head is None:
+            heads = getattr(self, 'heads', None)
+            names = tuple(connection_headers)
+            head = heads.get(names) if heads is not None else None
+            if head is None:
+                head = Response.build_head(self, connection_headers)
+                if heads is not None:
+                    heads[names] = head
+        items = tuple(connection_headers.items())
+        lines = _connection_lines.get(items)
+        if lines is None:
+            lines = "".join(f'{h}: {hv}\r\n' for (h, hv) in items).encode()
+            if len(_connection_lines) < CONNECTION_LINES_CACHE_SIZE:
+                _connection_lines[items] = lines
+        return head + lines + b'\r\n'
+
+    def serialize(self, connection_headers=None):
+        """Returns the whole response as bytes"""
+        return (Response.serialize_head(self, connection_headers)
+                + (self.body or b''))
+
+    def response(self, client, connection_headers=None, send_body=True):
+        """Sends the head and the body as separate buffers in one writev
+        call, partial writes are resumed through memoryviews without copying.
+        A file body follows through sendfile, a streamed body batch by batch.
+        Without "send_body" (HEAD) only the head is sent. Returns the number
+        of bytes sent"""
+        file = getattr(self, 'file', None)
+        head = Response.serialize_head(self, connection_headers)
+        if getattr(self, 'chunks', None) is not None:
+            return self._send_chunks(client, head, send_body)
+        body = (self.body or b'') if file is None and send_body else b''
+
+        try:
+            sent = send_buffers(client, (head, body))
+            if file is None or not send_body:
+                return sent
+            for segment in self.file_segments():
+                if not isinstance(segment, tuple):
+                    sent += send_buffers(client, (segment,))
+                elif segment[1]:
+                    sent += client.sendfile(file, *segment)
+            return sent
+        finally:
+            if file is not None:
+                file.close()
+
+    def _send_chunks(self, client, head, send_body):
+        """Sends the head at once and the streamed body as it is produced. A
+        synchronous iterator is advanced in the calling thread, each chunk
+        sent before the next one is asked for: a client that does not read
+        slows the producer down. An asynchronous one goes through a pump in
+        a loop of its own"""
+        chunked = self.headers.get('Transfer-Encoding') == 'chunked'
+        chunks = self.chunks
+        loop = pump = None
+        if hasattr(chunks, '__anext__'):
+            # An asynchronous body outside of run_async gets its own loop
+            loop = asyncio.new_event_loop()
+        try:
+            sent = send_buffers(client, (head,))
+            if not send_body:
+                return sent
+            if loop is None:
+                for chunk in chunks:
+                    chunk = _encode(chunk)
+                    if chunk:
+                        sent += send_buffers(client, frame([chunk], chunked))
+            else:
+                pump = AsyncChunkPump(chunks, loop)
+                while True:
+                    batch = loop.run_until_complete(pump.next_batch())
+                    if not batch:
+                        break
+                    sent += send_buffers(client, frame(batch, chunked))
+            if chunked:
+                sent += send_buffers(client, (LAST_CHUNK,))
+            return sent
+        finally:
+            if loop is not None:
+                loop.run_until_complete(pump.close() if pump is not None
+                                        else chunks.aclose())
+                loop.close()
+            elif hasattr(chunks, 'close'):
+                chunks.close()
+
+
+def is_stream(body):
+    """Whether a body is an iterator or iterable of chunks to stream"""
+    return (body is not None
+            and not isinstance(body, (bytes, bytearray, memoryview, str))
+            and (hasattr(body, '__iter__') or hasattr(body, '__aiter__')))
+
+
+def _encode(chunk):
+    return chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+
+
+_END = object()
+
+
+class ChunkPump:
+    """Advances a synchronous iterator of chunks for run_async, in a thread
+    of the default executor of the loop (the thread pool of the server) and
+    in the context it was created in. The chunks it produced can be sent
+    while it blocks for the next one. It waits once CHUNK_PUMP_SIZE bytes
+    are pending, a client that does not read slows it down.
+
+    The thread only appends to "pending" and the loop only pops from it,
+    both atomic. The thread wakes the loop up only when it waits for a
+    chunk, and the loop sets "room" only when it is not set already:
+    producing a chunk costs no lock.
+
+    Attributes
+    ----------
+    chunks - The iterator
+    loop - The loop sending the chunks
+    pending - Chunks produced and not taken yet
+    produced - Bytes produced, only counted by the thread
+    taken - Bytes taken, only counted by the loop
+    end - _END or the exception of the iterator, once it stopped
+    closed - Set by close
+    waiting - Set while the loop waits for a chunk
+    ready - asyncio.Event set when a chunk is produced or the iterator
+            stopped while the loop waits
+    room - Event set when chunks are taken or the pump is closed
+
+    Methods
+    ----------
+    next_batch - Waits for a chunk, returns it with the ones already
+                 produced
+    close - The thread closes the iterator once its chunk is produced"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self._loop = asyncio.get_running_loop()
+        self._pending: deque = deque()
+        self._produced: int = 0
+        self._taken: int = 0
+        self._end = None
+        self._closed: bool = False
+        self._waiting: bool = False
+        self._ready = asyncio.Event()
+        self._room = threading.Event()
+        context = contextvars.copy_context()
+        self._loop.run_in_executor(None, context.run, self._run)
+
+    def _run(self):
+        end = _END
+        pending = self._pending
+        try:
+            for chunk in self.chunks:
+                chunk = _encode(chunk)
+                if not chunk:
+                    continue
+                while (self._produced - self._taken >= CHUNK_PUMP_SIZE
+                       and not self._closed):
+                    self._room.clear()
+                    if (self._produced - self._taken >= CHUNK_PUMP_SIZE
+                            and not self._closed):
+                        self._room.wait()
+                if self._closed:
+                    return
+                pending.append(chunk)
+                self._produced += len(chunk)
+                if self._waiting:
+                    self._wake()
+        except BaseException as error:
+            end = error
+        finally:
+            if hasattr(self.chunks, 'close'):
+                self.chunks.close()
+        self._end = end
+        self._wake()
+
+    def _wake(self):
+        self._waiting = False
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            # The loop is closed, nobody waits any more
+            pass
+
+    async def next_batch(self):
+        """Waits for the next chunk and joins the ones already produced, up
+        to CHUNK_FLUSH_SIZE bytes. Returns an empty list once the iterator
+        is exhausted, raises its exception"""
+        while not self._pending and self._end is None:
+            self._ready.clear()
+            self._waiting = True
+            if self._pending or self._end is not None:
+                self._waiting = False
+                break
+            await self._ready.wait()
+        batch = _take(self._pending)
+        self._taken += sum(len(chunk) for chunk in batch)
+        if not self._room.is_set():
+            self._room.set()
+        if not batch:
+            # Every chunk was taken before the end was set
+            if self._end is not _END:
+                raise self._end
+        return batch
+
+    def close(self):
+        """The thread closes the iterator once its current chunk is
+        produced"""
+        self._closed = True
+        self._room.set()
+
+
+class AsyncChunkPump:
+    """Advances an asynchronous iterator of chunks in a task of the loop.
+    The chunks it produced can be sent while it waits for the next one, it
+    waits once CHUNK_PUMP_SIZE bytes are pending: a client that does not
+    read slows it down.
+
+    Attributes
+    ----------
+    chunks - The iterator
+    pending - Chunks produced and not taken yet
+    size - Bytes pending
+    end - _END or the exception of the iterator, once it stopped
+    ready - Event set when a chunk is produced or the iterator stopped
+    room - Event set when chunks are taken
+    task - The task advancing the iterator
+
+    Methods
+    ----------
+    next_batch - Waits for a chunk, returns it with the ones already
+                 produced
+    close - Cancels the task, which closes the iterator"""
+
+    def __init__(self, chunks, loop=None):
+        self.chunks = chunks
+        self._pending: deque = deque()
+        self._size: int = 0
+        self._end = None
+        self._ready = asyncio.Event()
+        self._room = asyncio.Event()
+        self._task = (loop or asyncio.get_running_loop()).create_task(
+            self._run())
+
+    async def _run(self):
+        end = _END
+        try:
+            async for chunk in self.chunks:
+                chunk = _encode(chunk)
+                if not chunk:
+                    continue
+                while self._size >= CHUNK_PUMP_SIZE:
+                    self._room.clear()
+                    await self._room.wait()
+                self._pending.append(chunk)
+                self._size += len(chunk)
+                if not self._ready.is_set():
+                    self._ready.set()
+        except Exception as error:
+            end = error
+        finally:
+            if hasattr(self.chunks, 'aclose'):
+                await self.chunks.aclose()
+        self._end = end
+        self._ready.set()
+
+    async def next_batch(self):
+        """Waits for the next chunk and joins the ones already produced, up
+        to CHUNK_FLUSH_SIZE bytes. Returns an empty list once the iterator
+        is exhausted, raises its exception"""
+        while not self._pending and self._end is None:
+            self._ready.clear()
+            await self._ready.wait()
+        batch = _take(self._pending)
+        self._size -= sum(len(chunk) for chunk in batch)
+        self._room.set()
+        if not batch and self._end is not _END:
+            raise self._end
+        return batch
+
+    async def close(self):
+        """Cancels the task, which closes the iterator"""
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+def _take(pending):
+    """Takes pending chunks up to CHUNK_FLUSH_SIZE bytes, at least one"""
+    batch = []
+    size = 0
+    while pending and size < CHUNK_FLUSH_SIZE:
+        chunk = pending.popleft()
+        batch.append(chunk)
+        size += len(chunk)
+    return batch
+
+
+def frame(batch, chunked):
+    """Buffers of one batch, as one chunk of the chunked transfer coding"""
+    if len(batch) > MAX_SCATTER:
+        batch = [b''.join(batch)]
+    if not chunked:
+        return batch
+    size = sum(len(chunk) for chunk in batch)
+    return [b'%x\r\n' % size, *batch, b'\r\n']
+
+
+def strip_weak(etag):
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def send_buffers(client, buffers):
+    """Sends all buffers, with sendmsg (writev) where it is available.
+    Returns the number of bytes sent"""
+    total = sum(len(buffer) for buffer in buffers)
+    sent = 0
+    if hasattr(client, 'sendmsg') and len(buffers) <= IOV_MAX:
+        # Mostly sent at once, the memoryviews only resume a partial write
+        sent = client.sendmsg(buffers)
+        if sent == total:
+            return total
+    buffers = [memoryview(buffer) for buffer in buffers if buffer]
+    if not hasattr(client, 'sendmsg'):
+        for buffer in buffers:
+            while buffer:
+                buffer = buffer[client.send(buffer):]
+        return total
+    while buffers:
+        while sent:
+            if sent >= len(buffers[0]):
+                sent -= len(buffers.pop(0))
             else:
-                body = file.read()
-            connection = request_headers.get('Connection')
-            size = os.stat(path).st_size
-            headers = {('Content-Type', f'{content_type}'),
-                       ('Content-Length', len(body)),
-                       ('Connection', connection)}
-            if header_range:
-                headers.add(('Content-Range', f'{start}-{end}/{size}'))
-            headers = OrderedDict(headers)
-
-            for (header, header_value) in additional_headers or []:
-                headers[header] = header_value
-            if header_range:
-                return Response(206, "Partial Content", headers, body)
-            return Response(200, "OK", headers, body)
-
-    def response(self, client):
-        content = self.status_code().encode('utf-8')
-        if type(self) is not HTTPResponseError:
-            content += (self._get_headers().encode("utf-8"))
-        content += b'\r\n' + self.body or b''
-
-        while content:
-            content_sent = client.send(content)
-            content = content[content_sent:]
\ No newline at end of file
+                buffers[0] = buffers[0][sent:]
+                sent = 0
+        if buffers:
+            sent = client.sendmsg(buffers[:IOV_MAX])
+    return total
@@ -0,0 +1,194 @@
+import re
+import threading
+from collections import OrderedDict
+
+REGEX_CHARS = frozenset('\\^$*+?{}[]|()')
+SEGMENT_CHARS = REGEX_CHARS | {'.'}
+QUANTIFIERS = frozenset('?*+{')
+NAMED_GROUP = re.compile(r'\(\?P<(\w+)>')
+NAMED_BACKREF = re.compile(r'\(\?P=(\w+)\)')
+NUMBERED_BACKREF = re.compile(r'\\[1-9]')
+
+
+class Router:
+    """Routing table of the web server.
+
+    Routes are compiled once into a hash map of literal paths and combined
+    regular expressions of the patterned ones, one per literal first path
+    segment ("/hello" of "/hello/(?P<name>.*)") plus one for the patterns
+    starting with a regex or with a top-level alternation. Resolving a url
+    costs a dictionary lookup or at most two regex matches whatever the
+    number of routes. Patterns that can not be combined (numbered
+    backreferences, global inline flags) are matched on their own. Recent
+    resolutions are kept in a small LRU cache.
+
+    A path without regex metacharacters ("." is treated as a plain dot) is
+    literal. Literal routes take precedence over patterned ones, patterned
+    routes are tried in the order they were added.
+
+    Attributes
+    ----------
+    routes - A dictionary of all paths and their user functions
+    literals - A dictionary of literal paths
+    patterns - A list of compiled patterned routes
+    combined - Combined regular expressions of the patterned routes by
+               their first path segment, None if not compiled yet
+    standalone - Indexes of the patterned routes matched on their own
+    cache - LRU cache of recent url resolutions
+    cache_size - Max number of cached resolutions
+
+    Methods
+    ----------
+    add_route - Decorator adding the function as the route of the path
+    set_routes - Replaces all routes
+    get_routes - Returns the dictionary of all routes
+    resolve - Returns the user function of the url and its arguments
+    resolve_route - Like resolve, with the path of the matched route first"""
+
+    def __init__(self, cache_size=1024):
+        self._routes: OrderedDict = OrderedDict()
+        self._literals: dict = {}
+        self._patterns: list = []
+        self._combined = None
+        self._standalone: list = []
+        self._cache: OrderedDict = OrderedDict()
+        self._cache_size: int = cache_size
+        self._lock = threading.Lock()
+
+    def add_route(self, path):
+        def decorator(custom_function):
+            with self._lock:
+                self._routes[path] = custom_function
+                self._combined = None
+                self._cache.clear()
+            return custom_function
+        return decorator
+
+    def set_routes(self, routes):
+        with self._lock:
+            self._routes = OrderedDict(routes)
+            self._combined = None
+            self._cache.clear()
+
+    def get_routes(self):
+        return self._routes
+
+    def resolve(self, url):
+        """Returns (function, args, kwargs) of the url or (None, (), {})"""
+        return self.resolve_route(url)[1:]
+
+    def resolve_route(self, url):
+        """Returns (path, function, args, kwargs) of the url or
+        (None, None, (), {})"""
+        with self._lock:
+            resolved = self._cache.get(url)
+            if resolved is not None:
+                self._cache.move_to_end(url)
+                return resolved
+            if self._combined is None:
+                self._compile()
+            literals, patterns, combined, standalone = (
+                self._literals, self._patterns, self._combined,
+                self._standalone)
+
+        resolved = (self._match(url, literals, patterns, combined, standalone)
+                    or (None, None, (), {}))
+        with self._lock:
+            self._cache[url] = resolved
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return resolved
+
+    @staticmethod
+    def _segment(path):
+        end = path.find('/', 1)
+        return path if end < 0 else path[:end]
+
+    @staticmethod
+    def _bucket(path):
+        """Returns the first segment of the path if every url the pattern
+        matches starts with it, None otherwise"""
+        end = path.find('/', 1)
+        if end < 0 or '|' in path or path[end + 1:end + 2] in QUANTIFIERS:
+            return None
+        segment = path[:end]
+        return None if SEGMENT_CHARS.intersection(segment) else segment
+
+    @staticmethod
+    def _arguments(match):
+        """Returns the unnamed groups of the match by position and the named
+        ones as keywords"""
+        named = set(match.re.groupindex.values())
+        args = tuple(match.group(index)
+                     for index in range(1, match.re.groups + 1)
+                     if index not in named)
+        return args, match.groupdict()
+
+    @staticmethod
+    def _match(url, literals, patterns, combined, standalone):
+        custom_function = literals.get(url)
+        if custom_function is not None:
+            return url, custom_function, (), {}
+
+        best = None
+        for regex in (combined.get(Router._segment(url)), combined.get(None)):
+            match = regex.fullmatch(url) if regex else None
+            if match and (best is None or int(match.lastgroup[2:])
+                          < int(best.lastgroup[2:])):
+                best = match
+        best_index = int(best.lastgroup[2:]) if best else len(patterns)
+
+        # Routes that can not be combined, in their place in the order
+        for index in standalone:
+            if index > best_index:
+                break
+            path, regex, _, custom_function = patterns[index]
+            own = regex.fullmatch(url)
+            if own:
+                return (path, custom_function) + Router._arguments(own)
+
+        if best is not None:
+            path, regex, names, custom_function = patterns[best_index]
+            if regex.groups > len(names):
+                own = regex.fullmatch(url)
+                return (path, custom_function) + Router._arguments(own)
+            prefix = best.lastgroup + '_'
+            return path, custom_function, (), {name: best.group(prefix + name)
+                                               for name in names}
+
+    def _compile(self):
+        """Builds the literal map and the combined regexes of the routes"""
+        literals = {}
+        patterns = []
+        standalone = []
+        alternatives = {}
+        for path, custom_function in self._routes.items():
+            if not REGEX_CHARS.intersection(path):
+                literals.setdefault(path, custom_function)
+                continue
+            regex = re.compile(path)
+            tag = f'_r{len(patterns)}'
+            renamed = NAMED_GROUP.sub(rf'(?P<{tag}_\1>', path)
+            renamed = NAMED_BACKREF.sub(rf'(?P={tag}_\1)', renamed)
+            alternative = f'(?P<{tag}>{renamed})'
+            if NUMBERED_BACKREF.search(path):
+                alternative = None
+            else:
+                try:
+                    # Global inline flags are only valid at the start
+                    re.compile(alternative)
+                except re.error:
+                    alternative = None
+            if alternative is None:
+                standalone.append(len(patterns))
+                patterns.append((path, regex, None, custom_function))
+                continue
+            alternatives.setdefault(self._bucket(path), []).append(
+                alternative)
+            patterns.append((path, regex, tuple(regex.groupindex),
+                             custom_function))
+        self._literals = literals
+        self._patterns = patterns
+        self._standalone = standalone
+        self._combined = {segment: re.compile('|'.join(group))
+                          for segment, group in alternatives.items()}
@@ -0,0 +1,146 @@
+import os
+import time
+import threading
+import mimetypes
+from urllib.parse import unquote
+
+DEFAULT_CONTENT_TYPE = 'application/octet-stream'
+# Content types by lower case extension, looked up once per indexed file
+CONTENT_TYPES = dict(mimetypes.types_map)
+CONTENT_TYPES.update({'.html': 'text/html; charset=utf-8',
+                      '.htm': 'text/html; charset=utf-8',
+                      '.txt': 'text/plain; charset=utf-8',
+                      '.css': 'text/css; charset=utf-8',
+                      '.js': 'text/javascript; charset=utf-8',
+                      '.json': 'application/json',
+                      '.svg': 'image/svg+xml',
+                      '.webp': 'image/webp',
+                      '.woff2': 'font/woff2'})
+
+
+def content_type(name):
+    return CONTENT_TYPES.get(os.path.splitext(name)[1].lower(),
+                             DEFAULT_CONTENT_TYPE)
+
+
+class StaticIndex:
+    """In-memory index of a directory tree served under one url prefix.
+
+    Every file and directory below "root" is mapped from its url path to
+    its file system path and, for files, its content type. Urls are
+    resolved with one dictionary lookup, only indexed paths are ever
+    served: "..", symbolic links leaving the root and hidden names never
+    reach the file system. Every "poll_interval" seconds a request checks
+    the mtimes of the indexed directories and the index is rebuilt if one
+    changed, the other requests keep using the previous index meanwhile.
+
+    Attributes
+    ----------
+    root - Absolute real path of the served directory
+    poll_interval - Seconds between two checks of the directory mtimes
+    follow_symlinks - Whether symbolic links inside the root are served
+    hidden - Whether names starting with a dot are served
+    entries - (path, content_type) by url path, content_type is None for
+              directories
+    mtimes - mtime_ns of every indexed directory
+
+    Methods
+    ----------
+    lookup - Returns the (path, content_type) entry of a url path
+    refresh - Rebuilds the index if a directory changed
+    build - Scans the tree and replaces the index"""
+
+    def __init__(self, root, poll_interval=2.0, follow_symlinks=False,
+                 hidden=False):
+        self.root: str = os.path.realpath(root)
+        self.poll_interval: float = poll_interval
+        self.follow_symlinks: bool = follow_symlinks
+        self.hidden: bool = hidden
+        self._entries: dict = {}
+        self._mtimes: dict = {}
+        self._checked: float = 0.0
+        self._lock = threading.Lock()
+        self.build()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, url_path):
+        """Returns (path, content_type) of the url path relative to the
+        mount, None if it is not in the index"""
+        if time.monotonic() - self._checked >= self.poll_interval:
+            self.refresh()
+        try:
+            key = unquote(url_path or '/', errors='strict')
+        except UnicodeDecodeError:
+            return None
+        if len(key) > 1 and key.endswith('/'):
+            key = key[:-1]
+        return self._entries.get(key)
+
+    def refresh(self):
+        """Rebuilds the index if the mtime of an indexed directory changed.
+        Only one thread checks at a time, the others go on with the current
+        index"""
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._checked = time.monotonic()
+            for path, mtime in self._mtimes.items():
+                try:
+                    if os.stat(path).st_mtime_ns != mtime:
+                        break
+                except OSError:
+                    break
+            else:
+                return
+            self._build()
+        finally:
+            self._lock.release()
+
+    def build(self):
+        with self._lock:
+            self._build()
+
+    def _build(self):
+        entries = {'/': (self.root, None)}
+        mtimes = {}
+        pending = [('', self.root, frozenset())]
+        while pending:
+            url, path, ancestors = pending.pop()
+            if path in ancestors:
+                # A followed link back to a directory above it
+                continue
+            ancestors = ancestors | {path}
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+                scan = os.scandir(path)
+            except OSError:
+                continue
+            with scan:
+                for entry in scan:
+                    if not self.hidden and entry.name.startswith('.'):
+                        continue
+                    if entry.is_symlink() and not self._inside(entry.path):
+                        continue
+                    child = f'{url}/{entry.name}'
+                    try:
+                        if entry.is_dir():
+                            entries[child] = (entry.path, None)
+                            pending.append((child, os.path.realpath(
+                                entry.path), ancestors))
+                        elif entry.is_file():
+                            entries[child] = (entry.path,
+                                              content_type(entry.name))
+                    except OSError:
+                        continue
+        self._entries, self._mtimes = entries, mtimes
+        self._checked = time.monotonic()
+
+    def _inside(self, path):
+        """Whether a symbolic link is served: it must be followed and stay
+        below the root"""
+        if not self.follow_symlinks:
+            return False
+        real = os.path.realpath(path)
+        return real == self.root or real.startswith(self.root + os.sep)
@@ -0,0 +1,73 @@
+import unittest
+import os
+import json
+import shutil
+import tempfile
+
+from accesslog import AccessLog
+from request import Request
+
+
+class TestAccessLog(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.test_dir, 'access.log')
+        self.request = Request(b'GET /a?b=1 HTTP/1.1\r\n'
+                               b'Referer: http://example.com/\r\n'
+                               b'User-Agent: test "agent"\r\n\r\n')
+        self.request.parse_request()
+
+    def read(self):
+        with open(self.path) as file:
+            return file.read().splitlines()
+
+    def test_common(self):
+        log = AccessLog(self.path)
+        log.log(('127.0.0.1', 5000), self.request, 200, 123, 0.002)
+        log.close()
+        line, = self.read()
+        self.assertTrue(line.startswith('127.0.0.1 - - ['))
+        self.assertTrue(line.endswith('] "GET /a?b=1 HTTP/1.1" 200 123'))
+
+    def test_combined(self):
+        log = AccessLog(self.path, 'combined')
+        log.log(('127.0.0.1', 5000), self.request, 404, 0, 0.002)
+        log.close()
+        line, = self.read()
+        self.assertTrue(line.endswith(
+            '" 404 - "http://example.com/" "test \\"agent\\""'))
+
+    def test_json(self):
+        log = AccessLog(self.path, 'json')
+        log.log(('127.0.0.1', 5000), self.request, 200, 10, 0.0025)
+        log.close()
+        record = json.loads(self.read()[0])
+        self.assertEqual(record['target'], '/a?b=1')
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(record['duration_ms'], 2.5)
+
+    def test_rotation(self):
+        log = AccessLog(self.path, max_bytes=200, backups=2,
+                        batch_size=1)
+        for _ in range(10):
+            log.log(('127.0.0.1', 5000), self.request, 200, 10, 0.001)
+        log.close()
+        self.assertEqual(log.written, 10)
+        self.assertTrue(os.path.exists(self.path + '.1'))
+        self.assertTrue(os.path.exists(self.path + '.2'))
+        self.assertFalse(os.path.exists(self.path + '.3'))
+
+    def test_drop_when_full(self):
+        log = AccessLog(self.path, max_queue=2)
+        # A stand-in writer keeps the real one from draining the queue
+        log._writer = object()
+        for _ in range(5):
+            log.log(('127.0.0.1', 5000), self.request, 200, 10, 0.001)
+        self.assertEqual(log.dropped, 3)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
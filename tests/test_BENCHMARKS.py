@@ -0,0 +1,28 @@
+import unittest
+
+from benchmarks.load import percentile
+from benchmarks.run import compare
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_percentile(self):
+        samples = list(range(1, 1001))
+        self.assertEqual(percentile(samples, 0.5), 500)
+        self.assertEqual(percentile(samples, 0.99), 990)
+        self.assertEqual(percentile(samples, 0.999), 999)
+        self.assertEqual(percentile([7], 0.999), 7)
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_compare(self):
+        baseline = {'load': {'literal': {'rps': 1000.0, 'p99_ms': 2.0}},
+                    'micro': {'parse_request': {'us_per_call': 10.0}}}
+        current = {'load': {'literal': {'rps': 850.0, 'p99_ms': 2.1}},
+                   'micro': {'parse_request': {'us_per_call': 9.0},
+                             'new': {'us_per_call': 1.0}}}
+        regressions = compare(baseline, current, 0.1)
+        self.assertEqual([regression[:3] for regression in regressions],
+                         [('load', 'literal', 'rps')])
+
+
+if __name__ == '__main__':
+    unittest.main()
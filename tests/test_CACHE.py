@@ -0,0 +1,93 @@
+import unittest
+import tempfile
+import os
+import shutil
+
+from cache import FileCache
+from response import Response
+
+
+class TestFileCache(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def make_file(self, name, content):
+        path = os.path.join(self.test_dir, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_get(self):
+        path = self.make_file('test.html', b'012345')
+        cache = FileCache()
+        first = cache.get(path, 'text/html')
+        second = cache.get(path, 'text/html')
+        self.assertEqual(second.body, b'012345')
+        self.assertEqual(second.headers.get('Content-Length'), 6)
+        self.assertIs(first.head, second.head)
+        self.assertTrue(second.head.startswith(b'HTTP/1.1 200 OK\r\n'))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_get_modified(self):
+        path = self.make_file('test.html', b'012345')
+        cache = FileCache()
+        cache.get(path, 'text/html')
+        self.make_file('test.html', b'0123456789')
+        self.assertEqual(cache.get(path, 'text/html').body, b'0123456789')
+        self.assertEqual(cache.stats()['misses'], 2)
+
+    def test_get_versions(self):
+        path = self.make_file('test.html', b'0')
+        cache = FileCache()
+        for content in (b'01', b'012', b'0123'):
+            self.make_file('test.html', content)
+            stat = os.stat(path)
+            etag, modified = Response.validators(stat)
+            response = cache.get(path, 'text/html', stat,
+                                 {'ETag': etag, 'Last-Modified': modified})
+            self.assertIn(f'ETag: {etag}\r\n'.encode(), response.head)
+        # Every version replaced the previous one
+        stats = cache.stats()
+        self.assertEqual((stats['files'], stats['bytes']), (1, 4))
+
+    def test_get_headers(self):
+        path = self.make_file('test.html', b'012345')
+        cache = FileCache()
+        cache.get(path, 'text/html')
+        response = cache.get(path, 'text/html',
+                             headers={'Cache-Control': 'no-cache'})
+        self.assertIn(b'Cache-Control: no-cache\r\n', response.head)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['files'], 1)
+
+    def test_get_too_large(self):
+        path = self.make_file('test.html', b'012345')
+        cache = FileCache(max_file_size=5)
+        self.assertIsNone(cache.get(path, 'text/html'))
+        self.assertIsNone(cache.get(os.path.join(self.test_dir, 'not.found'),
+                                    'text/html'))
+
+    def test_eviction(self):
+        first = self.make_file('first', b'0123')
+        second = self.make_file('second', b'4567')
+        cache = FileCache(max_bytes=6)
+        cache.get(first, '*/*')
+        cache.get(second, '*/*')
+        stats = cache.stats()
+        self.assertEqual((stats['evictions'], stats['files'], stats['bytes']),
+                         (1, 1, 4))
+
+    def test_invalidate(self):
+        path = self.make_file('test.html', b'012345')
+        cache = FileCache()
+        cache.get(path, 'text/html')
+        cache.invalidate(path)
+        self.assertEqual(cache.stats()['bytes'], 0)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import tempfile
+import os
+import gzip
+import shutil
+import zlib
+
+from compression import Compressor, negotiate
+from web import Response, Request
+
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.compressor = Compressor(min_size=10,
+                                     cache_dir=os.path.join(self.test_dir,
+                                                            'cache'))
+        self.request = Request()
+        self.request.headers['Accept-Encoding'] = 'gzip, deflate'
+
+    def test_negotiate(self):
+        self.assertEqual(negotiate('gzip, deflate, br'), 'gzip')
+        self.assertEqual(negotiate('deflate, gzip;q=0.5'), 'deflate')
+        self.assertEqual(negotiate('gzip;q=0, *'), 'deflate')
+        self.assertIsNone(negotiate('identity'))
+        self.assertIsNone(negotiate(None))
+
+    def test_compress(self):
+        body = b'<p>text</p>' * 10
+        response = Response(200, "OK", {'Content-Type': 'text/html'}, body)
+        result = self.compressor.compress(self.request, response)
+        self.assertEqual(result.headers.get('Content-Encoding'), 'gzip')
+        self.assertEqual(result.headers.get('Content-Length'),
+                         len(result.body))
+        self.assertEqual(gzip.decompress(result.body), body)
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_compress_skips(self):
+        small = Response(200, "OK", {'Content-Type': 'text/html'}, b'<p>')
+        image = Response(200, "OK", {'Content-Type': 'image/png'}, b'0' * 99)
+        for response in (small, image):
+            self.assertIs(self.compressor.compress(self.request, response),
+                          response)
+
+    def test_compress_negotiated(self):
+        body = b'<p>text</p>' * 10
+        response = Response(200, "OK", {'Content-Type': 'text/html'}, body)
+        # Negotiated for a client without Accept-Encoding, as it is memoized
+        result = self.compressor.compress(Request(), response)
+        self.assertEqual(result.headers.get('Vary'), 'Accept-Encoding')
+        self.assertIs(self.compressor.compress(self.request, result), result)
+
+    def test_file_variant(self):
+        path = os.path.join(self.test_dir, 'test.html')
+        with open(path, 'wb') as f:
+            f.write(b'<p>text</p>' * 10)
+        self.request.headers['Accept-Encoding'] = 'deflate'
+
+        variant, encoding = self.compressor.file_variant(
+            self.request, path, os.stat(path), 'text/html')
+        self.assertEqual(encoding, 'deflate')
+        with open(variant, 'rb') as f:
+            self.assertEqual(zlib.decompress(f.read()), b'<p>text</p>' * 10)
+
+    def test_file_variant_sidecar(self):
+        path = os.path.join(self.test_dir, 'test.html')
+        with open(path, 'wb') as f:
+            f.write(b'<p>text</p>' * 10)
+        with gzip.open(path + '.gz', 'wb') as f:
+            f.write(b'<p>text</p>' * 10)
+
+        variant = self.compressor.file_variant(self.request, path,
+                                               os.stat(path), 'text/html')
+        self.assertEqual(variant, (path + '.gz', 'gzip'))
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+
+from limiter import ConcurrencyLimiter
+
+
+class TestConcurrencyLimiter(unittest.TestCase):
+    def test_acquire(self):
+        limiter = ConcurrencyLimiter(initial_limit=2)
+        self.assertTrue(limiter.acquire())
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(limiter.acquire())
+        limiter.release(0.01)
+        self.assertTrue(limiter.acquire())
+        stats = limiter.stats()
+        self.assertEqual((stats['in_flight'], stats['admitted'],
+                          stats['rejected']), (2, 3, 1))
+
+    def test_priority(self):
+        limiter = ConcurrencyLimiter(initial_limit=2, priority_headroom=0.5)
+        limiter.acquire()
+        limiter.acquire()
+        self.assertFalse(limiter.acquire())
+        self.assertTrue(limiter.acquire(priority=True))
+        self.assertFalse(limiter.acquire(priority=True))
+
+    def test_queue_wait(self):
+        limiter = ConcurrencyLimiter(max_queue_wait=0.5)
+        self.assertFalse(limiter.acquire(waited=0.6))
+        self.assertTrue(limiter.acquire(priority=True, waited=0.6))
+        self.assertTrue(limiter.acquire(waited=0.4))
+        self.assertEqual(limiter.stats()['expired'], 1)
+
+    def test_increase(self):
+        limiter = ConcurrencyLimiter(initial_limit=4, max_limit=5)
+        for _ in range(20):
+            for _ in range(limiter.limit):
+                limiter.acquire()
+            for _ in range(limiter.in_flight):
+                limiter.release(0.01)
+        self.assertEqual(limiter.limit, 5)
+
+    def test_no_increase_when_idle(self):
+        limiter = ConcurrencyLimiter(initial_limit=4)
+        for _ in range(100):
+            limiter.acquire()
+            limiter.release(0.01)
+        self.assertEqual(limiter.limit, 4)
+
+    def test_decrease(self):
+        limiter = ConcurrencyLimiter(initial_limit=10, min_limit=8,
+                                     target_latency=0.1, backoff=0.5)
+        for _ in range(3):
+            limiter.acquire()
+        limiter.release(0.2)
+        self.assertEqual(limiter.limit, 8)
+        # One decrease per target_latency
+        limiter.release(0.2)
+        self.assertEqual(limiter.limit, 8)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            ConcurrencyLimiter(backoff=1)
+        with self.assertRaises(ValueError):
+            ConcurrencyLimiter(initial_limit=2, max_limit=1)
+
+
+if __name__ == "__main__":
+    unittest.main()
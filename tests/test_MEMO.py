@@ -0,0 +1,132 @@
+import unittest
+import asyncio
+import threading
+import time
+
+from memo import ResponseCache
+from response import Response
+from request import Request
+
+
+def make_request(data):
+    request = Request(data)
+    request.parse_request()
+    return request
+
+
+def ok(body):
+    return Response(200, "OK", {'Content-Type': 'text/plain'}, body)
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_get(self):
+        cache = ResponseCache(30)
+        key = cache.key(make_request(b'GET /page?a=1 HTTP/1.1\r\n\r\n'))
+        calls = []
+        first = cache.get(key, lambda: calls.append(1) or ok(b'page'))
+        second = cache.get(key, lambda: calls.append(1) or ok(b'other'))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(second.body, b'page')
+        self.assertIs(first.head, second.head)
+        self.assertTrue(second.head.startswith(b'HTTP/1.1 200 OK\r\n'))
+        self.assertIn(b'Content-Length: 4\r\n', second.head)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_key(self):
+        cache = ResponseCache(30, vary=('Accept-Language',))
+        english = cache.key(make_request(
+            b'GET /page HTTP/1.1\r\nAccept-Language: en\r\n\r\n'))
+        french = cache.key(make_request(
+            b'GET /page HTTP/1.1\r\nAccept-Language: fr\r\n\r\n'))
+        query = cache.key(make_request(
+            b'GET /page?a=1 HTTP/1.1\r\nAccept-Language: en\r\n\r\n'))
+        self.assertEqual(len({english, french, query}), 3)
+        self.assertIsNone(cache.key(make_request(
+            b'POST /page HTTP/1.1\r\nContent-Length: 0\r\n\r\n')))
+
+    def test_uncacheable(self):
+        cache = ResponseCache(30)
+        key = cache.key(make_request(b'GET / HTTP/1.1\r\n\r\n'))
+        not_found = Response(404, "Not found", {}, b'')
+        self.assertIs(cache.get(key, lambda: not_found), not_found)
+        self.assertIsNone(cache.get(key, lambda: None))
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_ttl(self):
+        cache = ResponseCache(0.05)
+        key = cache.key(make_request(b'GET / HTTP/1.1\r\n\r\n'))
+        cache.get(key, lambda: ok(b'old'))
+        time.sleep(0.1)
+        self.assertEqual(cache.get(key, lambda: ok(b'new')).body, b'new')
+
+    def test_eviction(self):
+        cache = ResponseCache(30, max_entries=2)
+        keys = [cache.key(make_request(f'GET /{i} HTTP/1.1\r\n\r\n'.encode()))
+                for i in range(3)]
+        cache.get(keys[0], lambda: ok(b'0'))
+        cache.get(keys[1], lambda: ok(b'1'))
+        cache.get(keys[0], lambda: ok(b'0'))
+        cache.get(keys[2], lambda: ok(b'2'))
+        # The least recently used one is gone
+        self.assertEqual(cache.get(keys[1], lambda: ok(b'again')).body,
+                         b'again')
+        self.assertEqual(cache.stats()['evictions'], 2)
+
+    def test_single_flight(self):
+        cache = ResponseCache(30)
+        key = cache.key(make_request(b'GET / HTTP/1.1\r\n\r\n'))
+        calls = []
+        started = threading.Event()
+
+        def compute():
+            calls.append(1)
+            started.set()
+            time.sleep(0.1)
+            return ok(b'slow')
+
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(cache.get(key, compute).body))
+            for _ in range(8)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [b'slow'] * 8)
+
+    def test_single_flight_async(self):
+        cache = ResponseCache(30)
+        key = cache.key(make_request(b'GET / HTTP/1.1\r\n\r\n'))
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return ok(b'slow')
+
+        async def main():
+            return await asyncio.gather(
+                *(cache.get_async(key, compute) for _ in range(8)))
+
+        results = asyncio.run(main())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([result.body for result in results], [b'slow'] * 8)
+
+    def test_invalidate(self):
+        cache = ResponseCache(30)
+        first = cache.key(make_request(b'GET /first HTTP/1.1\r\n\r\n'))
+        second = cache.key(make_request(b'GET /second HTTP/1.1\r\n\r\n'))
+        cache.get(first, lambda: ok(b'1'))
+        cache.get(second, lambda: ok(b'2'))
+        cache.invalidate('/first')
+        self.assertEqual(cache.stats()['entries'], 1)
+        cache.invalidate()
+        self.assertEqual(cache.stats()['entries'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
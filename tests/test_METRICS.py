@@ -0,0 +1,92 @@
+import unittest
+import socket
+
+from metrics import Metrics, Histogram, UNMATCHED
+from web import Webserver
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram(self):
+        histogram = Histogram((0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+        self.assertEqual(histogram.count, 4)
+        self.assertEqual(histogram.cumulative(),
+                         [(0.1, 2), (1.0, 3), (float('inf'), 4)])
+
+    def test_observe_request(self):
+        metrics = Metrics(buckets=(0.1, 1.0))
+        metrics.observe_request('/page/(?P<name>.*)', 200, 0.05, 100)
+        metrics.observe_request('/page/(?P<name>.*)', 200, 0.5, 50)
+        metrics.observe_request('/page/(?P<name>.*)', 404, 0.5, 10)
+        snapshot = metrics.snapshot()
+        self.assertEqual(
+            snapshot['requests'][('/page/(?P<name>.*)', 200)]['count'], 2)
+        self.assertEqual(
+            snapshot['bytes_sent'][('/page/(?P<name>.*)', 200)], 150)
+
+    def test_render(self):
+        metrics = Metrics(buckets=(0.1, 1.0))
+        metrics.observe_request('/"a"', 200, 0.05, 100)
+        metrics.observe_phase('parse', 0.001)
+        metrics.connection_opened()
+        metrics.add_gauge('pool_saturation', lambda: 0.5)
+        text = metrics.render()
+        self.assertIn('webserver_requests_total{route="/\\"a\\"",'
+                      'status="200"} 1', text)
+        self.assertIn('webserver_request_duration_seconds_bucket{route='
+                      '"/\\"a\\"",status="200",le="+Inf"} 1', text)
+        self.assertIn('webserver_response_bytes_total{route="/\\"a\\"",'
+                      'status="200"} 100', text)
+        self.assertIn('webserver_phase_duration_seconds_count{phase="parse"}'
+                      ' 1', text)
+        self.assertIn('webserver_active_connections 1', text)
+        self.assertIn('webserver_pool_saturation 0.5', text)
+
+
+class TestServerMetrics(unittest.TestCase):
+    def serve(self, app, data):
+        server, client = socket.socketpair()
+        with client:
+            client.sendall(data)
+            client.shutdown(socket.SHUT_WR)
+            app._handle_request(server, 'test')
+            return client.recv(65536)
+
+    def test_handle_request(self):
+        metrics = Metrics()
+        app = Webserver(metrics=metrics)
+
+        @app.route('/page/(?P<name>.*)')
+        def page(name):
+            return app.get(name)
+
+        self.serve(app, b'GET /page/a HTTP/1.1\r\n\r\n'
+                        b'GET /page/b HTTP/1.1\r\n\r\n'
+                        b'GET /missing HTTP/1.1\r\n\r\n')
+        snapshot = metrics.snapshot()
+        self.assertEqual(
+            snapshot['requests'][('/page/(?P<name>.*)', 200)]['count'], 2)
+        self.assertEqual(
+            snapshot['requests'][(UNMATCHED, 404)]['count'], 1)
+        self.assertGreater(
+            snapshot['bytes_sent'][('/page/(?P<name>.*)', 200)], 0)
+        self.assertEqual(snapshot['phases']['dispatch']['count'], 3)
+        self.assertEqual(snapshot['active_connections'], 0)
+        self.assertEqual(snapshot['gauges']['pool_queue_depth'], 0)
+
+    def test_expose_metrics(self):
+        app = Webserver(metrics=Metrics())
+        app.expose_metrics()
+        response = self.serve(app, b'GET /metrics HTTP/1.1\r\n'
+                                   b'Connection: close\r\n\r\n')
+        self.assertIn(b'text/plain; version=0.0.4', response)
+        self.assertIn(b'webserver_active_connections 1', response)
+
+    def test_expose_metrics_without_metrics(self):
+        with self.assertRaises(ValueError):
+            Webserver().expose_metrics()
+
+
+if __name__ == '__main__':
+    unittest.main()
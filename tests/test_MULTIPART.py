@@ -0,0 +1,81 @@
+import unittest
+import io
+import os
+import shutil
+import tempfile
+
+from multipart import parse_form, parse_multipart
+from errors import HTTPResponseError
+
+BOUNDARY = '----boundary42'
+
+
+def body(*parts):
+    data = b'preamble\r\n'
+    for headers, content in parts:
+        data += b'--' + BOUNDARY.encode() + b'\r\n' + headers + b'\r\n\r\n'
+        data += content + b'\r\n'
+    return data + b'--' + BOUNDARY.encode() + b'--\r\n'
+
+
+class SlowStream(io.BytesIO):
+    """Returns a few bytes per read, as a slow upload would"""
+
+    def read(self, size=-1):
+        return super().read(7)
+
+
+class TestMultipart(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.data = body(
+            (b'Content-Disposition: form-data; name="text"',
+             'привет'.encode()),
+            (b'Content-Disposition: form-data; name="upload"; '
+             b'filename="a.bin"\r\nContent-Type: application/octet-stream',
+             b'\r\n--' + b'x' * 100 + b'\r\n'),
+            (b'Content-Disposition: form-data; name="text"', b'second'))
+
+    def test_parse(self):
+        for stream in (io.BytesIO(self.data), SlowStream(self.data)):
+            form = parse_multipart(stream, BOUNDARY)
+            self.assertEqual(form.fields, {'text': ['привет', 'second']})
+            uploaded = form.get_file('upload')
+            self.assertEqual(uploaded.filename, 'a.bin')
+            self.assertEqual(uploaded.content_type,
+                             'application/octet-stream')
+            self.assertEqual(uploaded.size, 106)
+            self.assertEqual(uploaded.read(), b'\r\n--' + b'x' * 100 + b'\r\n')
+            form.close()
+
+    def test_spooled_and_saved(self):
+        content = os.urandom(300000)
+        data = body((b'Content-Disposition: form-data; name="f"; '
+                     b'filename="big.bin"', content))
+        form = parse_form(f'multipart/form-data; boundary="{BOUNDARY}"',
+                          io.BytesIO(data), spool_size=1024)
+        uploaded = form.get_file('f')
+        self.assertTrue(uploaded.file._rolled)
+        path = os.path.join(self.test_dir, 'saved.bin')
+        uploaded.save(path)
+        with open(path, 'rb') as file:
+            self.assertEqual(file.read(), content)
+        form.close()
+
+    def test_malformed(self):
+        for data in (self.data[:-20], b'no delimiter at all',
+                     body((b'Content-Disposition: form-data', b'no name'))):
+            with self.assertRaises(HTTPResponseError) as error:
+                parse_multipart(io.BytesIO(data), BOUNDARY)
+            self.assertEqual(error.exception.status, 400)
+
+    def test_missing_boundary(self):
+        with self.assertRaises(HTTPResponseError):
+            parse_form('multipart/form-data', io.BytesIO(self.data))
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
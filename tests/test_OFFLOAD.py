@@ -0,0 +1,134 @@
+import unittest
+import os
+import socket
+import threading
+import time
+
+from web import Webserver, Error as Errors
+from request import Request
+
+app = Webserver(process_workers=2, process_queue_size=2)
+
+
+@app.route('/pid/(?P<name>\\w+)', executor='process')
+def pid(name):
+    return app.get(f'{name} {app.request.url} {os.getpid()}')
+
+
+@app.route('/slow', executor='process', timeout=0.2)
+def slow():
+    time.sleep(0.6)
+    return app.get('slow')
+
+
+@app.route('/hang', executor='process', timeout=0.2)
+def hang():
+    time.sleep(60)
+
+
+@app.route('/nap', executor='process', timeout=5)
+def nap():
+    time.sleep(0.5)
+    return app.get('nap')
+
+
+@app.route('/rows', executor='process')
+def rows():
+    return (f'{i},row\n' for i in range(3))
+
+
+@app.route('/missing', executor='process')
+def missing():
+    raise Errors.NOT_FOUND_PAGE
+
+
+def call(url):
+    request = Request(f'GET {url} HTTP/1.1\r\n\r\n'.encode())
+    request.parse_request()
+    app.request = request
+    function, args, kwargs = app._match_route(request.url)
+    return function(*args, **kwargs)
+
+
+def tearDownModule():
+    app._offload.shutdown()
+
+
+class TestProcessOffload(unittest.TestCase):
+    def test_call(self):
+        response = call('/pid/bob')
+        name, url, worker = response.body.split()
+        self.assertEqual((name, url), (b'bob', b'/pid/bob'))
+        self.assertNotEqual(int(worker), os.getpid())
+        # Serialized in the worker process
+        self.assertTrue(response.head.startswith(b'HTTP/1.1 200 OK\r\n'))
+
+    def test_stream(self):
+        response = call('/rows')
+        self.assertEqual(response.body, b'0,row\n1,row\n2,row\n')
+        self.assertIn(b'Content-Length: 18\r\n', response.head)
+
+    def test_error(self):
+        with self.assertRaises(type(Errors.NOT_FOUND_PAGE)) as error:
+            call('/missing')
+        self.assertEqual(error.exception.status, 404)
+
+    def test_timeout(self):
+        self.assertEqual(call('/hang').status, 504)
+        # The stuck worker was killed, the capacity is back at once
+        self.assertEqual(app._offload.pending, 0)
+        started = time.monotonic()
+        for _ in range(3):
+            self.assertEqual(call('/pid/bob').status, 200)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(call('/hang').status, 504)
+        self.assertEqual(call('/pid/bob').status, 200)
+
+    def test_timeout_spares_others(self):
+        answers = []
+        thread = threading.Thread(target=lambda: answers.append(call('/nap')))
+        thread.start()
+        time.sleep(0.1)
+        self.assertEqual(call('/hang').status, 504)
+        thread.join()
+        # Only the worker of the timed out call was killed
+        self.assertEqual(answers[0].status, 200)
+        self.assertEqual(answers[0].body, b'nap')
+
+    def test_not_forked(self):
+        call('/pid/bob')
+        # Never forked from the threaded server process
+        self.assertNotEqual(app._offload._context.get_start_method(), 'fork')
+
+    def test_queue_size(self):
+        threads = [threading.Thread(target=call, args=('/slow',))
+                   for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        self.assertEqual(call('/pid/bob').status, 503)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(call('/pid/bob').status, 200)
+
+    def test_serve(self):
+        server, client = socket.socketpair()
+        with client:
+            client.sendall(b'GET /pid/alice HTTP/1.1\r\n\r\n')
+            client.shutdown(socket.SHUT_WR)
+            app._handle_request(server, 'test')
+            answer = b''.join(iter(lambda: client.recv(65536), b''))
+        self.assertTrue(answer.startswith(b'HTTP/1.1 200 OK\r\n'))
+        self.assertIn(b'\r\n\r\nalice /pid/alice ', answer)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            app.route('/thread', executor='thread')
+        with self.assertRaises(ValueError):
+            @app.route('/coroutine', executor='process')
+            async def coroutine():
+                pass
+
+
+if __name__ == "__main__":
+    unittest.main()
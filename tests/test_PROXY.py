@@ -0,0 +1,210 @@
+import unittest
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from proxy import Proxy
+from request import Request
+from web import Webserver
+from test_RESPONSE import dechunk
+
+
+class Backend(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        name = self.server.name.encode()
+        if self.path.endswith('/chunked'):
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for chunk in (b'one ', b'two'):
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+            return
+        if self.path == '/close':
+            self.send_response(200)
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.wfile.write(b'until the end')
+            self.close_connection = True
+            return
+        if self.path == '/slow':
+            time.sleep(0.5)
+        body = b'%s %d' % (name, self.client_address[1])
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Set-Cookie', 'a=1')
+        self.send_header('Set-Cookie', 'b=2')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        body += f' {self.headers["X-Forwarded-For"]}'.encode()
+        self.send_response(201)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_backend(name):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Backend)
+    server.daemon_threads = True
+    server.name = name
+    threading.Thread(target=server.serve_forever, args=(0.05,),
+                     daemon=True).start()
+    return server
+
+
+def make_request(data, address=('10.0.0.1', 4000)):
+    request = Request(data)
+    request.parse_request()
+    request.address = address
+    return request
+
+
+def read(response):
+    return b''.join(response.chunks) if response.chunks is not None \
+        else response.body
+
+
+def unused_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class TestProxy(unittest.TestCase):
+    def setUp(self):
+        self.backends = [start_backend('a'), start_backend('b')]
+        self.addresses = [f'127.0.0.1:{backend.server_address[1]}'
+                          for backend in self.backends]
+
+    def get(self, proxy, path):
+        return proxy.forward(make_request(
+            f'GET {path} HTTP/1.1\r\nHost: test\r\n\r\n'.encode()))
+
+    def test_pooled(self):
+        proxy = Proxy(self.addresses[0])
+        first = read(self.get(proxy, '/'))
+        second = read(self.get(proxy, '/'))
+        # The second request went through the pooled connection
+        self.assertEqual(first, second)
+        self.assertTrue(first.startswith(b'a '))
+        self.assertEqual(proxy.stats()[self.addresses[0]]['idle'], 1)
+        proxy.close()
+
+    def test_head(self):
+        proxy = Proxy(self.addresses[0])
+        response = self.get(proxy, '/')
+        self.assertEqual(response.status, 200)
+        self.assertIn(b'Set-Cookie: a=1\r\nSet-Cookie: b=2\r\n', response.head)
+        self.assertIn(b'Content-Length: ', response.head)
+        self.assertNotIn(b'Keep-Alive', response.head)
+        read(response)
+        proxy.close()
+
+    def test_chunked_and_close_delimited(self):
+        proxy = Proxy(self.addresses[0])
+        response = self.get(proxy, '/chunked')
+        self.assertEqual(response.headers['Transfer-Encoding'], 'chunked')
+        self.assertEqual(read(response), b'one two')
+        self.assertEqual(proxy.stats()[self.addresses[0]]['idle'], 1)
+        self.assertEqual(read(self.get(proxy, '/close')), b'until the end')
+        self.assertEqual(proxy.stats()[self.addresses[0]]['idle'], 0)
+        proxy.close()
+
+    def test_post(self):
+        proxy = Proxy(self.addresses[0])
+        response = proxy.forward(make_request(
+            b'POST /items HTTP/1.1\r\nContent-Length: 4\r\n'
+            b'X-Forwarded-For: 10.0.0.9\r\n\r\nitem'))
+        self.assertEqual(response.status, 201)
+        self.assertEqual(read(response), b'item 10.0.0.9, 10.0.0.1')
+        proxy.close()
+
+    def test_read_timeout(self):
+        proxy = Proxy(self.addresses[0], read_timeout=0.1)
+        self.assertEqual(self.get(proxy, '/slow').status, 504)
+        self.assertEqual(proxy.stats()[self.addresses[0]]['active'], 0)
+        proxy.close()
+
+    def test_ejection(self):
+        down = f'127.0.0.1:{unused_port()}'
+        proxy = Proxy([down, self.addresses[1]], max_fails=1,
+                      fail_timeout=30)
+        for _ in range(4):
+            self.assertTrue(read(self.get(proxy, '/')).startswith(b'b '))
+        self.assertTrue(proxy.stats()[down]['ejected'])
+        proxy.close()
+        proxy = Proxy(down, max_fails=1)
+        self.assertEqual(self.get(proxy, '/').status, 502)
+        self.assertEqual(self.get(proxy, '/').status, 502)
+        self.assertTrue(proxy.stats()[down]['ejected'])
+
+    def test_round_robin(self):
+        proxy = Proxy(self.addresses)
+        names = [read(self.get(proxy, '/'))[:1] for _ in range(4)]
+        self.assertEqual(names, [b'a', b'b', b'a', b'b'])
+        proxy.close()
+
+    def test_least_connections(self):
+        proxy = Proxy(self.addresses, balance='least_connections')
+        # The body of the first response is not read yet, its connection is
+        # still active
+        pending = self.get(proxy, '/')
+        names = {read(self.get(proxy, '/'))[:1] for _ in range(3)}
+        self.assertEqual(len(names), 1)
+        self.assertNotIn(read(pending)[:1], names)
+        proxy.close()
+
+    def test_idle_timeout(self):
+        proxy = Proxy(self.addresses[0], idle_timeout=0.05)
+        first = read(self.get(proxy, '/'))
+        time.sleep(0.1)
+        self.assertNotEqual(read(self.get(proxy, '/')), first)
+        proxy.close()
+
+    def test_pool_limit(self):
+        proxy = Proxy(self.addresses[0], max_connections=1,
+                      connect_timeout=0.1)
+        pending = self.get(proxy, '/')
+        self.assertEqual(self.get(proxy, '/').status, 504)
+        pending.chunks.close()
+        self.assertEqual(self.get(proxy, '/').status, 200)
+        proxy.close()
+
+    def test_route(self):
+        app = Webserver()
+        proxy = app.proxy('/api/.*', self.addresses[0])
+        server, client = socket.socketpair()
+        with client:
+            client.sendall(b'GET /api/chunked HTTP/1.1\r\n\r\n'
+                           b'GET /api/items HTTP/1.0\r\n\r\n')
+            client.shutdown(socket.SHUT_WR)
+            app._handle_request(server, ('10.0.0.1', 4000))
+            answer = b''.join(iter(lambda: client.recv(65536), b''))
+        first, second = answer.split(b'HTTP/1.1 200 OK\r\n')[1:]
+        self.assertIn(b'Transfer-Encoding: chunked\r\n', first)
+        self.assertEqual(dechunk(first.split(b'\r\n\r\n', 1)[1])[0],
+                         b'one two')
+        self.assertTrue(first.endswith(b'\r\n0\r\n\r\n'))
+        # A body of known length is sent as it is
+        self.assertIn(b'Content-Length: 7\r\n', second)
+        self.assertNotIn(b'Transfer-Encoding', second)
+        self.assertRegex(second, rb'\r\n\r\na \d+$')
+        proxy.close()
+
+    def tearDown(self):
+        for backend in self.backends:
+            backend.shutdown()
+            backend.server_close()
+
+
+if __name__ == "__main__":
+    unittest.main()
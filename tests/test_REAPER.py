@@ -0,0 +1,64 @@
+import unittest
+import socket
+import threading
+import time
+
+from reaper import Connection, Reaper
+
+
+class TestReaper(unittest.TestCase):
+    def setUp(self):
+        self.dispatched = []
+        self.expired = []
+        self.event = threading.Event()
+        self.reaper = Reaper(self.dispatch, self.expire, max_connections=2)
+        self.thread = threading.Thread(target=self.reaper.run, daemon=True)
+        self.thread.start()
+        self.sockets = []
+
+    def dispatch(self, connection):
+        self.dispatched.append(connection)
+        self.event.set()
+
+    def expire(self, connection):
+        self.expired.append(connection)
+        self.event.set()
+
+    def connection(self, timeout=10):
+        server, client = socket.socketpair()
+        self.sockets += [server, client]
+        return Connection(server, 'test', None,
+                          time.monotonic() + timeout), client
+
+    def test_dispatch_readable(self):
+        connection, client = self.connection()
+        self.reaper.park(connection)
+        client.sendall(b'GET')
+        self.assertTrue(self.event.wait(2))
+        self.assertEqual(self.dispatched, [connection])
+        self.assertEqual(len(self.reaper), 0)
+
+    def test_expire_deadline(self):
+        connection, _ = self.connection(timeout=0.1)
+        self.reaper.park(connection)
+        self.assertTrue(self.event.wait(2))
+        self.assertEqual(self.expired, [connection])
+
+    def test_expire_oldest_over_max_connections(self):
+        first, _ = self.connection()
+        self.reaper.park(first)
+        for _ in range(2):
+            connection, _ = self.connection()
+            self.reaper.park(connection)
+        self.assertTrue(self.event.wait(2))
+        self.assertEqual(self.expired, [first])
+
+    def tearDown(self):
+        self.reaper.stop()
+        self.thread.join(2)
+        for sock in self.sockets:
+            sock.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
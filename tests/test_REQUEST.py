@@ -0,0 +1,109 @@
+import unittest
+
+from web import Request, RequestParser, HTTPResponseError
+
+
+class TestRequest(unittest.TestCase):
+    def test_parse_request(self):
+        request = Request(b'GET /files/?page=2 HTTP/1.1\r\n'
+                          b'Host: localhost\r\n'
+                          b'Connection:keep-alive\r\n\r\n')
+        request.parse_request()
+        self.assertEqual(request.method, 'GET')
+        self.assertEqual(request.target, '/files/?page=2')
+        self.assertEqual(request.version, 'HTTP/1.1')
+        self.assertEqual(request.url, '/files')
+        self.assertEqual(request.query, 'page=2')
+        self.assertEqual(request.get_headers().get('connection'), 'keep-alive')
+        self.assertEqual(request.get_headers()['HOST'], 'localhost')
+
+    def test_parse_request_malformed(self):
+        request = Request(b'GET /\r\n\r\n')
+        with self.assertRaises(HTTPResponseError):
+            request.parse_request()
+
+
+class TestRequestParser(unittest.TestCase):
+    def test_feed_byte_by_byte(self):
+        data = (b'POST /form HTTP/1.1\r\nContent-Length: 5\r\n\r\nhello'
+                b'GET / HTTP/1.1\r\n\r\n')
+        parser = RequestParser()
+        for i in range(len(data)):
+            parser.feed(data[i:i + 1])
+        self.assertEqual(len(parser.requests), 2)
+        first, second = parser.requests
+        self.assertEqual((first.method, first.body), ('POST', b'hello'))
+        self.assertEqual((second.method, second.body), ('GET', b''))
+
+    def test_feed_chunked(self):
+        parser = RequestParser()
+        parser.feed(b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+                    b'5;ext=1\r\nhello\r\n6\r\n world\r\n0\r\n'
+                    b'Trailer: yes\r\n\r\n')
+        self.assertEqual(parser.requests.popleft().body, b'hello world')
+
+    def test_max_header_size(self):
+        parser = RequestParser(max_header_size=64)
+        with self.assertRaises(HTTPResponseError) as error:
+            parser.feed(b'GET / HTTP/1.1\r\nX-Long: ' + b'a' * 100)
+        self.assertEqual(error.exception.status, 431)
+
+    def test_max_headers(self):
+        parser = RequestParser(max_headers=2)
+        with self.assertRaises(HTTPResponseError):
+            parser.feed(b'GET / HTTP/1.1\r\nA: 1\r\nB: 2\r\nC: 3\r\n\r\n')
+
+    def test_body_spooled(self):
+        parser = RequestParser(spool_size=16)
+        parser.feed(b'POST / HTTP/1.1\r\nContent-Length: 40\r\n\r\n')
+        self.assertEqual(parser.state, 'body')
+        for _ in range(4):
+            parser.feed(b'0123456789')
+            # Received bytes leave the buffer as they arrive
+            self.assertEqual(len(parser._buffer), 0)
+        request = parser.requests.popleft()
+        self.assertTrue(request.stream._rolled)
+        self.assertEqual(request.stream.read(), b'0123456789' * 4)
+        self.assertEqual(request.body, b'0123456789' * 4)
+        request.close()
+
+    def test_chunked_split(self):
+        data = (b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+                b'a\r\n0123456789\r\n0\r\n\r\n')
+        parser = RequestParser()
+        for i in range(len(data)):
+            parser.feed(data[i:i + 1])
+        self.assertEqual(parser.requests.popleft().body, b'0123456789')
+
+    def test_max_body_size(self):
+        parser = RequestParser(max_body_size=10)
+        with self.assertRaises(HTTPResponseError) as error:
+            parser.feed(b'POST / HTTP/1.1\r\nContent-Length: 11\r\n\r\n')
+        self.assertEqual(error.exception.status, 413)
+
+        parser = RequestParser(max_body_size=10)
+        parser.feed(b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+                    b'6\r\n012345\r\n')
+        with self.assertRaises(HTTPResponseError) as error:
+            parser.feed(b'6\r\n')
+        self.assertEqual(error.exception.status, 413)
+
+    def test_expect_continue(self):
+        parser = RequestParser()
+        parser.feed(b'POST / HTTP/1.1\r\nContent-Length: 2\r\n'
+                    b'Expect: 100-continue\r\n\r\n')
+        self.assertTrue(parser.expect_continue)
+        parser.feed(b'ok')
+        self.assertFalse(parser.expect_continue)
+
+    def test_form_urlencoded(self):
+        request = Request(b'POST / HTTP/1.1\r\n'
+                          b'Content-Type: application/x-www-form-urlencoded'
+                          b'\r\n\r\ntext=a+b%21&text=c&empty=')
+        request.parse_request()
+        form = request.form()
+        self.assertEqual(form.fields, {'text': ['a b!', 'c'], 'empty': ['']})
+        self.assertEqual(form.get('text'), 'a b!')
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,96 +1,487 @@
-import unittest
-import tempfile
-import os
-import shutil
-from web import Response, Request
-
-
-class TestResponse(unittest.TestCase):
-    def setUp(self):
-        self.test_dir = tempfile.mkdtemp()
-
-    def test_status_code(self):
-        response = Response(200, "OK")
-        expected = f"HTTP/1.1 {response.status} {response.message}"
-        actual = response.status_code()
-        self.assertEqual(expected, actual)
-
-    def test_get_headers(self):
-        response = Response(200, "OK", headers={"Content-Length": 0})
-        expected = 'Content-Length: 0\r\n'
-        actual = response.get_headers()
-        self.assertEqual(expected, actual)
-
-    def test_response_file(self):
-        request = Request()
-
-        file = os.path.join(self.test_dir, 'test.html')
-        with open(file, 'wb') as f:
-            f.write(b'012345')
-
-        response = Response.response_file(request, file, 'text/html')
-        self.assertEqual(response.status, 200)
-        self.assertEqual(response.message, 'OK')
-        self.assertEqual(response.headers.get('Content-Length'), 6)
-        self.assertEqual(response.body, b'012345')
-
-    def test_response_file_range(self):
-        request = Request()
-        request.headers['Range'] = 'bytes=0-6'
-
-        file = os.path.join(self.test_dir, 'test.html')
-        with open(file, 'wb') as f:
-            f.write(b'012345')
-
-        response = Response.response_file(request, file, 'text/html')
-        self.assertEqual(response.status, 206)
-        self.assertEqual(response.message, 'Partial Content')
-        self.assertEqual(response.headers.get('Content-Length'), 6)
-        self.assertEqual(response.body, b'012345')
-
-    def test_response_file_range_without_start(self):
-        request = Request()
-        request.headers['Range'] = 'bytes=-3'
-
-        file = os.path.join(self.test_dir, 'test.html')
-        with open(file, 'wb') as f:
-            f.write(b'012345')
-
-        response = Response.response_file(request, file, 'text/html')
-        self.assertEqual(response.status, 206)
-        self.assertEqual(response.message, 'Partial Content')
-        self.assertEqual(response.headers.get('Content-Length'), 3)
-        self.assertEqual(response.body, b'345')
-
-    def test_response_file_range_withoud_end(self):
-        request = Request()
-        request.headers['Range'] = 'bytes=2-'
-
-        file = os.path.join(self.test_dir, 'test.html')
-        with open(file, 'wb') as f:
-            f.write(b'012345')
-
-        response = Response.response_file(request, file, 'text/html')
-        self.assertEqual(response.status, 206)
-        self.assertEqual(response.message, 'Partial Content')
-        self.assertEqual(response.headers.get('Content-Length'), 4)
-        self.assertEqual(response.body, b'2345')
-
-    def test_response_dir(self):
-        request = Request()
-
-        path = os.path.join(self.test_dir)
-        response = Response.response_dir(request, path)
-        act_body = b'<!DOCTYPE html><html>\n<head>\n<title>'
-        act_body += f'Listing for: {path}'.encode('utf-8')
-        act_body += b'</title>\n</head>\n</head>\n<body><h1>'
-        act_body += f'Listing for: {path}'.encode('utf-8')
-        act_body += b'</h1><hr>\n<ul><li><a  href="/" '
-        act_body += b'None>/</a></li>\n</ul>\n</body>\n</html>\n'
-        self.assertEqual(response.status, 200)
-        self.assertEqual(response.message, 'OK')
-        self.assertEqual(response.headers.get('Content-Length'), len(act_body))
-        self.assertEqual(response.body, act_body)
-
-    def tearDown(self):
-        shutil.rmtree(self.test_dir)
+import unittest
+import tempfile
+import os
+import shutil
+import socket
+import json
+import asyncio
+import threading
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import response as response_module
+from web import Response, Request, Error
+from response import send_buffers, ChunkPump
+
+
+def dechunk(body):
+    """Returns the payload and the chunk sizes of a chunked body"""
+    payload, sizes = b'', []
+    while True:
+        line, body = body.split(b'\r\n', 1)
+        size = int(line, 16)
+        if not size:
+            return payload, sizes
+        payload += body[:size]
+        sizes.append(size)
+        body = body[size + 2:]
+
+
+class TestResponse(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def test_status_code(self):
+        response = Response(200, "OK")
+        expected = f"HTTP/1.1 {response.status} {response.message}"
+        actual = response.status_code()
+        self.assertEqual(expected, actual)
+
+    def test_get_headers(self):
+        response = Response(200, "OK", headers={"Content-Length": 0})
+        expected = 'Content-Length: 0\r\n'
+        actual = response.get_headers()
+        self.assertEqual(expected, actual)
+
+    def test_serialize(self):
+        response = Response(200, "OK", headers={"Content-Length": 4},
+                            body=b'body')
+        expected = b'HTTP/1.1 200 OK\r\nContent-Length: 4\r\n\r\nbody'
+        self.assertEqual(response.serialize(), expected)
+
+    def test_send_buffers_partial(self):
+        class Client:
+            def __init__(self):
+                self.data = b''
+
+            def sendmsg(self, buffers):
+                chunk = b''.join(bytes(buffer) for buffer in buffers)[:3]
+                self.data += chunk
+                return len(chunk)
+
+        client = Client()
+        send_buffers(client, (b'head', b'', b'body'))
+        self.assertEqual(client.data, b'headbody')
+
+    def test_serialize_empty_body(self):
+        response = Response(200, "OK")
+        expected = b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n'
+        self.assertEqual(response.serialize(), expected)
+        response = Response(304, "Not Modified")
+        expected = b'HTTP/1.1 304 Not Modified\r\n\r\n'
+        self.assertEqual(response.serialize(), expected)
+
+    def test_serialize_head_error_cached(self):
+        connection = {'Connection': 'close'}
+        first = Response.serialize_head(Error.NOT_FOUND_PAGE, connection)
+        second = Response.serialize_head(Error.NOT_FOUND_PAGE, connection)
+        self.assertEqual(first, second)
+        self.assertIn(('Connection',), Error.NOT_FOUND_PAGE.heads)
+
+    def test_response_file(self):
+        request = Request()
+
+        file = os.path.join(self.test_dir, 'test.html')
+        with open(file, 'wb') as f:
+            f.write(b'012345')
+
+        response = Response.response_file(request, file, 'text/html')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.message, 'OK')
+        self.assertEqual(response.headers.get('Content-Length'), 6)
+        self.assertEqual(response.body, b'012345')
+
+    def test_response_file_streams_from_handle(self):
+        request = Request()
+        request.headers['Range'] = 'bytes=2-'
+
+        file = os.path.join(self.test_dir, 'test.html')
+        with open(file, 'wb') as f:
+            f.write(b'012345')
+
+        response = Response.response_file(request, file, 'text/html')
+        self.assertEqual((response.offset, response.length), (2, 4))
+        server, client = socket.socketpair()
+        with server, client:
+            response.response(server)
+            server.shutdown(socket.SHUT_WR)
+            answer = b''.join(iter(lambda: client.recv(1024), b''))
+        self.assertTrue(response.file.closed)
+        self.assertTrue(answer.endswith(b'\r\n\r\n2345'))
+
+    def test_response_file_range(self):
+        request = Request()
+        request.headers['Range'] = 'bytes=0-6'
+
+        file = os.path.join(self.test_dir, 'test.html')
+        with open(file, 'wb') as f:
+            f.write(b'012345')
+
+        response = Response.response_file(request, file, 'text/html')
+        self.assertEqual(response.status, 206)
+        self.assertEqual(response.message, 'Partial Content')
+        self.assertEqual(response.headers.get('Content-Length'), 6)
+        self.assertEqual(response.body, b'012345')
+
+    def test_response_file_range_without_start(self):
+        request = Request()
+        request.headers['Range'] = 'bytes=-3'
+
+        file = os.path.join(self.test_dir, 'test.html')
+        with open(file, 'wb') as f:
+            f.write(b'012345')
+
+        response = Response.response_file(request, file, 'text/html')
+        self.assertEqual(response.status, 206)
+        self.assertEqual(response.message, 'Partial Content')
+        self.assertEqual(response.headers.get('Content-Length'), 3)
+        self.assertEqual(response.body, b'345')
+
+    def test_response_file_range_withoud_end(self):
+        request = Request()
+        request.headers['Range'] = 'bytes=2-'
+
+        file = os.path.join(self.test_dir, 'test.html')
+        with open(file, 'wb') as f:
+            f.write(b'012345')
+
+        response = Response.response_file(request, file, 'text/html')
+        self.assertEqual(response.status, 206)
+        self.assertEqual(response.message, 'Partial Content')
+        self.assertEqual(response.headers.get('Content-Length'), 4)
+        self.assertEqual(response.body, b'2345')
+
+    def test_parse_ranges(self):
+        self.assertEqual(Response.parse_ranges('bytes=0-6', 6), [(0, 5)])
+        self.assertEqual(Response.parse_ranges('bytes=-3', 6), [(3, 5)])
+        self.assertEqual(Response.parse_ranges('bytes=2-', 6), [(2, 5)])
+        self.assertEqual(Response.parse_ranges('bytes=4-5, 0-1,1-2', 6),
+                         [(0, 2), (4, 5)])
+        self.assertEqual(Response.parse_ranges('bytes=6-9', 6), [])
+        self.assertIsNone(Response.parse_ranges('bytes=3-1', 6))
+        self.assertIsNone(Response.parse_ranges('items=0-1', 6))
+
+    def test_response_file_multiple_ranges(self):
+        request = Request()
+        request.headers['Range'] = 'bytes=0-1,4-'
+
+        file = os.path.join(self.test_dir, 'test.html')
+        with open(file, 'wb') as f:
+            f.write(b'012345')
+
+        response = Response.response_file(request, file, 'text/html')
+        boundary = response.headers['Content-Type'].split('boundary=')[1]
+        self.assertEqual(response.status, 206)
+        self.assertEqual(response.headers.get('Content-Length'),
+                         len(response.body))
+        self.assertEqual(response.body, (
+            f'--{boundary}\r\nContent-Type: text/html\r\n'
+            f'Content-Range: bytes 0-1/6\r\n\r\n01\r\n'
+            f'--{boundary}\r\nContent-Type: text/html\r\n'
+            f'Content-Range: bytes 4-5/6\r\n\r\n45\r\n'
+            f'--{boundary}--\r\n').encode('utf-8'))
+
+    def test_response_file_range_not_satisfiable(self):
+        request = Request()
+        request.headers['Range'] = 'bytes=6-'
+
+        file = os.path.join(self.test_dir, 'test.html')
+        with open(file, 'wb') as f:
+            f.write(b'012345')
+
+        response = Response.response_file(request, file, 'text/html')
+        self.assertEqual(response.status, 416)
+        self.assertEqual(response.headers.get('Content-Range'), 'bytes */6')
+
+    def test_response_file_if_range(self):
+        file = os.path.join(self.test_dir, 'test.html')
+        with open(file, 'wb') as f:
+            f.write(b'012345')
+        etag, _ = Response.validators(os.stat(file))
+
+        for if_range, status in ((etag, 206), ('"other"', 200)):
+            request = Request()
+            request.headers['Range'] = 'bytes=0-1'
+            request.headers['If-Range'] = if_range
+            response = Response.response_file(request, file, 'text/html')
+            response.close()
+            self.assertEqual(response.status, status)
+
+    def test_is_not_modified(self):
+        file = os.path.join(self.test_dir, 'test.html')
+        with open(file, 'wb') as f:
+            f.write(b'012345')
+        stat = os.stat(file)
+        etag, last_modified = Response.validators(stat)
+
+        cases = [({'If-None-Match': etag}, True),
+                 ({'If-None-Match': f'"other", W/{etag}'}, True),
+                 ({'If-None-Match': '"other"',
+                   'If-Modified-Since': last_modified}, False),
+                 ({'If-Modified-Since': last_modified}, True),
+                 ({'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'},
+                  False),
+                 ({}, False)]
+        for headers, expected in cases:
+            request = Request()
+            request.method = 'GET'
+            for header, header_value in headers.items():
+                request.headers[header] = header_value
+            self.assertEqual(
+                Response.is_not_modified(request, etag, stat.st_mtime),
+                expected)
+
+    def test_response_head_only(self):
+        response = Response(200, "OK", body=b'body')
+        server, client = socket.socketpair()
+        with server, client:
+            response.response(server, send_body=False)
+            server.shutdown(socket.SHUT_WR)
+            answer = b''.join(iter(lambda: client.recv(1024), b''))
+        self.assertEqual(answer,
+                         b'HTTP/1.1 200 OK\r\nContent-Length: 4\r\n\r\n')
+
+    def send(self, response, send_body=True):
+        server, client = socket.socketpair()
+        with server, client:
+            response.response(server, send_body=send_body)
+            server.shutdown(socket.SHUT_WR)
+            return b''.join(iter(lambda: client.recv(65536), b''))
+
+    def test_response_chunked(self):
+        def chunks():
+            yield b'first,'
+            yield ''
+            yield 'second'
+        response = Response(200, "OK", {'Transfer-Encoding': 'chunked'},
+                            chunks())
+        self.assertIsNone(response.body)
+        head, body = self.send(response).split(b'\r\n\r\n', 1)
+        self.assertEqual(head, b'HTTP/1.1 200 OK\r\n'
+                               b'Transfer-Encoding: chunked')
+        self.assertEqual(dechunk(body)[0], b'first,second')
+        self.assertTrue(body.endswith(b'\r\n0\r\n\r\n'))
+
+    def test_response_chunked_batches(self):
+        chunk = b'x' * 1000
+        size = response_module.CHUNK_FLUSH_SIZE
+        count = size // len(chunk) * 3
+        response = Response(200, "OK", {'Transfer-Encoding': 'chunked'},
+                            (chunk for _ in range(count)))
+        body = self.send(response).split(b'\r\n\r\n', 1)[1]
+        payload, sizes = dechunk(body)
+        self.assertEqual(payload, chunk * count)
+        batch = (size + len(chunk) - 1) // len(chunk) * len(chunk)
+        self.assertLessEqual(max(sizes), batch)
+
+    def test_response_chunks_in_calling_thread(self):
+        threads = []
+
+        def chunks():
+            for chunk in (b'first,', b'second'):
+                threads.append(threading.current_thread())
+                yield chunk
+        response = Response(200, "OK", {}, chunks())
+        self.assertTrue(self.send(response).endswith(b'\r\n\r\nfirst,second'))
+        self.assertEqual(threads, [threading.current_thread()] * 2)
+
+    def run_pump(self, chunks, steps):
+        """Runs steps(pump) in a loop whose executor has a single thread"""
+        async def main():
+            asyncio.get_running_loop().set_default_executor(executor)
+            return await steps(ChunkPump(chunks))
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return asyncio.run(main())
+
+    def test_chunk_pump(self):
+        variable = contextvars.ContextVar('variable')
+        variable.set('request')
+        threads = []
+
+        def chunks():
+            threads.append(threading.current_thread())
+            yield 'first '
+            yield ''
+            yield variable.get()
+
+        async def steps(pump):
+            batches = []
+            while not batches or batches[-1]:
+                batches.append(await pump.next_batch())
+            return b''.join(b''.join(batch) for batch in batches)
+        before = threading.active_count()
+        # The empty chunk is skipped, the iterator runs in the context
+        self.assertEqual(self.run_pump(chunks(), steps), b'first request')
+        # Advanced by the thread of the pool, no thread of its own
+        self.assertTrue(threads[0].name.startswith('ThreadPoolExecutor'))
+        self.assertEqual(threading.active_count(), before)
+
+    def test_chunk_pump_joins_produced(self):
+        chunk = b'x' * 1000
+        count = 20
+        produced = threading.Event()
+
+        def chunks():
+            yield from (chunk for _ in range(count))
+            produced.set()
+
+        async def steps(pump):
+            while not produced.is_set():
+                await asyncio.sleep(0.01)
+            return [len(await pump.next_batch()) for _ in range(3)]
+        # Every chunk waits, they are joined up to CHUNK_FLUSH_SIZE bytes
+        size = response_module.CHUNK_FLUSH_SIZE
+        first = (size + len(chunk) - 1) // len(chunk)
+        self.assertEqual(self.run_pump(chunks(), steps),
+                         [first, count - first, 0])
+
+    def test_chunk_pump_error(self):
+        def chunks():
+            yield b'first'
+            raise ValueError('broken')
+
+        async def steps(pump):
+            self.assertEqual(await pump.next_batch(), [b'first'])
+            with self.assertRaises(ValueError):
+                await pump.next_batch()
+        self.run_pump(chunks(), steps)
+
+    def test_chunk_pump_close(self):
+        entered, release = threading.Event(), threading.Event()
+        closed = []
+
+        def chunks():
+            try:
+                yield b'first'
+                entered.set()
+                release.wait(5)
+                yield b'second'
+            finally:
+                closed.append(True)
+
+        async def steps(pump):
+            await pump.next_batch()
+            while not entered.is_set():
+                await asyncio.sleep(0.01)
+            # Closed by the thread once the chunk is produced
+            pump.close()
+            self.assertEqual(closed, [])
+            release.set()
+        self.run_pump(chunks(), steps)
+        self.assertEqual(closed, [True])
+
+    def test_response_chunks_first_sent_at_once(self):
+        def chunks():
+            yield b'first\n'
+            time.sleep(0.5)
+            yield b'second\n'
+
+        async def async_chunks():
+            yield b'first\n'
+            await asyncio.sleep(0.5)
+            yield b'second\n'
+
+        for body in (chunks(), async_chunks()):
+            response = Response(200, "OK", {}, body)
+            server, client = socket.socketpair()
+            with server, client:
+                started = time.monotonic()
+                sender = threading.Thread(target=response.response,
+                                          args=(server,))
+                sender.start()
+                data = b''
+                while not data.endswith(b'first\n'):
+                    data += client.recv(65536)
+                elapsed = time.monotonic() - started
+                sender.join()
+            self.assertLess(elapsed, 0.25)
+
+    def test_response_async_chunks(self):
+        async def chunks():
+            for i in range(3):
+                yield str(i)
+        response = Response(200, "OK", {}, chunks())
+        self.assertEqual(self.send(response),
+                         b'HTTP/1.1 200 OK\r\n\r\n012')
+
+    def test_response_chunks_head_only(self):
+        closed = []
+
+        def chunks():
+            try:
+                yield b'body'
+            finally:
+                closed.append(True)
+        generator = chunks()
+        next(generator, None)
+        response = Response(200, "OK", {'Transfer-Encoding': 'chunked'},
+                            generator)
+        self.assertEqual(self.send(response, send_body=False),
+                         b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n'
+                         b'\r\n')
+        self.assertEqual(closed, [True])
+
+    def test_response_dir(self):
+        request = Request()
+
+        path = os.path.join(self.test_dir)
+        response = Response.response_dir(request, path)
+        act_body = b'<!DOCTYPE html><html>\n<head>\n<title>'
+        act_body += f'Listing for: {path}'.encode('utf-8')
+        act_body += b'</title>\n</head>\n</head>\n<body><h1>'
+        act_body += f'Listing for: {path}'.encode('utf-8')
+        act_body += b'</h1><hr>\n<ul><li><a  href="/" '
+        act_body += b'None>/</a></li>\n</ul>\n</body>\n</html>\n'
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.message, 'OK')
+        self.assertEqual(response.headers.get('Content-Length'), len(act_body))
+        self.assertEqual(response.body, act_body)
+
+    def test_response_dir_json(self):
+        request = Request()
+        request.query = 'format=json'
+        os.mkdir(os.path.join(self.test_dir, 'b'))
+        for name in ('c', 'a'):
+            with open(os.path.join(self.test_dir, name), 'wb'):
+                pass
+
+        response = Response.response_dir(request, self.test_dir)
+        listing = json.loads(response.body)
+        self.assertEqual(response.headers.get('Content-Type'),
+                         'application/json')
+        self.assertEqual(response.headers.get('Content-Length'),
+                         len(response.body))
+        self.assertEqual([entry['name'] for entry in listing['entries']],
+                         ['b', 'a', 'c'])
+        self.assertEqual(listing['entries'][0]['type'], 'dir')
+
+    def test_response_dir_pages(self):
+        page_size = response_module.LISTING_PAGE_SIZE
+        response_module.LISTING_PAGE_SIZE = 2
+        self.addCleanup(setattr, response_module, 'LISTING_PAGE_SIZE',
+                        page_size)
+        for name in ('a', 'b', 'c'):
+            with open(os.path.join(self.test_dir, name), 'wb'):
+                pass
+        request = Request()
+        request.query = 'format=json&page=2'
+
+        listing = json.loads(Response.response_dir(request,
+                                                   self.test_dir).body)
+        self.assertEqual((listing['page'], listing['pages']), (2, 2))
+        self.assertEqual(listing['entries'], [{'name': 'c', 'type': 'file'}])
+
+    def test_response_dir_cache_invalidated(self):
+        request = Request()
+        request.query = 'format=json'
+        Response.response_dir(request, self.test_dir)
+        with open(os.path.join(self.test_dir, 'new'), 'wb'):
+            pass
+        os.utime(self.test_dir, ns=(0, 1))
+
+        listing = json.loads(Response.response_dir(request,
+                                                   self.test_dir).body)
+        self.assertEqual(listing['entries'], [{'name': 'new', 'type': 'file'}])
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
@@ -0,0 +1,93 @@
+import unittest
+
+from router import Router
+
+
+class TestRouter(unittest.TestCase):
+    def setUp(self):
+        self.router = Router(cache_size=2)
+
+    def add(self, path):
+        def custom_function(*args, **kwargs):
+            return path, args, kwargs
+        self.router.add_route(path)(custom_function)
+        return custom_function
+
+    def test_resolve_literal(self):
+        function = self.add('/files/pictures/dog.jpg')
+        self.assertEqual(self.router.resolve('/files/pictures/dog.jpg'),
+                         (function, (), {}))
+        self.assertEqual(self.router.resolve('/files/pictures/dogxjpg'),
+                         (None, (), {}))
+
+    def test_resolve_named_groups(self):
+        self.add('/page/(?P<name>.*)')
+        hello = self.add('/hello/(?P<first>\\w+)/(?P<last>\\w+)')
+        self.assertEqual(self.router.resolve('/hello/John/Smith'),
+                         (hello, (), {'first': 'John', 'last': 'Smith'}))
+
+    def test_resolve_unnamed_groups(self):
+        self.add('/page/(?P<name>.*)')
+        item = self.add('/item/(\\d+)')
+        self.assertEqual(self.router.resolve('/item/42'), (item, ('42',), {}))
+
+    def test_resolve_order(self):
+        first = self.add('/a/(?P<name>.*)')
+        self.add('/a/(?P<other>b)')
+        literal = self.add('/a/c')
+        self.assertEqual(self.router.resolve('/a/b')[0], first)
+        self.assertEqual(self.router.resolve('/a/c')[0], literal)
+
+    def test_resolve_backreference(self):
+        double = self.add('/(\\w+)/\\1')
+        self.assertEqual(self.router.resolve('/x/x'), (double, ('x',), {}))
+        self.assertEqual(self.router.resolve('/x/y'), (None, (), {}))
+
+    def test_resolve_mixed_groups(self):
+        item = self.add('/item/(\\d+)/(?P<slug>\\w+)')
+        self.assertEqual(self.router.resolve('/item/42/dog'),
+                         (item, ('42',), {'slug': 'dog'}))
+
+    def test_resolve_inline_flags(self):
+        insensitive = self.add('(?i)/x/(?P<name>\\w+)')
+        page = self.add('/page/(?P<name>.*)')
+        self.assertEqual(self.router.resolve('/X/dog'),
+                         (insensitive, (), {'name': 'dog'}))
+        self.assertEqual(self.router.resolve('/page/a'),
+                         (page, (), {'name': 'a'}))
+
+    def test_resolve_alternation(self):
+        either = self.add('/a/b|/c/d')
+        self.assertEqual(self.router.resolve('/a/b')[0], either)
+        self.assertEqual(self.router.resolve('/c/d')[0], either)
+        self.assertEqual(self.router.resolve('/a/d')[0], None)
+
+    def test_resolve_quantified_slash(self):
+        optional = self.add('/a/?x')
+        self.assertEqual(self.router.resolve('/ax')[0], optional)
+        self.assertEqual(self.router.resolve('/a/x')[0], optional)
+
+    def test_resolve_order_standalone(self):
+        double = self.add('/(\\w+)/\\1')
+        later = self.add('/(?P<first>\\w+)/(?P<second>\\w+)')
+        self.assertEqual(self.router.resolve('/x/x')[0], double)
+        self.assertEqual(self.router.resolve('/x/y')[0], later)
+        self.router.set_routes({})
+        later = self.add('/(?P<first>\\w+)/(?P<second>\\w+)')
+        self.add('/(\\w+)/\\1')
+        self.assertEqual(self.router.resolve('/x/x')[0], later)
+
+    def test_add_route_clears_cache(self):
+        self.assertEqual(self.router.resolve('/new'), (None, (), {}))
+        function = self.add('/new')
+        self.assertEqual(self.router.resolve('/new'), (function, (), {}))
+
+    def test_cache_size(self):
+        self.add('/(?P<name>.*)')
+        for url in ('/a', '/b', '/c'):
+            self.router.resolve(url)
+        self.assertEqual(list(self.router._cache), ['/b', '/c'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+import tempfile
+import os
+import shutil
+
+from static import StaticIndex, content_type
+
+
+class TestStaticIndex(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.test_dir, 'root')
+        os.makedirs(os.path.join(self.root, 'pictures'))
+        self.make_file('index.html', b'index')
+        self.make_file(os.path.join('pictures', 'dog.jpg'), b'dog')
+        self.make_file('.secret', b'secret')
+        self.make_file(os.path.join('..', 'outside.txt'), b'outside')
+
+    def make_file(self, name, content):
+        path = os.path.join(self.root, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_lookup(self):
+        index = StaticIndex(self.root)
+        self.assertEqual(index.lookup('/pictures/dog.jpg'),
+                         (os.path.join(self.root, 'pictures', 'dog.jpg'),
+                          'image/jpeg'))
+        self.assertEqual(index.lookup('/pictures/')[1], None)
+        self.assertEqual(index.lookup(None), (os.path.realpath(self.root),
+                                              None))
+        self.assertEqual(index.lookup('/index.html')[1],
+                         'text/html; charset=utf-8')
+        self.assertIsNone(index.lookup('/pictures/cat.jpg'))
+
+    def test_traversal(self):
+        os.symlink(os.path.join(self.test_dir, 'outside.txt'),
+                   os.path.join(self.root, 'link.txt'))
+        index = StaticIndex(self.root, follow_symlinks=True)
+        for url in ('/../outside.txt', '/pictures/../../outside.txt',
+                    '/%2e%2e/outside.txt', '/.secret', '/link.txt',
+                    '/%ff'):
+            self.assertIsNone(index.lookup(url), url)
+
+    def test_symlink_inside(self):
+        os.symlink(os.path.join(self.root, 'pictures'),
+                   os.path.join(self.root, 'images'))
+        self.assertIsNone(StaticIndex(self.root).lookup('/images/dog.jpg'))
+        index = StaticIndex(self.root, follow_symlinks=True)
+        self.assertEqual(index.lookup('/images/dog.jpg')[1], 'image/jpeg')
+
+    def test_refresh(self):
+        index = StaticIndex(self.root, poll_interval=0)
+        self.assertIsNone(index.lookup('/pictures/pugs.png'))
+        self.make_file(os.path.join('pictures', 'pugs.png'), b'pugs')
+        # The next check sees the new mtime of the directory
+        os.utime(os.path.join(self.root, 'pictures'), ns=(0, 0))
+        self.assertEqual(index.lookup('/pictures/pugs.png')[1], 'image/png')
+
+    def test_content_type(self):
+        self.assertEqual(content_type('style.CSS'), 'text/css; charset=utf-8')
+        self.assertEqual(content_type('data.unknown'),
+                         'application/octet-stream')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,86 +1,601 @@
-import unittest
-import os
-import tempfile
-import shutil
-from web import Webserver, Errors
-
-
-class TestWebsever(unittest.TestCase):
-
-    def setUp(self):
-        self.test_dir = tempfile.mkdtemp()
-
-    def test_handle_file(self):
-        file = os.path.join(self.test_dir, 'test.html')
-        with open(file, 'wb') as f:
-            f.write(b'012345')
-
-        app = Webserver()
-        result = app.handle_file(file, self.test_dir)
-        self.assertEqual(result.status, 200)
-        self.assertEqual(result.message, "OK")
-        self.assertEqual(result.headers.get('Content-Length'), 6)
-        self.assertEqual(result.body, b'012345')
-
-    def test_handle_file_not_found(self):
-        app = Webserver()
-        result = app.handle_file(os.path.join(self.test_dir, 'not.found'))
-        self.assertEqual(result.status, Errors.NOT_FOUND_PAGE.status)
-        self.assertEqual(result.message, Errors.NOT_FOUND_PAGE.message)
-        self.assertEqual(result.body, Errors.NOT_FOUND_PAGE.body)
-
-    def test_handle_dir(self):
-        path = os.path.join(self.test_dir)
-
-        app = Webserver()
-        result = app.handle_dir(path)
-        act_body = b'<!DOCTYPE html><html>\n<head>\n<title>'
-        act_body += f'Listing for: {path}'.encode('utf-8')
-        act_body += b'</title>\n</head>\n</head>\n<body><h1>'
-        act_body += f'Listing for: {path}'.encode('utf-8')
-        act_body += b'</h1><hr>\n<ul><li><a  href="/" '
-        act_body += b'None>/</a></li>\n</ul>\n</body>\n</html>\n'
-        self.assertEqual(result.status, 200)
-        self.assertEqual(result.message, "OK")
-        self.assertEqual(result.headers.get('Content-Length'), len(act_body))
-        self.assertEqual(result.body, act_body)
-
-    def test_handle_dir_not_found(self):
-        app = Webserver()
-        result = app.handle_dir(os.path.join(self.test_dir, '/notfound'))
-        self.assertEqual(result.status, Errors.NOT_FOUND_PAGE.status)
-        self.assertEqual(result.message, Errors.NOT_FOUND_PAGE.message)
-        self.assertEqual(result.body, Errors.NOT_FOUND_PAGE.body)
-
-    def test_get(self):
-        body = 'body'
-        app = Webserver()
-        result = app.get(body)
-        self.assertEqual(result.status, 200)
-        self.assertEqual(result.message, "OK")
-        self.assertEqual(result.headers, {})
-        self.assertEqual(result.body, b'\r\nbody')
-
-    def test_post(self):
-        body = 'body'
-        app = Webserver()
-        result = app.post(body)
-        self.assertEqual(result.status, 200)
-        self.assertEqual(result.message, "OK")
-        self.assertEqual(result.headers, {'Content-Length': 4})
-        self.assertEqual(result.body, b'body')
-
-    def test_post_without_content_length(self):
-        body = ''
-        app = Webserver()
-        result = app.post(body)
-        self.assertEqual(result.status, Errors.LENGTH_REQUIRED.status)
-        self.assertEqual(result.message, Errors.LENGTH_REQUIRED.message)
-        self.assertEqual(result.body, Errors.LENGTH_REQUIRED.body)
-
-    def tearDown(self):
-        shutil.rmtree(self.test_dir)
-
-
-if __name__ == "__main__":
-    unittest.main()
+import unittest
+import os
+import re
+import sys
+import signal
+import subprocess
+import queue
+import tempfile
+import gzip
+import shutil
+import socket
+import asyncio
+import threading
+import time
+from web import Webserver, Request, Response, Error as Errors
+from limiter import ConcurrencyLimiter
+from compression import Compressor
+from test_RESPONSE import dechunk
+
+
+class TestWebsever(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def test_handle_file(self):
+        file = os.path.join(self.test_dir, 'test.html')
+        with open(file, 'wb') as f:
+            f.write(b'012345')
+
+        app = Webserver()
+        result = app.handle_file(file, self.test_dir)
+        self.assertEqual(result.status, 200)
+        self.assertEqual(result.message, "OK")
+        self.assertEqual(result.headers.get('Content-Length'), 6)
+        self.assertEqual(result.body, b'012345')
+
+    def test_handle_file_not_found(self):
+        app = Webserver()
+        result = app.handle_file(os.path.join(self.test_dir, 'not.found'))
+        self.assertEqual(result.status, Errors.NOT_FOUND_PAGE.status)
+        self.assertEqual(result.message, Errors.NOT_FOUND_PAGE.message)
+        self.assertEqual(result.body, Errors.NOT_FOUND_PAGE.body)
+
+    def test_handle_dir(self):
+        path = os.path.join(self.test_dir)
+
+        app = Webserver()
+        result = app.handle_dir(path)
+        act_body = b'<!DOCTYPE html><html>\n<head>\n<title>'
+        act_body += f'Listing for: {path}'.encode('utf-8')
+        act_body += b'</title>\n</head>\n</head>\n<body><h1>'
+        act_body += f'Listing for: {path}'.encode('utf-8')
+        act_body += b'</h1><hr>\n<ul><li><a  href="/" '
+        act_body += b'None>/</a></li>\n</ul>\n</body>\n</html>\n'
+        self.assertEqual(result.status, 200)
+        self.assertEqual(result.message, "OK")
+        self.assertEqual(result.headers.get('Content-Length'), len(act_body))
+        self.assertEqual(result.body, act_body)
+
+    def test_handle_dir_not_found(self):
+        app = Webserver()
+        result = app.handle_dir(os.path.join(self.test_dir, '/notfound'))
+        self.assertEqual(result.status, Errors.NOT_FOUND_PAGE.status)
+        self.assertEqual(result.message, Errors.NOT_FOUND_PAGE.message)
+        self.assertEqual(result.body, Errors.NOT_FOUND_PAGE.body)
+
+    def test_get(self):
+        body = 'body'
+        app = Webserver()
+        result = app.get(body)
+        self.assertEqual(result.status, 200)
+        self.assertEqual(result.message, "OK")
+        self.assertEqual(result.headers, {})
+        self.assertEqual(result.body, b'body')
+
+    def test_post(self):
+        body = 'body'
+        app = Webserver()
+        result = app.post(body)
+        self.assertEqual(result.status, 200)
+        self.assertEqual(result.message, "OK")
+        self.assertEqual(result.headers, {'Content-Length': 4})
+        self.assertEqual(result.body, b'body')
+
+    def test_post_without_content_length(self):
+        body = ''
+        app = Webserver()
+        result = app.post(body)
+        self.assertEqual(result.status, Errors.LENGTH_REQUIRED.status)
+        self.assertEqual(result.message, Errors.LENGTH_REQUIRED.message)
+        self.assertEqual(result.body, Errors.LENGTH_REQUIRED.body)
+
+    def test_unknown_overflow_policy(self):
+        with self.assertRaises(ValueError):
+            Webserver(overflow='drop')
+
+    def test_reject_answers_service_unavailable(self):
+        app = Webserver(workers=1, queue_size=0, overflow='reject',
+                        retry_after=5)
+        server, client = socket.socketpair()
+        app._reject(server)
+        with client:
+            answer = client.recv(1024)
+        self.assertTrue(answer.startswith(b'HTTP/1.1 503 '))
+        self.assertIn(b'Retry-After: 5\r\n', answer)
+
+    def test_find_custom_function_async(self):
+        app = Webserver()
+
+        @app.route('/async/(?P<name>.*)')
+        async def coroutine(name):
+            return app.get(name)
+
+        @app.route('/plain/(?P<name>.*)')
+        def plain(name):
+            return app.get(name)
+
+        for url in ('/async/body', '/plain/body'):
+            request = Request()
+            request.url = url
+            result = asyncio.run(app._find_custom_function_async(request))
+            self.assertEqual(result.status, 200)
+            self.assertEqual(result.body, b'body')
+
+    def test_find_custom_function_async_not_found(self):
+        app = Webserver()
+        request = Request()
+        request.url = '/missing'
+        result = asyncio.run(app._find_custom_function_async(request))
+        self.assertIsNone(result)
+
+    def test_request_per_thread(self):
+        app = Webserver()
+        started = threading.Barrier(2)
+        seen = {}
+
+        def handle(url):
+            request = Request()
+            request.url = url
+            app.request = request
+            started.wait()
+            seen[url] = app.request.url
+
+        threads = [threading.Thread(target=handle, args=(url,))
+                   for url in ('/a', '/b')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(seen, {'/a': '/a', '/b': '/b'})
+        self.assertIsNone(app.request.url)
+
+    def test_receive_pipelined(self):
+        server, client = socket.socketpair()
+        client.sendall(b'POST /a HTTP/1.1\r\nContent-Length: 2\r\n\r\nok'
+                       b'GET /b HTTP/1.1\r\n\r\n')
+        parser = Webserver()._make_parser()
+        with server, client:
+            self.assertTrue(Webserver._receive(server, parser))
+            first = parser.requests.popleft()
+            second = parser.requests.popleft()
+            # Nothing more sent yet, the read does not block
+            self.assertTrue(Webserver._receive(server, parser))
+            client.shutdown(socket.SHUT_WR)
+            self.assertFalse(Webserver._receive(server, parser))
+        self.assertEqual((first.url, first.body), ('/a', b'ok'))
+        self.assertEqual((second.url, second.body), ('/b', b''))
+
+    def test_header_timeout(self):
+        app = Webserver(header_timeout=0.2)
+        server, client = socket.socketpair()
+        with client:
+            client.sendall(b'GET / HTTP/1.1\r\nHost: slow')
+            app._handle_request(server, 'test')
+            answer = client.recv(1024)
+        self.assertTrue(answer.startswith(b'HTTP/1.1 408 '))
+        self.assertIn(b'Connection: close\r\n', answer)
+        self.assertEqual(server.fileno(), -1)
+
+    def test_header_timeout_async(self):
+        app = Webserver(header_timeout=0.1)
+
+        async def read():
+            reader = asyncio.StreamReader()
+            reader.feed_data(b'GET / HTTP/1.1\r\n')
+            return await app._read_request_async(reader, app._make_parser(),
+                                                 0)
+
+        with self.assertRaises(type(Errors.REQUEST_TIMEOUT)) as error:
+            asyncio.run(read())
+        self.assertEqual(error.exception.status, 408)
+
+    def test_keepalive_timeout_closes_silently(self):
+        app = Webserver(keepalive_timeout=0.2)
+
+        @app.route('/')
+        def index():
+            return app.get('index')
+
+        server, client = socket.socketpair()
+        with client:
+            client.sendall(b'GET / HTTP/1.1\r\n\r\n')
+            app._handle_request(server, 'test')
+            answer = client.recv(1024)
+            self.assertEqual(client.recv(1024), b'')
+        self.assertTrue(answer.startswith(b'HTTP/1.1 200 '))
+        self.assertNotIn(b'408', answer)
+
+    def serve(self, app, data):
+        server, client = socket.socketpair()
+        with client:
+            client.sendall(data)
+            client.shutdown(socket.SHUT_WR)
+            app._handle_request(server, 'test')
+            return b''.join(iter(lambda: client.recv(65536), b''))
+
+    def test_stream(self):
+        app = Webserver()
+
+        @app.route('/export')
+        def export():
+            return (f'{i},row\n' for i in range(3))
+
+        answer = self.serve(app, b'GET /export HTTP/1.1\r\n\r\n'
+                                 b'GET /export HTTP/1.0\r\n\r\n'
+                                 b'GET /export HTTP/1.1\r\n\r\n')
+        first, second = answer.split(b'HTTP/1.1 200 OK')[1:]
+        self.assertIn(b'Transfer-Encoding: chunked\r\n', first)
+        self.assertEqual(dechunk(first.split(b'\r\n\r\n', 1)[1])[0],
+                         b'0,row\n1,row\n2,row\n')
+        self.assertTrue(first.endswith(b'\r\n0\r\n\r\n'))
+        # HTTP/1.0 gets the raw body, delimited by closing the connection
+        self.assertNotIn(b'Transfer-Encoding', second)
+        self.assertIn(b'Connection: close\r\n', second)
+        self.assertTrue(second.endswith(b'\r\n\r\n0,row\n1,row\n2,row\n'))
+
+    def test_route_cache(self):
+        app = Webserver()
+        calls = []
+
+        @app.route('/hello/(?P<name>\\w+)', cache_ttl=30)
+        def hello(name):
+            calls.append(name)
+            return app.get(f'hello {name}')
+
+        request = b'GET /hello/bob HTTP/1.1\r\n\r\n'
+        answer = self.serve(app, request * 3)
+        self.assertEqual(answer.count(b'hello bob'), 3)
+        self.assertEqual(calls, ['bob'])
+        app.invalidate(url='/hello/bob')
+        self.serve(app, request)
+        self.assertEqual(calls, ['bob', 'bob'])
+        self.serve(app, b'POST /hello/bob HTTP/1.1\r\n'
+                        b'Content-Length: 0\r\n\r\n')
+        self.assertEqual(len(calls), 3)
+
+    def test_route_cache_compressed(self):
+        compressor = Compressor(min_size=10, cache_dir=os.path.join(
+            self.test_dir, 'compressed'))
+        app = Webserver(compressor=compressor)
+        compressed = []
+        original = compressor.compress
+
+        def compress(request, response):
+            result = original(request, response)
+            if result is not response:
+                compressed.append(result)
+            return result
+        compressor.compress = compress
+
+        @app.route('/page', cache_ttl=30)
+        def page():
+            return Response(200, "OK", {'Content-Type': 'text/html'},
+                            b'<p>page</p>' * 10)
+
+        gzip_request = (b'GET /page HTTP/1.1\r\n'
+                        b'Accept-Encoding: gzip\r\n\r\n')
+        answer = self.serve(app, gzip_request * 3)
+        self.assertEqual(answer.count(b'Content-Encoding: gzip\r\n'), 3)
+        body = answer.split(b'\r\n\r\n', 1)[1].split(b'HTTP/1.1')[0]
+        self.assertEqual(gzip.decompress(body), b'<p>page</p>' * 10)
+        # Compressed once, the hits are sent as they were memoized
+        self.assertEqual(len(compressed), 1)
+        # Another negotiated encoding is another entry
+        answer = self.serve(app, b'GET /page HTTP/1.1\r\n\r\n')
+        self.assertNotIn(b'Content-Encoding', answer)
+        self.assertTrue(answer.endswith(b'<p>page</p>' * 10))
+        self.assertEqual(app._caches['/page'].stats()['entries'], 2)
+
+    def test_static(self):
+        os.makedirs(os.path.join(self.test_dir, 'pages'))
+        with open(os.path.join(self.test_dir, 'pages', 'index.html'),
+                  'wb') as f:
+            f.write(b'<p>index</p>')
+        with open(os.path.join(self.test_dir, 'notes.txt'), 'wb') as f:
+            f.write(b'notes')
+        app = Webserver()
+        app.static('/files/', self.test_dir)
+
+        answer = self.serve(app, b'GET /files/notes.txt HTTP/1.1\r\n\r\n')
+        self.assertIn(b'Content-Type: text/plain; charset=utf-8\r\n', answer)
+        self.assertTrue(answer.endswith(b'\r\n\r\nnotes'))
+        answer = self.serve(app, b'GET /files/pages/ HTTP/1.1\r\n\r\n')
+        self.assertTrue(answer.endswith(b'<p>index</p>'))
+        answer = self.serve(app, b'GET /files HTTP/1.1\r\n\r\n')
+        self.assertIn(b'notes.txt', answer)
+        answer = self.serve(app, b'GET /files/../web.py HTTP/1.1\r\n\r\n')
+        self.assertTrue(answer.startswith(b'HTTP/1.1 404 '))
+
+    def test_static_listing_links(self):
+        root = os.path.join(self.test_dir, 'root')
+        os.makedirs(os.path.join(root, 'sub dir'))
+        with open(os.path.join(root, 'sub dir', 'a.txt'), 'wb') as f:
+            f.write(b'a')
+        app = Webserver()
+        app.static('/deep/mount', root)
+
+        def links(url):
+            answer = self.serve(app, f'GET {url} HTTP/1.1\r\n\r\n'.encode())
+            self.assertTrue(answer.startswith(b'HTTP/1.1 200 '))
+            return re.findall(r'href="([^"?]*)"', answer.decode())
+
+        directory, = links('/deep/mount')
+        self.assertEqual(directory, '/deep/mount/sub%20dir/')
+        # Followed from the listing, absolute under the prefix
+        parent, file = links(directory)
+        self.assertEqual(parent, '/deep/mount/')
+        self.assertEqual(links(parent), [directory])
+        self.assertEqual(file, '/deep/mount/sub%20dir/a.txt')
+        answer = self.serve(app, f'GET {file} HTTP/1.1\r\n\r\n'.encode())
+        self.assertTrue(answer.startswith(b'HTTP/1.1 200 '))
+        self.assertTrue(answer.endswith(b'\r\n\r\na'))
+
+    def test_limiter(self):
+        limiter = ConcurrencyLimiter(initial_limit=1, priority_headroom=1)
+        app = Webserver(limiter=limiter)
+
+        @app.route('/')
+        def index():
+            return app.get('index')
+
+        @app.route('/health', priority=True)
+        def health():
+            return app.get('ok')
+
+        self.assertTrue(self.serve(app, b'GET / HTTP/1.1\r\n\r\n')
+                        .startswith(b'HTTP/1.1 200 '))
+        # Every slot is taken
+        while limiter.acquire():
+            pass
+        answer = self.serve(app, b'GET / HTTP/1.1\r\n\r\n')
+        self.assertTrue(answer.startswith(b'HTTP/1.1 503 '))
+        self.assertIn(b'Retry-After: 1\r\n', answer)
+        self.assertTrue(self.serve(app, b'GET /health HTTP/1.1\r\n\r\n')
+                        .endswith(b'ok'))
+        self.assertEqual(limiter.stats()['in_flight'], limiter.limit)
+
+    def test_keep_alive(self):
+        app = Webserver(keepalive_requests=2)
+        cases = [(b'GET / HTTP/1.1\r\n\r\n', 1, True),
+                 (b'GET / HTTP/1.1\r\nConnection: close\r\n\r\n', 1, False),
+                 (b'GET / HTTP/1.0\r\n\r\n', 1, False),
+                 (b'GET / HTTP/1.0\r\nConnection: keep-alive\r\n\r\n', 1,
+                  True),
+                 (b'GET / HTTP/1.1\r\n\r\n', 2, False)]
+        for data, served, expected in cases:
+            request = Request(data)
+            request.parse_request()
+            self.assertEqual(app._keep_alive(request, served), expected)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+
+def read_response(client):
+    """Reads one response of a Content-Length delimited body"""
+    data = b''
+    while b'\r\n\r\n' not in data:
+        chunk = client.recv(65536)
+        if not chunk:
+            return data
+        data += chunk
+    head, body = data.split(b'\r\n\r\n', 1)
+    length = int(head.split(b'Content-Length: ')[1].split(b'\r\n')[0])
+    while len(body) < length:
+        body += client.recv(65536)
+    return head + b'\r\n\r\n' + body
+
+
+class TestServe(unittest.TestCase):
+    """Clients of a server started by run or run_async"""
+
+    def start(self, app, mode='run'):
+        thread = threading.Thread(target=getattr(app, mode), daemon=True)
+        thread.start()
+        deadline = time.monotonic() + 5
+        while app._server_address[1] == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        def stop():
+            app.stop()
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        self.addCleanup(stop)
+
+    def connect(self, app):
+        return socket.create_connection(app._server_address, timeout=5)
+
+    def make_app(self, **options):
+        app = Webserver(port=0, **options)
+
+        @app.route('/hello/(?P<name>\\w+)')
+        def hello(name):
+            return app.get(f'hello {name}')
+        return app
+
+    def test_keep_alive(self):
+        for mode in ('run', 'run_async'):
+            with self.subTest(mode=mode):
+                app = self.make_app()
+                self.start(app, mode)
+                with self.connect(app) as client:
+                    client.sendall(b'GET /hello/bob HTTP/1.1\r\n\r\n')
+                    first = read_response(client)
+                    time.sleep(0.1)
+                    if mode == 'run':
+                        # Handed back to the reaper between the requests
+                        self.assertEqual(len(app._reaper), 1)
+                    client.sendall(b'GET /hello/tom HTTP/1.1\r\n\r\n')
+                    second = read_response(client)
+                self.assertTrue(first.startswith(b'HTTP/1.1 200 OK\r\n'))
+                self.assertTrue(first.endswith(b'\r\n\r\nhello bob'))
+                self.assertTrue(second.endswith(b'\r\n\r\nhello tom'))
+
+    def test_stream_first_chunk(self):
+        for mode in ('run', 'run_async'):
+            with self.subTest(mode=mode):
+                app = self.make_app()
+
+                @app.route('/slow')
+                def slow():
+                    yield b'first\n'
+                    time.sleep(0.5)
+                    yield b'second\n'
+
+                self.start(app, mode)
+                with self.connect(app) as client:
+                    started = time.monotonic()
+                    client.sendall(b'GET /slow HTTP/1.1\r\n\r\n')
+                    data = b''
+                    while b'first\n' not in data:
+                        data += client.recv(65536)
+                    elapsed = time.monotonic() - started
+                    while not data.endswith(b'0\r\n\r\n'):
+                        data += client.recv(65536)
+                self.assertLess(elapsed, 0.25)
+                self.assertEqual(dechunk(data.split(b'\r\n\r\n', 1)[1])[0],
+                                 b'first\nsecond\n')
+
+    def test_header_timeout(self):
+        for mode in ('run', 'run_async'):
+            with self.subTest(mode=mode):
+                app = self.make_app(header_timeout=0.2)
+                self.start(app, mode)
+                with self.connect(app) as client:
+                    client.sendall(b'GET /hello/bob HTTP/1.1\r\n')
+                    answer = read_response(client)
+                    self.assertEqual(client.recv(1024), b'')
+                self.assertTrue(answer.startswith(b'HTTP/1.1 408 '))
+
+    def test_reject_overflow(self):
+        app = self.make_app(workers=1, queue_size=0, overflow='reject')
+        entered, release = threading.Event(), threading.Event()
+
+        @app.route('/slow')
+        def slow():
+            entered.set()
+            release.wait(5)
+            return app.get('slow')
+
+        self.start(app)
+        with self.connect(app) as busy, self.connect(app) as client:
+            busy.sendall(b'GET /slow HTTP/1.1\r\n\r\n')
+            self.assertTrue(entered.wait(5))
+            client.sendall(b'GET /hello/bob HTTP/1.1\r\n\r\n')
+            answer = read_response(client)
+            release.set()
+            self.assertTrue(read_response(busy).endswith(b'slow'))
+        self.assertTrue(answer.startswith(b'HTTP/1.1 503 '))
+        self.assertIn(b'Retry-After: 1\r\n', answer)
+
+    def test_block_overflow(self):
+        app = self.make_app(workers=1, queue_size=0, overflow='block')
+        entered, release = threading.Event(), threading.Event()
+
+        @app.route('/slow')
+        def slow():
+            entered.set()
+            release.wait(5)
+            return app.get('slow')
+
+        self.start(app)
+        busy = self.connect(app)
+        busy.sendall(b'GET /slow HTTP/1.1\r\n\r\n')
+        self.assertTrue(entered.wait(5))
+        clients = [self.connect(app) for _ in range(20)]
+        for client in clients:
+            client.sendall(b'GET /hello/bob HTTP/1.1\r\n\r\n')
+        time.sleep(0.3)
+        # The accept loop paused, the other clients wait in the backlog
+        self.assertLessEqual(len(app._ready), 1)
+        self.assertLessEqual(len(app._ready) + len(app._reaper), 1)
+        self.assertEqual(app._queue_depth(), len(app._ready))
+        release.set()
+        with busy:
+            self.assertTrue(read_response(busy).endswith(b'slow'))
+        for client in clients:
+            with client:
+                self.assertTrue(read_response(client).endswith(b'hello bob'))
+
+
+SUPERVISED = """
+import os
+from web import Webserver
+
+
+class Supervised(Webserver):
+    def _spawn(self):
+        pid = super()._spawn()
+        print(f'Spawned {pid}', flush=True)
+        return pid
+
+
+app = Supervised(port=0, workers=2)
+
+
+@app.route('/pid')
+def pid():
+    return app.get(str(os.getpid()))
+
+
+app.run(processes=2)
+"""
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'requires os.fork')
+class TestSupervise(unittest.TestCase):
+    """Worker processes of run(processes=2), in a subprocess"""
+
+    def start(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        process = subprocess.Popen([sys.executable, '-u', '-c', SUPERVISED],
+                                   cwd=root, stdout=subprocess.PIPE,
+                                   text=True)
+        lines = queue.Queue()
+
+        def read():
+            for line in process.stdout:
+                lines.put(line.strip())
+        threading.Thread(target=read, daemon=True).start()
+
+        def kill():
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            process.stdout.close()
+        self.addCleanup(kill)
+        return process, lambda: lines.get(timeout=10)
+
+    def get_pid(self, port):
+        with socket.create_connection(('localhost', port), timeout=5) as c:
+            c.sendall(b'GET /pid HTTP/1.1\r\nConnection: close\r\n\r\n')
+            return int(read_response(c).split(b'\r\n\r\n', 1)[1])
+
+    def test_supervise(self):
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            with self.subTest(signal=signum.name):
+                process, line = self.start()
+                port = int(line().rsplit(':', 1)[1])
+                first = int(line().split()[1])
+                second = int(line().split()[1])
+
+                # A crashed worker is replaced
+                os.kill(first, signal.SIGKILL)
+                self.assertTrue(line().startswith(f'Worker {first} exited'))
+                spawned = int(line().split()[1])
+                self.assertNotIn(spawned, (first, second))
+                for _ in range(4):
+                    self.assertIn(self.get_pid(port), (second, spawned))
+
+                # The signal is forwarded, every worker exits
+                os.kill(process.pid, signum)
+                self.assertEqual(process.wait(10), 0)
+                for worker in (second, spawned):
+                    with self.assertRaises(ProcessLookupError):
+                        os.kill(worker, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,253 +1,1157 @@
-import os
-import socket
-import re
-import chardet
-
-from concurrent.futures import ThreadPoolExecutor
-from collections import OrderedDict
-
-from router import Router
-from request import Request
-from response import Response
-from errors import Error
-from http.server import BaseHTTPRequestHandler, HTTPServer
-
-HTTP_METHODS = ('GET', ' POST')
-
-
-# TODO обработка keep-alive
-# TODO обработка conn
-# TODO stop
-# TODO обработка keep-alive
-
-
-class Webserver:
-    """The main class of this library. It is a web server.
-
-    Allows you to import a simple web server into the project for organizing
-    data storage, writing HTTP requests, and so on.
-
-    Attributes
-    ----------
-    host - Takes on the host value
-    port - Takes on the port value
-    hostname - Symbolic name assigned to the network device
-    max_workers - Max number of active connections
-    routes - A dictionary that includes all routes set by the user
-    regular_routes - A dictionary that includes all routes with regular
-                     expressions set by the user
-    request - Current request object
-    response - Current response object
-    pool - The worker thread pool of size "max_workers"
-    serv_socket - Socket of this server
-    server_address - Host and port pair
-
-    Methods
-    ----------
-    route - Decorator for functions of the user. Compiles the routes dictionary
-    make_regular_routes - Merges routes and regular_routes
-    run - Starts the web server. Starts processing new connections
-    handle_request - Main handler for new client connections
-    find_custom_function - Searches for user functions in regular_routes.
-                   Assigns the self.response value to the object
-    set_routes - Allows you to change the dictionary "self.routes"
-    get_routes - Allows you to get the dictionary "self.routes"
-    get - Executes an HTTP GET request
-    post - Executes an HTTP POST request
-    handle_file - Returns a file from a folder on the web server
-    handle_dir - Represents the selected directory as a list of directories.
-                 Allows you to download files"""
-
-    def __init__(self, host="localhost",
-                 port=8080,
-                 hostname='hostname',
-                 workers=os.cpu_count() - 1):
-        self._host: str = host
-        self._port: int = port
-        self._hostname: str = hostname
-        self._max_workers: int = workers
-        self._routes: Router = Router()
-        self._request: Request = Request()
-        self._response: Response = Response()
-        self._pool: list = []
-        self._serv_socket = None
-        self._server_address = self._host, self._port
-
-    def route(self, path):
-        return self._routes.add_route(path)
-
-    def run(self):
-        """NIY"""
-        self._serv_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._serv_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        # self._make_regular_routes()
-
-        # print(self._routes)
-        # print(self.regular_routes)
-
-        with self._serv_socket:
-            self._serv_socket.bind(self._server_address)
-            self._serv_socket.listen(self._max_workers)
-            print(f'Start server on {self._host}:{self._port}')
-
-            while True:
-                client, addr = self._serv_socket.accept()
-                print(f'Got client: {addr}')
-
-                # TODO
-                with ThreadPoolExecutor(max_workers=self._max_workers) as ex:
-                    if len(self._pool) < self._max_workers:
-                        self._pool.append(ex.submit(self._handle_request,
-                                                    client, addr))
-                for fut in self._pool:
-                    if fut.done():
-                        self._pool.remove(fut)
-
-    def _handle_request(self, client: socket.socket, address):
-        """Main handler"""
-        with client:
-            data_end = b'\r\n\r\n'
-            while True:
-                data = client.recv(1024)
-                if data:
-                    self.request = Request(data)
-                    self.request.parse_request()
-                    request_headers = self.request.get_headers()
-
-                    if request_headers.get('Connection') == 'keep-alive':
-                        client.setsockopt(socket.SOL_SOCKET,
-                                          socket.SO_KEEPALIVE, 1)
-
-                    self._response = (self._find_custom_function()
-                                      or Error.NOT_FOUND_PAGE)
-
-                    self._response.response(client)
-                    print(self._response)
-
-                if data_end in data:
-                    print(f'Disconnected: {address}')
-                    break
-
-    def _find_custom_function(self):
-        routes: dict = self._routes.get_routes()
-        for reg, custom_function in routes.items():
-            match = re.fullmatch(reg, self.request.url)
-            if match:
-                return custom_function() if len(
-                    match.groupdict().items()) == 0 else custom_function(
-                    match.group(1))
-
-    def get(self, body, headers=None, params=None):
-        body = ("\r\n" + body).encode('utf-8')
-        return Response(200, "OK", headers, body=body)
-
-    def post(self, body, headers=None, params=None):
-        body = body.encode('utf-8')
-        headers = {('Content-Length', len(body))}
-        headers = OrderedDict(headers)
-        response = Response(200, "OK", headers=headers, body=body)
-        if not headers['Content-Length'] or headers['Content-Length'] == 0:
-            response = Error.LENGTH_REQUIRED
-        return response
-
-    def handle_file(self, filename, root=os.getcwd(), content_type='*/*'):
-        path = os.path.join(root, filename)
-        if not os.path.exists(path):
-            return Error.NOT_FOUND_PAGE
-        return Response.response_file(self.request, path, content_type)
-
-    def handle_dir(self, dirname=os.getcwd()):
-        path = os.path.abspath(dirname)
-        if not os.path.exists(path):
-            return Error.NOT_FOUND_PAGE
-        return Response.response_dir(self.request, path)
-
-if __name__ == "__main__":
-    app = Webserver()
-
-
-    @app.route('/')
-    def start():
-        return app.handle_dir(os.getcwd())
-
-
-    @app.route('/files')
-    def files():
-        return app.handle_dir(os.path.join(os.getcwd(), 'files'))
-
-
-    @app.route('/files/documents')
-    def documents():
-        return app.handle_dir(os.path.join(os.getcwd(), 'files', 'documents'))
-
-
-    @app.route('/files/documents/pdffile.pdf')
-    def pdf():
-        return app.handle_file('pdffile.pdf',
-                               os.path.join(os.getcwd(), 'files', 'documents'))
-
-
-    @app.route('/files/documents/wordfile.docx')
-    def word():
-        return app.handle_file('wordfile.docx',
-                               os.path.join(os.getcwd(), 'files', 'documents'))
-
-
-    @app.route('/files/media')
-    def media():
-        return app.handle_dir(os.path.join(os.getcwd(), 'files', 'media'))
-
-
-    @app.route('/files/media/music.mp3')
-    def music():
-        return app.handle_file('music.mp3',
-                               os.path.join(os.getcwd(), 'files', 'media'))
-
-
-    @app.route('/files/pages')
-    def pages():
-        return app.handle_dir(os.path.join(os.getcwd(), 'files', 'pages'))
-
-
-    @app.route('/files/pages/index.html')
-    def index():
-        return app.handle_file('index.html',
-                               os.path.join(os.getcwd(), 'files', 'pages'))
-
-
-    @app.route('/files/pictures')
-    def pictures():
-        return app.handle_dir(os.path.join(os.getcwd(), 'files', 'pictures'))
-
-
-    @app.route('/files/pictures/dog.jpg')
-    def dog():
-        return app.handle_file('dog.jpg',
-                               root=os.path.join(os.getcwd(), 'files',
-                                                 'pictures'))
-
-
-    @app.route('/files/pictures/pugs.png')
-    def dog():
-        return app.handle_file('pugs.png',
-                               root=os.path.join(os.getcwd(), 'files',
-                                                 'pictures'))
-
-
-    @app.route('/page/(?P<name>.*)')
-    def page(name):
-        return app.get(f'Hello, {name}')
-
-
-    @app.route('/hello/(?P<name>.*)')
-    def func(name):
-        return app.get(f'Hello, {name}')
-
-
-    @app.route('/bigtext.txt')
-    def txt():
-        return app.handle_file('big_text.txt',
-                               root=os.path.join(os.getcwd()))
-
-
-    app.run()
+import os
+import re
+import asyncio
+import contextvars
+import functools
+import socket
+import select
+import signal
+import threading
+import time
+import traceback
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+
+from router import Router
+from request import Request, RequestParser
+from response import (Response, is_stream, ChunkPump,
+                      AsyncChunkPump, frame, LAST_CHUNK)
+from errors import Error, HTTPResponseError
+from cache import FileCache
+from compression import Compressor, is_compressible, negotiate
+from metrics import Metrics, UNMATCHED, REJECTED
+from reaper import Connection, Reaper
+from accesslog import AccessLog
+from memo import ResponseCache
+from static import StaticIndex
+from limiter import ConcurrencyLimiter
+from proxy import Proxy
+from offload import ProcessOffload
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+HTTP_METHODS = ('GET', ' POST')
+OVERFLOW_POLICIES = ('block', 'reject')
+EXECUTORS = (None, 'process')
+RECV_SIZE = 65536
+CONTINUE = b'HTTP/1.1 100 Continue\r\n\r\n'
+
+
+# TODO обработка conn
+
+
+class Webserver:
+    """The main class of this library. It is a web server.
+
+    Allows you to import a simple web server into the project for organizing
+    data storage, writing HTTP requests, and so on.
+
+    Attributes
+    ----------
+    host - Takes on the host value
+    port - Takes on the port value
+    hostname - Symbolic name assigned to the network device
+    max_workers - Max number of active connections
+    queue_size - Max number of accepted connections waiting for a worker
+    overflow - What to do when all workers and the queue are busy:
+               "block" stops accepting, "reject" answers 503
+    retry_after - Value of the Retry-After header of the 503 answer
+    keepalive_timeout - Seconds a persistent connection may stay idle
+    header_timeout - Seconds a client has to send a whole request head,
+                     counted from the connection or the first byte
+    body_timeout - Seconds a client has to send a whole request body
+    write_timeout - Seconds a send may block on a client not reading
+    max_connections - Max number of connections parked in the reaper
+    keepalive_requests - Max number of requests served on one connection
+    max_header_size - Max size of the request line and headers in bytes
+    max_headers - Max number of headers of one request
+    max_body_size - Max size of a request body in bytes, larger ones are
+                    answered 413. None for no limit
+    spool_size - Request bodies above this size are spooled to disk
+    file_cache - Optional FileCache serving hot files of handle_file
+                 from memory
+    compressor - Optional Compressor negotiating gzip and deflate bodies
+    metrics - Optional Metrics recording latency, status and bytes per
+              route, the phases of the requests and the pool saturation
+    access_log - Optional AccessLog the served requests are written to
+    limiter - Optional ConcurrencyLimiter answering 503 to the requests
+              over its adaptive limit or that waited too long for a worker
+    process_workers - Number of worker processes of the routes declared
+                      with executor="process", the number of cores if None
+    process_queue_size - Max number of calls of those routes queued or
+                         running, more are answered 503
+    offload - ProcessOffload of those routes, created with the first one
+    routes - A dictionary that includes all routes set by the user
+    caches - ResponseCache of every route declared with a "cache_ttl"
+    priority_routes - Paths of the routes the limiter favors
+    regular_routes - A dictionary that includes all routes with regular
+                     expressions set by the user
+    request - Request of the current connection. Kept in a context
+              variable, so every worker thread and asyncio task sees its own
+    pool - Futures of the connections admitted to the executor
+    executor - The worker thread pool of size "max_workers"
+    admitted - Number of connections holding a slot, at most
+               "max_workers" + "queue_size"
+    ready - Readable connections waiting for a slot in "block" mode, the
+            accept loop pauses while there are some or no slot is free
+    room - Condition of "pool_lock" notified when a slot is freed
+    reaper - Reaper watching the connections without data to serve
+    stopping - Event set by stop
+    loop - Event loop of run_async, None otherwise
+    stopped_async - asyncio.Event ending run_async
+    serv_socket - Socket of this server
+    server_address - Host and port pair, the bound port once serving
+
+    Methods
+    ----------
+    route - Decorator for functions of the user. Compiles the routes dictionary
+    invalidate - Forgets cached responses of one route, one url or all
+    static - Serves a directory tree under an url prefix
+    proxy - Forwards the requests of a route to upstream servers
+    make_regular_routes - Merges routes and regular_routes
+    run - Starts the web server. Starts processing new connections,
+          optionally in several worker processes
+    run_async - Starts the web server on an asyncio event loop
+    stop - Stops the server from another thread
+    expose_metrics - Adds a route answering the metrics in the Prometheus
+                     text format
+    handle_request - Serves a connection until it is closed, waiting for
+                     its data in the calling thread. Only used by the tests
+    serve_connection - Serves the requests a client has sent, returns
+                       whether the connection waits for more
+    receive - Reads what a client has sent without blocking, pipelined
+              requests stay in the parser of the connection
+    expire - Closes a connection past its deadline, with a 408 answer if
+             a request was due
+    keep_alive - Decides whether the connection persists after a request
+    handle_request_async - Main handler for connections of run_async
+    find_custom_function - Searches for user functions in regular_routes.
+                   Assigns the self.response value to the object
+    match_route - Returns the user function of the url and its positional
+                  and keyword arguments
+    set_routes - Allows you to change the dictionary "self.routes"
+    get_routes - Allows you to get the dictionary "self.routes"
+    get - Executes an HTTP GET request
+    post - Executes an HTTP POST request
+    stream - Returns a response streaming the chunks of an iterator, sent
+             with the chunked transfer coding
+    handle_file - Returns a file from a folder on the web server
+    handle_dir - Represents the selected directory as a list of directories.
+                 Allows you to download files"""
+
+    def __init__(self, host="localhost",
+                 port=8080,
+                 hostname='hostname',
+                 workers=max(os.cpu_count() - 1, 1),
+                 queue_size=None,
+                 overflow='block',
+                 retry_after=1,
+                 keepalive_timeout=5,
+                 header_timeout=10,
+                 body_timeout=30,
+                 write_timeout=30,
+                 max_connections=1024,
+                 keepalive_requests=100,
+                 max_header_size=65536,
+                 max_headers=100,
+                 max_body_size=1024 ** 3,
+                 spool_size=1024 * 1024,
+                 file_cache=None,
+                 compressor=None,
+                 metrics=None,
+                 access_log=None,
+                 limiter=None,
+                 process_workers=None,
+                 process_queue_size=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f'overflow must be one of {OVERFLOW_POLICIES}')
+        self._host: str = host
+        self._port: int = port
+        self._hostname: str = hostname
+        self._max_workers: int = workers
+        self._queue_size: int = workers if queue_size is None else queue_size
+        self._overflow: str = overflow
+        self._retry_after: int = retry_after
+        self._keepalive_timeout: float = keepalive_timeout
+        self._header_timeout: float = header_timeout
+        self._body_timeout: float = body_timeout
+        self._write_timeout: float = write_timeout
+        self._max_connections: int = max_connections
+        self._keepalive_requests: int = keepalive_requests
+        self._max_header_size: int = max_header_size
+        self._max_headers: int = max_headers
+        self._max_body_size: int = max_body_size
+        self._spool_size: int = spool_size
+        self._file_cache: FileCache = file_cache
+        self._compressor: Compressor = compressor
+        self._metrics: Metrics = metrics
+        self._access_log: AccessLog = access_log
+        self._limiter: ConcurrencyLimiter = limiter
+        self._process_workers: int = process_workers
+        self._process_queue_size: int = process_queue_size
+        self._offload: ProcessOffload = None
+        self._routes: Router = Router()
+        self._caches: dict = {}
+        self._priority_routes: set = set()
+        self._request: ContextVar = ContextVar(f'request_{id(self)}')
+        self._pool: set = set()
+        self._pool_lock = threading.Lock()
+        self._executor = None
+        self._admitted: int = 0
+        self._room = threading.Condition(self._pool_lock)
+        self._ready: deque = deque()
+        self._reaper = None
+        self._stopping = threading.Event()
+        self._loop = None
+        self._stopped_async = None
+        self._serv_socket = None
+        self._server_address = self._host, self._port
+        if metrics is not None:
+            metrics.add_gauge('pool_queue_depth', self._queue_depth)
+            metrics.add_gauge('pool_saturation', self._saturation)
+            if limiter is not None:
+                metrics.add_gauge('concurrency_limit', lambda: limiter.limit)
+                metrics.add_gauge('concurrency_in_flight',
+                                  lambda: limiter.in_flight)
+
+    def route(self, path, cache_ttl=None, cache_size=1024, cache_vary=(),
+              priority=False, executor=None, timeout=None):
+        """Decorator adding a user function for the url pattern "path".
+        Requests of a "priority" route get past the limiter under overload.
+
+        With "cache_ttl" the serialized 200 responses to GET and HEAD are
+        memoized for that many seconds, at most "cache_size" of them, keyed
+        by the url, the query and the request headers named in
+        "cache_vary".
+
+        With executor="process" the function runs in a worker process, it
+        must be defined at module level and its arguments and response are
+        pickled. A call not done within "timeout" seconds is answered 504."""
+        if executor not in EXECUTORS:
+            raise ValueError(f'executor must be one of {EXECUTORS}')
+        add_route = self._routes.add_route(path)
+        if priority:
+            self._priority_routes.add(path)
+        if cache_ttl is None and executor is None:
+            return add_route
+        cache = None
+        if cache_ttl is not None:
+            cache = self._caches[path] = ResponseCache(cache_ttl, cache_size,
+                                                       cache_vary)
+
+        def decorator(custom_function):
+            function = custom_function
+            if executor == 'process':
+                function = self._offloaded(function, timeout)
+            if cache is not None:
+                function = self._memoize(cache, function)
+            add_route(function)
+            return custom_function
+        return decorator
+
+    def _offloaded(self, custom_function, timeout=None):
+        """Wraps the user function to run it in a worker process"""
+        if asyncio.iscoroutinefunction(custom_function):
+            raise ValueError('coroutine functions can not run in a process')
+        if self._offload is None:
+            self._offload = ProcessOffload(self, self._process_workers,
+                                           self._process_queue_size)
+
+        @functools.wraps(custom_function)
+        def offloaded(*args, **kwargs):
+            return self._offload.call(custom_function, self.request, args,
+                                      kwargs, timeout)
+        return offloaded
+
+    def _memoize(self, cache, custom_function):
+        """Wraps the user function to answer from the cache when it can.
+        With a compressor the response is memoized compressed, one entry
+        per negotiated encoding, so a hit is not compressed again"""
+        compressor = self._compressor
+
+        def key_of(request):
+            key = cache.key(request)
+            if key is not None and compressor is not None:
+                key += (negotiate(
+                    request.get_headers().get('Accept-Encoding')),)
+            return key
+
+        def compressed(response):
+            if compressor is None or not isinstance(response, Response):
+                return response
+            return compressor.compress(self.request, response)
+
+        if asyncio.iscoroutinefunction(custom_function):
+            @functools.wraps(custom_function)
+            async def memoized(*args, **kwargs):
+                key = key_of(self.request)
+                if key is None:
+                    return await custom_function(*args, **kwargs)
+
+                async def compute():
+                    return compressed(await custom_function(*args, **kwargs))
+                return await cache.get_async(key, compute)
+            return memoized
+
+        @functools.wraps(custom_function)
+        def memoized(*args, **kwargs):
+            key = key_of(self.request)
+            if key is None:
+                return custom_function(*args, **kwargs)
+            return cache.get(key, lambda: compressed(
+                custom_function(*args, **kwargs)))
+        return memoized
+
+    def invalidate(self, path=None, url=None):
+        """Forgets the cached responses of the route "path", of the url
+        "url", or all of them"""
+        caches = (self._caches.values() if path is None
+                  else [self._caches[path]])
+        for cache in caches:
+            cache.invalidate(url)
+
+    def expose_metrics(self, path='/metrics'):
+        """Adds a route of "path" answering the metrics in the Prometheus
+        text format"""
+        if self._metrics is None:
+            raise ValueError('the server has no metrics')
+
+        def metrics():
+            body = self._metrics.render().encode()
+            headers = OrderedDict([
+                ('Content-Type', 'text/plain; version=0.0.4; charset=utf-8'),
+                ('Content-Length', len(body))])
+            return Response(200, "OK", headers, body)
+        self.route(path)(metrics)
+
+    def static(self, prefix, root, index='index.html', listing=True,
+               cache_control=None, poll_interval=2.0, follow_symlinks=False):
+        """Serves the tree of the directory "root" under the url "prefix"
+        with one route. Urls are resolved through a StaticIndex of the tree,
+        files go through handle_file with the content type of their
+        extension. A directory is answered with its "index" file if it has
+        one, else with its listing if "listing" is set. Returns the index"""
+        static_index = StaticIndex(root, poll_interval, follow_symlinks)
+        prefix = prefix.rstrip('/')
+
+        def serve(subpath=None):
+            entry = static_index.lookup(subpath)
+            if entry is None:
+                return Error.NOT_FOUND_PAGE
+            path, content_type = entry
+            if content_type is None and index:
+                entry = static_index.lookup(
+                    f'{(subpath or "").rstrip("/")}/{index}')
+                if entry is not None:
+                    path, content_type = entry
+            if content_type is None:
+                if not listing:
+                    return Error.NOT_FOUND_PAGE
+                # Links of the listing are absolute urls under the prefix
+                directory = (subpath or '').strip('/')
+                base = f'{prefix}/{directory}/' if directory else prefix + '/'
+                parent = None
+                if directory:
+                    parent = directory.rpartition('/')[0]
+                    parent = f'{prefix}/{parent}/' if parent else prefix + '/'
+                return self.handle_dir(path, cache_control, base, parent)
+            return self.handle_file(os.path.basename(path),
+                                    os.path.dirname(path), content_type,
+                                    cache_control)
+        self.route(re.escape(prefix) + '(?P<subpath>/.*)?')(serve)
+        return static_index
+
+    def proxy(self, path, upstreams, **options):
+        """Adds a route of "path" forwarding its requests to "upstreams",
+        "host:port" addresses, through a Proxy created with "options".
+        The responses are streamed back. Returns the proxy"""
+        upstream_proxy = Proxy(upstreams, **options)
+
+        def forward(*args, **kwargs):
+            return upstream_proxy.forward(self.request)
+        self.route(path)(forward)
+        return upstream_proxy
+
+    def _queue_depth(self):
+        """Connections waiting for a worker thread, admitted or ready"""
+        with self._pool_lock:
+            return (max(len(self._pool) - self._max_workers, 0)
+                    + len(self._ready))
+
+    def _saturation(self):
+        """Share of busy worker threads, from 0 to 1"""
+        with self._pool_lock:
+            return min(len(self._pool), self._max_workers) / self._max_workers
+
+    @property
+    def request(self) -> Request:
+        """The request being handled in the current context, an empty one
+        outside of a request"""
+        request = self._request.get(None)
+        return request if request is not None else Request()
+
+    @request.setter
+    def request(self, request: Request):
+        self._request.set(request)
+
+    def run(self, processes=1):
+        """Starts the web server.
+
+        Connections are handed to one long-lived thread pool. At most
+        "max_workers" + "queue_size" connections are admitted at a time,
+        the rest are handled according to the "overflow" policy: "block"
+        stops accepting until a slot is free, "reject" answers 503.
+
+        With "processes" > 1 the listening socket is shared by that many
+        forked worker processes, each with its own thread pool. The parent
+        process only supervises them."""
+        if processes > 1 and not hasattr(os, 'fork'):
+            raise ValueError('processes > 1 requires os.fork')
+        self._serv_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._serv_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+        with self._serv_socket:
+            self._serv_socket.bind(self._server_address)
+            self._serv_socket.listen(min(self._max_connections,
+                                         socket.SOMAXCONN))
+            self._server_address = self._serv_socket.getsockname()[:2]
+            print(f'Start server on {self._host}:{self._server_address[1]}')
+
+            if processes > 1:
+                self._supervise(processes)
+            else:
+                self._serve()
+
+    def _serve(self):
+        """Accept loop of one process. New connections go to the reaper,
+        they take a worker once the client has sent something"""
+        if self._offload is not None:
+            # Started now rather than on a busy request
+            self._offload.start()
+        self._reaper = Reaper(self._dispatch, self._expire,
+                              self._max_connections)
+        reaper = threading.Thread(target=self._reaper.run, daemon=True)
+        reaper.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self._max_workers) as ex:
+                self._executor = ex
+                while not self._stopping.is_set():
+                    if self._overflow == 'block':
+                        self._wait_for_room()
+                    try:
+                        client, addr = self._serv_socket.accept()
+                    except OSError:
+                        if self._stopping.is_set():
+                            break
+                        raise
+                    self._reaper.park(self._open(client, addr))
+        finally:
+            self._reaper.stop()
+            with self._pool_lock:
+                ready, self._ready = self._ready, deque()
+            for connection in ready:
+                self._close(connection)
+            if self._access_log is not None:
+                self._access_log.close()
+            if self._offload is not None:
+                self._offload.shutdown()
+
+    def _wait_for_room(self):
+        """Pauses the accept loop of the "block" mode while no slot is free,
+        new clients then wait in the listen backlog of the kernel"""
+        with self._room:
+            self._room.wait_for(lambda: self._stopping.is_set() or (
+                not self._ready and self._admitted
+                < self._max_workers + self._queue_size))
+
+    def stop(self):
+        """Stops the server started by run, in a single process, or by
+        run_async. The requests being served are completed, waiting
+        connections are closed"""
+        self._stopping.set()
+        with self._room:
+            self._room.notify_all()
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped_async.set)
+        elif self._serv_socket is not None:
+            try:
+                # Wakes up the blocked accept
+                self._serv_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _spawn(self):
+        """Forks a worker process serving the inherited listening socket"""
+        pid = os.fork()
+        if pid:
+            return pid
+        status = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            self._serve()
+        except KeyboardInterrupt:
+            pass
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        finally:
+            os._exit(status)
+
+    def _supervise(self, processes):
+        """Keeps "processes" workers alive until SIGTERM or SIGINT, which are
+        forwarded to the workers"""
+        workers = {}
+        stopping = False
+
+        def stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+            for worker in workers:
+                try:
+                    os.kill(worker, signum)
+                except ProcessLookupError:
+                    pass
+
+        previous = {signum: signal.signal(signum, stop)
+                    for signum in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            for _ in range(processes):
+                workers[self._spawn()] = time.monotonic()
+
+            while workers:
+                try:
+                    pid, status = os.wait()
+                except ChildProcessError:
+                    break
+                started = workers.pop(pid, None)
+                if stopping or started is None:
+                    continue
+                print(f'Worker {pid} exited with status {status}, restarting')
+                if time.monotonic() - started < 1:
+                    time.sleep(1)
+                workers[self._spawn()] = time.monotonic()
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+
+    def _dispatch(self, connection: Connection):
+        """Admits a connection the client has sent data on. Without a free
+        slot it waits in "ready" or is rejected, by the overflow policy"""
+        connection.queued = time.monotonic()
+        with self._pool_lock:
+            admitted = self._admitted < self._max_workers + self._queue_size
+            if admitted:
+                self._admitted += 1
+            elif self._overflow == 'block':
+                self._ready.append(connection)
+                return
+        if admitted:
+            self._submit(connection)
+        else:
+            self._reject(connection.client)
+            self._close(connection)
+
+    def _submit(self, connection: Connection):
+        """Hands an admitted connection to the executor. The admission slot
+        is released and the future forgotten once the worker is done"""
+        try:
+            future = self._executor.submit(self._work, connection)
+        except RuntimeError:
+            # The server stopped, its executor takes no more work
+            self._close(connection)
+            with self._room:
+                self._admitted -= 1
+                self._room.notify()
+            return
+        with self._pool_lock:
+            self._pool.add(future)
+        future.add_done_callback(self._release)
+
+    def _release(self, future):
+        """Passes the slot to the next ready connection or frees it"""
+        with self._room:
+            self._pool.discard(future)
+            connection = self._ready.popleft() if self._ready else None
+            if connection is None:
+                self._admitted -= 1
+                self._room.notify()
+        if connection is not None:
+            self._submit(connection)
+
+    def _work(self, connection: Connection):
+        """Task of a worker thread, the connection goes back to the reaper
+        once its client has nothing more to serve"""
+        if self._serve_connection(connection):
+            self._reaper.park(connection)
+
+    def _reject(self, client: socket.socket):
+        """Answers 503 to a client that could not be admitted, or whose
+        request the limiter refused"""
+        started = time.perf_counter()
+        with client:
+            try:
+                sent = self._unavailable().response(client)
+            except OSError:
+                sent = 0
+        self._observe_rejected(started, sent)
+
+    def _unavailable(self):
+        headers = OrderedDict([('Retry-After', self._retry_after),
+                               ('Content-Length', 0),
+                               ('Connection', 'close')])
+        return Response(503, 'Service Unavailable', headers, b'')
+
+    def _observe_rejected(self, started, sent):
+        if self._metrics is not None:
+            self._metrics.observe_request(
+                REJECTED, 503, time.perf_counter() - started, sent)
+
+    def _open(self, client: socket.socket, address):
+        """Wraps an accepted client into a connection, its first request
+        head is due within the header timeout"""
+        try:
+            # Heads, multipart boundaries and file bodies are separate
+            # writes, Nagle would delay them for the ACK of the client
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            pass
+        if self._metrics is not None:
+            self._metrics.connection_opened()
+        return Connection(client, address, self._make_parser(),
+                          time.monotonic() + self._header_timeout)
+
+    def _close(self, connection: Connection):
+        connection.client.close()
+        if self._metrics is not None:
+            self._metrics.connection_closed()
+
+    def _expire(self, connection: Connection):
+        """Closes a connection past its deadline. A client that was due to
+        send a request is answered 408, an idle persistent one is not"""
+        if connection.served == 0 or connection.parser.state is not None:
+            try:
+                connection.client.settimeout(0)
+                Response.response(Error.REQUEST_TIMEOUT, connection.client,
+                                  self._connection_headers(False))
+            except OSError:
+                pass
+        self._close(connection)
+
+    def _handle_request(self, client: socket.socket, address):
+        """Serves a connection until it is closed. Waits for the data of the
+        client in the calling thread instead of the reaper.
+
+        Not used by run, which goes through the reaper and the worker pool:
+        it lets the tests serve one end of a socketpair synchronously"""
+        connection = self._open(client, address)
+        while self._serve_connection(connection):
+            wait = connection.deadline - time.monotonic()
+            if wait <= 0 or not select.select([client], [], [], wait)[0]:
+                self._expire(connection)
+                break
+
+    def _serve_connection(self, connection: Connection):
+        """Serves the requests the client has sent without waiting for more.
+        Returns False once the connection is closed, True if it waits for
+        more data, with its deadline set for that wait"""
+        client, parser = connection.client, connection.parser
+        try:
+            while True:
+                if not parser.requests:
+                    state = parser.state
+                    if not self._receive(client, parser, self._metrics):
+                        self._close(connection)
+                        return False
+                    if parser.state != state:
+                        self._set_deadline(connection)
+                    if not parser.requests:
+                        return True
+                request = parser.requests.popleft()
+                request.address = connection.address
+                connection.served += 1
+                keep_alive = self._keep_alive(request, connection.served)
+                self.request = request
+                waited = 0.0
+                if connection.queued is not None:
+                    waited = time.monotonic() - connection.queued
+                    connection.queued = None
+                if not self._admit(request, waited):
+                    request.close()
+                    self._reject(client)
+                    self._close(connection)
+                    return False
+
+                started = time.perf_counter()
+                try:
+                    response, keep_alive = self._finish_response(
+                        request, self._find_custom_function(), keep_alive)
+                finally:
+                    dispatched = time.perf_counter()
+                    if self._limiter is not None:
+                        self._limiter.release(dispatched - started)
+
+                client.settimeout(self._write_timeout)
+                sent = Response.response(
+                    response, client, self._connection_headers(keep_alive),
+                    request.method != 'HEAD')
+                self._record(connection.address, request, response,
+                             started, dispatched, sent)
+                request.close()
+                if not keep_alive:
+                    self._close(connection)
+                    return False
+                self._set_deadline(connection)
+        except HTTPResponseError as error:
+            self._send_error(client, error)
+        except OSError:
+            # Reset by the client or past the write timeout
+            pass
+        except BaseException:
+            self._close(connection)
+            raise
+        self._close(connection)
+        return False
+
+    def _admit(self, request: Request, waited=0.0):
+        """Asks the limiter to admit the request, which waited "waited"
+        seconds for a worker"""
+        if self._limiter is None:
+            return True
+        route = self._routes.resolve_route(request.url)[0]
+        return self._limiter.acquire(route in self._priority_routes, waited)
+
+    def _set_deadline(self, connection: Connection):
+        connection.deadline = time.monotonic() + self._timeout(
+            connection.parser.state, connection.served)
+
+    def _timeout(self, state, served):
+        """Timeout of the next wait: idle between requests, the head or the
+        body timeout while one is being received. The first request of a
+        connection is due within the head timeout"""
+        if state == 'body':
+            return self._body_timeout
+        if state is None and served:
+            return self._keepalive_timeout
+        return self._header_timeout
+
+    def _record(self, address, request: Request, response, started,
+                dispatched, sent):
+        """Records a served request in the metrics and the access log. Its
+        latency runs from the dispatch to the end of the send, parsing is
+        recorded on its own"""
+        finished = time.perf_counter()
+        if self._metrics is not None:
+            route = self._routes.resolve_route(request.url)[0] or UNMATCHED
+            self._metrics.observe_phase('dispatch', dispatched - started)
+            self._metrics.observe_phase('send', finished - dispatched)
+            self._metrics.observe_request(route, response.status,
+                                          finished - started, sent)
+        if self._access_log is not None:
+            self._access_log.log(address, request, response.status, sent,
+                                 finished - started)
+
+    def _make_parser(self):
+        return RequestParser(self._max_header_size, self._max_headers,
+                             self._max_body_size, self._spool_size)
+
+    def _send_error(self, client: socket.socket, error: HTTPResponseError):
+        """Answers a malformed request, the connection is closed after it"""
+        try:
+            client.settimeout(self._write_timeout)
+            Response.response(error, client, self._connection_headers(False))
+        except OSError:
+            pass
+
+    @staticmethod
+    def _receive(client: socket.socket, parser: RequestParser,
+                 metrics: Metrics = None):
+        """Feeds the parser what the client has sent until a request is
+        complete or nothing more is available. Never blocks. Returns False
+        once the client has closed the connection"""
+        client.settimeout(0)
+        while not parser.requests:
+            try:
+                data = client.recv(RECV_SIZE)
+            except BlockingIOError:
+                return True
+            if not data:
+                return False
+            started = time.perf_counter()
+            parser.feed(data)
+            if metrics is not None:
+                metrics.observe_phase('parse', time.perf_counter() - started)
+            if parser.expect_continue:
+                parser.expect_continue = False
+                try:
+                    client.send(CONTINUE)
+                except BlockingIOError:
+                    # The client sends the body after a delay anyway
+                    pass
+        return True
+
+    def _keep_alive(self, request: Request, served: int):
+        """HTTP/1.1 connections persist unless the client asks to close them,
+        HTTP/1.0 ones only if the client asks to keep them alive"""
+        if served >= self._keepalive_requests:
+            return False
+        connection = request.get_headers().get('Connection', '').lower()
+        if request.version == 'HTTP/1.1':
+            return connection != 'close'
+        return connection == 'keep-alive'
+
+    def _connection_headers(self, keep_alive: bool):
+        if not keep_alive:
+            return {'Connection': 'close'}
+        return {'Connection': 'keep-alive',
+                'Keep-Alive': f'timeout={self._keepalive_timeout}'}
+
+    async def _serve_async(self):
+        if self._offload is not None:
+            self._offload.start()
+        loop = asyncio.get_running_loop()
+        self._stopped_async = asyncio.Event()
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            self._executor = executor
+            loop.set_default_executor(executor)
+            server = await asyncio.start_server(self._handle_request_async,
+                                                self._host, self._port,
+                                                reuse_address=True)
+            self._server_address = server.sockets[0].getsockname()[:2]
+            print(f'Start server on {self._host}:{self._server_address[1]}')
+            self._loop = loop
+            if self._stopping.is_set():
+                self._stopped_async.set()
+            try:
+                async with server:
+                    await self._stopped_async.wait()
+            finally:
+                self._loop = None
+                if self._access_log is not None:
+                    self._access_log.close()
+                if self._offload is not None:
+                    self._offload.shutdown()
+
+    def run_async(self):
+        """Starts the web server on an asyncio event loop.
+
+        Every connection is a coroutine instead of a thread, so idle and slow
+        clients cost a few kilobytes each. "async def" routes run on the
+        loop, plain routes are offloaded to a pool of "max_workers" threads"""
+        asyncio.run(self._serve_async())
+
+    async def _handle_request_async(self, reader: asyncio.StreamReader,
+                                    writer: asyncio.StreamWriter):
+        """Main handler of run_async"""
+        address = writer.get_extra_info('peername')
+        metrics = self._metrics
+        if metrics is not None:
+            metrics.connection_opened()
+        parser = self._make_parser()
+        served = 0
+        try:
+            while True:
+                request = await self._read_request_async(
+                    reader, parser, served, metrics, writer)
+                if request is None:
+                    break
+                request.address = address
+                served += 1
+                keep_alive = self._keep_alive(request, served)
+                self.request = request
+                if not self._admit(request):
+                    request.close()
+                    started = time.perf_counter()
+                    data = self._unavailable().serialize()
+                    writer.write(data)
+                    self._observe_rejected(started, len(data))
+                    break
+
+                started = time.perf_counter()
+                try:
+                    response, keep_alive = self._finish_response(
+                        request,
+                        await self._find_custom_function_async(request),
+                        keep_alive)
+                finally:
+                    dispatched = time.perf_counter()
+                    if self._limiter is not None:
+                        self._limiter.release(dispatched - started)
+                sent = await self._send_async(
+                    writer, response, self._connection_headers(keep_alive),
+                    request.method != 'HEAD', self._write_timeout)
+                self._record(address, request, response, started,
+                             dispatched, sent)
+                request.close()
+                if not keep_alive:
+                    break
+        except HTTPResponseError as error:
+            writer.write(Response.serialize(
+                error, self._connection_headers(False)))
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+            if metrics is not None:
+                metrics.connection_closed()
+
+    @staticmethod
+    async def _send_async(writer: asyncio.StreamWriter, response,
+                          connection_headers, send_body=True,
+                          write_timeout=None):
+        """Writes the response, a file body goes through loop.sendfile.
+        Every drain may take "write_timeout" seconds. Returns the number of
+        bytes sent"""
+        file = getattr(response, 'file', None)
+        head = Response.serialize_head(response, connection_headers)
+        if getattr(response, 'chunks', None) is not None:
+            return await Webserver._send_chunks_async(
+                writer, response, head, send_body, write_timeout)
+        if file is None or not send_body:
+            body = b''
+            if file is None and send_body:
+                body = response.body or b''
+            writer.writelines((head, body))
+            await asyncio.wait_for(writer.drain(), write_timeout)
+            if file is not None:
+                file.close()
+            return len(head) + len(body)
+        try:
+            writer.write(head)
+            sent = len(head)
+            for segment in response.file_segments():
+                if not isinstance(segment, tuple):
+                    writer.write(segment)
+                    sent += len(segment)
+                elif segment[1]:
+                    await asyncio.wait_for(writer.drain(), write_timeout)
+                    sent += await asyncio.get_running_loop().sendfile(
+                        writer.transport, file, *segment)
+            await asyncio.wait_for(writer.drain(), write_timeout)
+            return sent
+        finally:
+            file.close()
+
+    @staticmethod
+    async def _send_chunks_async(writer: asyncio.StreamWriter, response,
+                                 head, send_body, write_timeout):
+        """Streams the body batch by batch through a pump, each drained
+        before the next is taken. A synchronous iterator is advanced by the
+        thread pool of the server, in the context of the request, so it may
+        block"""
+        chunked = response.headers.get('Transfer-Encoding') == 'chunked'
+        chunks = response.chunks
+        pump = None
+        try:
+            writer.write(head)
+            sent = len(head)
+            await asyncio.wait_for(writer.drain(), write_timeout)
+            if not send_body:
+                return sent
+            if hasattr(chunks, '__anext__'):
+                pump = AsyncChunkPump(chunks)
+            else:
+                pump = ChunkPump(chunks)
+            while True:
+                batch = await pump.next_batch()
+                if not batch:
+                    break
+                buffers = frame(batch, chunked)
+                writer.writelines(buffers)
+                sent += sum(len(buffer) for buffer in buffers)
+                await asyncio.wait_for(writer.drain(), write_timeout)
+            if chunked:
+                writer.write(LAST_CHUNK)
+                sent += len(LAST_CHUNK)
+                await asyncio.wait_for(writer.drain(), write_timeout)
+            return sent
+        finally:
+            if isinstance(pump, AsyncChunkPump):
+                await pump.close()
+            elif pump is not None:
+                pump.close()
+            elif hasattr(chunks, 'aclose'):
+                await chunks.aclose()
+            elif hasattr(chunks, 'close'):
+                chunks.close()
+
+    async def _read_request_async(self, reader: asyncio.StreamReader,
+                                  parser: RequestParser, served: int,
+                                  metrics: Metrics = None,
+                                  writer: asyncio.StreamWriter = None):
+        """Returns the next request or None once the client has closed the
+        connection or let it idle. A request not received in time raises
+        REQUEST_TIMEOUT"""
+        loop = asyncio.get_running_loop()
+        state = parser.state
+        deadline = loop.time() + self._timeout(state, served)
+        while not parser.requests:
+            try:
+                data = await asyncio.wait_for(reader.read(RECV_SIZE),
+                                              max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                if served and state is None:
+                    return None
+                raise Error.REQUEST_TIMEOUT
+            if not data:
+                return None
+            started = time.perf_counter()
+            parser.feed(data)
+            if metrics is not None:
+                metrics.observe_phase('parse', time.perf_counter() - started)
+            if parser.expect_continue and writer is not None:
+                parser.expect_continue = False
+                writer.write(CONTINUE)
+            if parser.state != state:
+                state = parser.state
+                deadline = loop.time() + self._timeout(state, served)
+        return parser.requests.popleft()
+
+    async def _find_custom_function_async(self, request: Request):
+        custom_function, args, kwargs = self._match_route(request.url)
+        if custom_function is None:
+            return None
+        if asyncio.iscoroutinefunction(custom_function):
+            return await custom_function(*args, **kwargs)
+        # The executor thread runs in a copy of this task's context, which
+        # carries the request
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, functools.partial(contextvars.copy_context().run,
+                                    custom_function, *args, **kwargs))
+
+    def _finish_response(self, request: Request, response, keep_alive=True):
+        """Turns the result of the user function into the response to send.
+        Returns it with whether the connection may persist after it: a
+        streamed body of unknown length goes chunked to HTTP/1.1 clients,
+        the end of the connection ends it for older ones"""
+        response = response or Error.NOT_FOUND_PAGE
+        if is_stream(response):
+            response = self.stream(response)
+        if getattr(response, 'chunks', None) is not None:
+            if 'Content-Length' in response.headers:
+                pass
+            elif request.version == 'HTTP/1.1':
+                response.headers['Transfer-Encoding'] = 'chunked'
+            else:
+                keep_alive = False
+        elif self._compressor is not None:
+            response = self._compressor.compress(request, response)
+        return response, keep_alive
+
+    def _match_route(self, url):
+        return self._routes.resolve(url)
+
+    def _find_custom_function(self):
+        custom_function, args, kwargs = self._match_route(self.request.url)
+        if custom_function is not None:
+            return custom_function(*args, **kwargs)
+
+    def get(self, body, headers=None, params=None):
+        body = body.encode('utf-8')
+        return Response(200, "OK", headers, body=body)
+
+    def stream(self, chunks, content_type='text/plain; charset=utf-8',
+               headers=None):
+        """Returns a response streaming the chunks of an iterator, generator
+        or asynchronous generator. Chunks may be bytes or str"""
+        response_headers = OrderedDict([('Content-Type', content_type)])
+        response_headers.update(headers or {})
+        return Response(200, "OK", response_headers, chunks)
+
+    def post(self, body, headers=None, params=None):
+        body = body.encode('utf-8')
+        headers = {('Content-Length', len(body))}
+        headers = OrderedDict(headers)
+        response = Response(200, "OK", headers=headers, body=body)
+        if not headers['Content-Length'] or headers['Content-Length'] == 0:
+            response = Error.LENGTH_REQUIRED
+        return response
+
+    def handle_file(self, filename, root=os.getcwd(), content_type='*/*',
+                    cache_control=None):
+        """Returns the file. The ETag and Last-Modified validators come from
+        one stat call and a request they satisfy is answered 304 without
+        opening the file"""
+        path = os.path.join(root, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return Error.NOT_FOUND_PAGE
+        ranged = 'Range' in self.request.get_headers()
+        headers = {}
+        if (self._compressor is not None and not ranged
+                and is_compressible(content_type)):
+            headers['Vary'] = 'Accept-Encoding'
+            variant = self._compressor.file_variant(self.request, path, stat,
+                                                    content_type)
+            if variant is not None:
+                path, headers['Content-Encoding'] = variant
+                stat = os.stat(path)
+        headers['ETag'], headers['Last-Modified'] = Response.validators(stat)
+        if cache_control is not None:
+            headers['Cache-Control'] = cache_control
+        if Response.is_not_modified(self.request, headers['ETag'],
+                                    stat.st_mtime):
+            return Response(304, 'Not Modified', headers)
+        if self._file_cache is not None and not ranged:
+            response = self._file_cache.get(path, content_type, stat, headers)
+            if response is not None:
+                return response
+        return Response.response_file(self.request, path, content_type,
+                                      **headers)
+
+    def handle_dir(self, dirname=os.getcwd(), cache_control=None, base=None,
+                   parent=None):
+        """Returns the listing of the directory, validated by the mtime of the
+        directory like handle_file. "base" and "parent" are the urls of the
+        directory and of its parent, see Response.response_dir"""
+        path = os.path.abspath(dirname)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return Error.NOT_FOUND_PAGE
+        request_headers = self.request.get_headers()
+        variant = (f'{self.request.url}?{self.request.query}'
+                   f'|{request_headers.get("Accept", "")}')
+        headers = {}
+        headers['ETag'], headers['Last-Modified'] = Response.validators(
+            stat, variant)
+        if cache_control is not None:
+            headers['Cache-Control'] = cache_control
+        if Response.is_not_modified(self.request, headers['ETag'],
+                                    stat.st_mtime):
+            return Response(304, 'Not Modified', headers)
+        return Response.response_dir(self.request, path, base, parent,
+                                     **headers)
+
+if __name__ == "__main__":
+    app = Webserver(access_log=AccessLog())
+
+
+    @app.route('/')
+    def start():
+        return app.handle_dir(os.getcwd())
+
+
+    app.static('/files', os.path.join(os.getcwd(), 'files'))
+
+
+    @app.route('/page/(?P<name>.*)')
+    def page(name):
+        return app.get(f'Hello, {name}')
+
+
+    @app.route('/hello/(?P<name>.*)')
+    def func(name):
+        return app.get(f'Hello, {name}')
+
+
+    @app.route('/bigtext.txt')
+    def txt():
+        return app.handle_file('big_text.txt',
+                               root=os.path.join(os.getcwd()))
+
+
+    app.run()